@@ -5,32 +5,40 @@ import re
 import uuid
 
 SERVER_URL = "http://localhost:5000"  # Replace with your server URL
+QUEUE_WAIT = 30  # Seconds the server may hold a queue request open
+RETRY_DELAY = 10  # Seconds to wait after a failed request
 # Replace with your device's MAC address
 DEVICE_MAC_ADDRESS = ':'.join(re.findall('..', '%012x' % uuid.getnode()))
 print("Device running with MAC address: ", DEVICE_MAC_ADDRESS)
 
-def fetch_script_queue():
+def claim_next_script():
+    # Long-poll: the server answers as soon as a script is queued
     try:
-        response = requests.get(
-            f"{SERVER_URL}/api/scripts-queue/{DEVICE_MAC_ADDRESS}")
+        response = requests.post(
+            f"{SERVER_URL}/api/claim-script/{DEVICE_MAC_ADDRESS}",
+            params={'wait': QUEUE_WAIT}, timeout=QUEUE_WAIT + 10)
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 204:
+            return {}
         else:
-            print(f"Failed to fetch script queue: {response.status_code}")
+            print(f"Failed to claim script: {response.status_code}")
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching script queue: {e}")
+        print(f"Error claiming script: {e}")
         return None
 
 
-def dequeue_script(script_name):
+def report_result(item_id, succeeded, result):
+    outcome = "complete" if succeeded else "fail"
     try:
         response = requests.post(
-            f"{SERVER_URL}/api/dequeue-script/{DEVICE_MAC_ADDRESS}", json={'name': script_name})
+            f"{SERVER_URL}/api/{outcome}-script/{DEVICE_MAC_ADDRESS}",
+            json={'id': item_id, 'result': result})
         if response.status_code != 200:
-            print(f"Failed to dequeue script: {response.status_code}")
+            print(f"Failed to report script result: {response.status_code}")
     except requests.exceptions.RequestException as e:
-        print(f"Error dequeuing script: {e}")
+        print(f"Error reporting script result: {e}")
 
 
 def execute_script(script_content):
@@ -38,8 +46,10 @@ def execute_script(script_content):
         # Execute the script content as a Python script
         exec(script_content)
         print("Script executed successfully")
+        return True, None
     except Exception as e:
         print(f"Error executing script: {e}")
+        return False, str(e)
 
 
 def send_ping():
@@ -57,16 +67,15 @@ def main():
         # Send a ping to the server
         send_ping()
 
-        # Fetch and execute scripts from the server
-        script_queue = fetch_script_queue()
-        if script_queue:
-            for script_info in script_queue:
-                script_name = script_info.get("name")
-                script_content = script_info.get("content")
-                print(f"Executing script: {script_name}")
-                execute_script(script_content)
-                dequeue_script(script_name)
-        time.sleep(10)  # Request every 10 seconds
+        # Claim and execute the next script from the server
+        script_info = claim_next_script()
+        if script_info is None:
+            time.sleep(RETRY_DELAY)
+            continue
+        if script_info:
+            print(f"Executing script: {script_info.get('name')}")
+            succeeded, result = execute_script(script_info.get("content"))
+            report_result(script_info.get("id"), succeeded, result)
 
 
 if __name__ == "__main__":
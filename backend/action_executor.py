@@ -0,0 +1,161 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    """A sequence of actions and the index of the next one to run."""
+
+    __slots__ = ('actions', 'index')
+
+    def __init__(self, actions: List[Dict[str, Any]], index: int = 0):
+        self.actions = actions
+        self.index = index
+
+
+class ActionExecutor:
+    """Runs automation and scene actions off the caller's thread.
+
+    Action sequences are queued to a bounded pool of worker threads. A
+    ``delay`` action does not block a worker: the rest of the sequence is
+    parked on a timer heap and re-queued when it is due. Scenes can fan out
+    over several workers with a per-scene concurrency limit.
+    """
+
+    def __init__(self, run_action: Callable[[Dict[str, Any]], bool],
+                 workers: int = 4, queue_size: int = 1000):
+        self._run_action = run_action
+        self._workers = workers
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._delayed = []
+        self._delayed_cv = threading.Condition()
+        self._sequence = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._app = None
+        self.scene_concurrency = 4
+
+        self._stats_lock = threading.Lock()
+        self._active = 0
+        self._stats = {'submitted': 0, 'completed': 0,
+                       'failed': 0, 'rejected': 0}
+
+    def init_app(self, app) -> None:
+        """Bind to an app and start the worker and timer threads."""
+        if self._threads:
+            return
+        self._app = app
+        self._workers = app.config.get('ACTION_WORKERS', self._workers)
+        self._queue = queue.Queue(maxsize=app.config.get(
+            'ACTION_QUEUE_SIZE', self._queue.maxsize))
+        self.scene_concurrency = app.config.get(
+            'SCENE_MAX_CONCURRENCY', self.scene_concurrency)
+
+        for i in range(self._workers):
+            self._start_thread(self._work, f'action-worker-{i}')
+        self._start_thread(self._release_delayed, 'action-timer')
+
+    def submit(self, actions: List[Dict[str, Any]]) -> bool:
+        """Queue a sequence of actions to run in order.
+
+        The sequence stops at the first action that fails.
+
+        Returns:
+            bool: False if the queue is full and the sequence was dropped
+        """
+        if not actions:
+            return True
+        try:
+            self._queue.put_nowait(_Job(list(actions)))
+        except queue.Full:
+            self._count('rejected')
+            logger.warning("Action queue full, dropping action sequence")
+            return False
+        self._count('submitted')
+        return True
+
+    def submit_parallel(self, actions: List[Dict[str, Any]], limit: Optional[int] = None) -> bool:
+        """Queue actions to run concurrently, at most ``limit`` at a time.
+
+        The actions are dealt round-robin into ``limit`` sequences, so a
+        large fan-out never takes more than ``limit`` workers.
+        """
+        limit = max(1, min(limit or self.scene_concurrency, len(actions)))
+        lanes = [actions[i::limit] for i in range(limit)]
+        return all([self.submit(lane) for lane in lanes])
+
+    def metrics(self) -> Dict[str, int]:
+        """Get queue depth and throughput counters."""
+        with self._delayed_cv:
+            delayed = len(self._delayed)
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'delayed': delayed,
+                'active': self._active,
+                'workers': self._workers,
+                **self._stats
+            }
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _count(self, stat: str, delta: int = 1):
+        with self._stats_lock:
+            self._stats[stat] += delta
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._stats_lock:
+                self._active += 1
+            try:
+                with self._app.app_context():
+                    self._run(job)
+            except Exception as e:
+                self._count('failed')
+                logger.error(f"Error running action sequence: {str(e)}")
+            finally:
+                with self._stats_lock:
+                    self._active -= 1
+                self._queue.task_done()
+
+    def _run(self, job: _Job):
+        for index in range(job.index, len(job.actions)):
+            action = job.actions[index]
+            if action.get('type') == 'delay':
+                # Park the rest of the sequence instead of sleeping
+                job.index = index + 1
+                self._schedule(job, action.get('duration', 0))
+                return
+            if not self._run_action(action):
+                self._count('failed')
+                return
+        self._count('completed')
+
+    def _schedule(self, job: _Job, delay: float):
+        with self._delayed_cv:
+            heapq.heappush(self._delayed, (time.monotonic() + delay,
+                                           next(self._sequence), job))
+            self._delayed_cv.notify()
+
+    def _release_delayed(self):
+        while True:
+            with self._delayed_cv:
+                while not self._delayed:
+                    self._delayed_cv.wait()
+                due = self._delayed[0][0] - time.monotonic()
+                if due > 0:
+                    self._delayed_cv.wait(due)
+                    continue
+                _, _, job = heapq.heappop(self._delayed)
+            # Blocking put: a delayed job has already been accepted
+            self._queue.put(job)
@@ -1,17 +1,51 @@
-from flask import Flask, request, jsonify
-from flask_socketio import SocketIO
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import device_manager
+import device_io
+import json_codec
+import repository
+import realtime
+from realtime import event_batcher
+from heartbeat import heartbeats
+from device_versions import device_versions
+from queue_notifier import queue_notifier
+from device_registry import device_registry
+from change_bus import change_bus
+from event_store import event_store
+from state_sink import state_sink
+from state_history import state_history
+from telemetry import telemetry, RESOLUTIONS
+from trigger_index import trigger_index
+from automation_engine import action_executor
+from time_scheduler import time_scheduler
+from protocols.adapter_registry import adapter_registry
 import logging
 from models import db, User, Device
 from config import config
-from auth import requires_roles, device_access_required, validate_registration_data, init_admin_user
+from auth import requires_roles, device_access_required, authorize_devices, get_current_principal, get_current_device, validate_registration_data, init_admin_user
+from principal_cache import principals
 import os
+from datetime import datetime, timedelta, timezone
+
+
+def _utc_arg(name):
+    """Parse an ISO 8601 query argument as a naive UTC datetime, if given.
+
+    Raises:
+        ValueError: If the argument is not a valid timestamp
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
 
 
 def create_app(config_name='default'):
@@ -20,14 +54,20 @@ def create_app(config_name='default'):
 
     # Initialize extensions
     db.init_app(app)
+    json_codec.init_app(app)
+    repository.init_app(app)
+    change_bus.init_app(app)
+    principals.init_app(app)
     CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ORIGINS']}})
-    socketio = SocketIO(app, cors_allowed_origins=app.config['CORS_ORIGINS'])
     jwt = JWTManager(app)
     limiter = Limiter(
         app=app,
         key_func=get_remote_address,
         storage_uri=app.config['RATELIMIT_STORAGE_URL']
     )
+    # Limited routes only hold a weak reference to the limiter, and with
+    # RATELIMIT_ENABLED off it registers nothing on the app to keep it alive
+    app.extensions.setdefault('limiter', set()).add(limiter)
 
     # Set up logging
     logging.basicConfig(
@@ -44,6 +84,19 @@ def create_app(config_name='default'):
     with app.app_context():
         db.create_all()
         init_admin_user(app)
+    device_registry.init_app(app)
+    trigger_index.init_app(app)
+    device_versions.init_app(app)
+    queue_notifier.init_app(app)
+    event_store.init_app(app)
+    state_history.init_app(app)
+    telemetry.init_app(app)
+    heartbeats.init_app(app)
+    state_sink.init_app(app)
+    adapter_registry.init_app(app)
+    action_executor.init_app(app)
+    time_scheduler.init_app(app, action_executor.submit)
+    realtime.init_socketio(app)
 
     # Authentication routes
     @app.route('/api/auth/register', methods=['POST'])
@@ -107,7 +160,7 @@ def create_app(config_name='default'):
     @requires_roles('admin')
     @limiter.limit("30/minute")
     def get_users():
-        users = User.query.all()
+        users = repository.list_users()
         return jsonify([user.to_dict() for user in users])
 
     @app.route('/api/users/<int:user_id>', methods=['PUT'])
@@ -124,6 +177,7 @@ def create_app(config_name='default'):
 
         try:
             db.session.commit()
+            principals.invalidate(user.username)
             logger.info(f"User updated: {user.username}")
             return jsonify(user.to_dict())
         except Exception as e:
@@ -131,17 +185,75 @@ def create_app(config_name='default'):
             logger.error(f"Error updating user: {str(e)}")
             return jsonify({"error": "Update failed"}), 500
 
+    @app.route('/api/metrics/actions', methods=['GET'])
+    @jwt_required()
+    @requires_roles('admin')
+    def get_action_metrics():
+        return jsonify(action_executor.metrics())
+
+    @app.route('/api/metrics/sockets', methods=['GET'])
+    @jwt_required()
+    @requires_roles('admin')
+    def get_socket_metrics():
+        return jsonify(event_batcher.metrics())
+
+    @app.route('/api/health/protocols', methods=['GET'])
+    @jwt_required()
+    @requires_roles('admin')
+    def get_protocol_health():
+        return jsonify(adapter_registry.health_check())
+
+    @app.route('/api/metrics/ingest', methods=['GET'])
+    @jwt_required()
+    @requires_roles('admin')
+    def get_ingest_metrics():
+        adapter = adapter_registry.get('mqtt')
+        if adapter is None:
+            return jsonify({'error': 'MQTT adapter unavailable'}), 503
+        return jsonify(adapter.ingest.metrics())
+
     # Device routes
     @app.route('/api/devices', methods=['GET'])
     @jwt_required()
     @limiter.limit("30/minute")
     def get_devices():
-        user = User.query.filter_by(username=get_jwt_identity()).first()
-        if user.role == 'admin':
-            devices = Device.query.all()
-        else:
-            devices = Device.query.filter_by(owner_id=user.id).all()
-        return jsonify([device.to_dict() for device in devices])
+        user = get_current_principal()
+        owner_id = None if user.role == 'admin' else user.id
+
+        # Unchanged listings are answered from the version counter alone
+        etag = device_versions.etag(owner_id, request.query_string)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        limit = min(request.args.get('limit', app.config['DEVICES_PAGE_SIZE'], type=int),
+                     app.config['MAX_DEVICES_PAGE_SIZE'])
+        after = request.args.get('after', type=int)
+        include = set(filter(None, request.args.get('include', '').split(',')))
+        fields = None
+        if request.args.get('fields'):
+            fields = [field for field in request.args['fields'].split(',') if field]
+            unknown = set(fields) - set(Device.SERIALIZED_FIELDS)
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+
+        # One extra row tells whether there is a next page
+        devices = repository.list_devices(
+            owner_id, after=after, limit=limit + 1,
+            include=include & {'scripts'}, fields=fields)
+        page = devices[:limit]
+        response = jsonify([
+            device.to_dict(include_scripts='scripts' in include, fields=fields)
+            for device in page
+        ])
+        if len(devices) > limit:
+            response.headers['X-Next-Cursor'] = str(page[-1].id)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
 
     @app.route('/api/devices', methods=['POST'])
     @jwt_required()
@@ -157,7 +269,7 @@ def create_app(config_name='default'):
             if not mac_address or not Device.validate_mac_address(mac_address):
                 return jsonify({'error': 'Invalid MAC address'}), 400
 
-            user = User.query.filter_by(username=get_jwt_identity()).first()
+            user = get_current_principal()
             device = Device(
                 mac_address=mac_address,
                 name=data.get('name', 'Unknown'),
@@ -176,12 +288,150 @@ def create_app(config_name='default'):
             logger.error(f"Error adding device: {str(e)}")
             return jsonify({'error': str(e)}), 400
 
+    @app.route('/api/devices/import', methods=['POST'])
+    @jwt_required()
+    @requires_roles('admin', 'device_manager')
+    @limiter.limit("5/minute")
+    def api_import_devices():
+        # An uploaded file or the request body, in the format named by the
+        # query string, the content type or the file extension
+        upload = request.files.get('file')
+        content_type = (upload.mimetype if upload else request.mimetype) or ''
+        filename = (upload.filename or '') if upload else ''
+        fmt = request.args.get('format') or next(
+            (name for name, mimetype in device_io.FORMATS.items() if mimetype == content_type),
+            None)
+        if fmt is None:
+            if content_type == 'application/json' or filename.endswith('.json'):
+                fmt = 'json'
+            elif filename.endswith('.csv'):
+                fmt = 'csv'
+            else:
+                fmt = 'jsonl'
+        try:
+            data = upload.read().decode('utf-8') if upload else request.get_data(as_text=True)
+            rows = device_io.parse(data, fmt)
+        except (UnicodeDecodeError, ValueError) as e:
+            return jsonify({'error': f'Invalid import: {str(e)}'}), 400
+        if not rows:
+            return jsonify({'error': 'No devices provided'}), 400
+        if len(rows) > app.config['MAX_IMPORT_ROWS']:
+            return jsonify({'error': f"At most {app.config['MAX_IMPORT_ROWS']} devices per import"}), 413
+
+        user = get_current_principal()
+        report = device_io.import_devices(
+            rows, user.id, is_admin=user.role == 'admin',
+            dry_run=request.args.get('dry_run', '').lower() in ('1', 'true'),
+            batch_size=app.config['IMPORT_BATCH_SIZE'])
+        if report is None:
+            return jsonify({'error': 'Failed to import devices'}), 500
+        logger.info(f"Device import by {user.username}: {report['created']} created, "
+                    f"{report['updated']} updated, {len(report['errors'])} rejected")
+        return jsonify(report), 200
+
+    @app.route('/api/devices/export', methods=['GET'])
+    @jwt_required()
+    @limiter.limit("5/minute")
+    def api_export_devices():
+        fmt = request.args.get('format', 'jsonl')
+        if fmt not in device_io.FORMATS:
+            return jsonify({'error': f'format must be one of {", ".join(device_io.FORMATS)}'}), 400
+        user = get_current_principal()
+        owner_id = None if user.role == 'admin' else user.id
+        response = Response(stream_with_context(device_io.export_devices(
+            fmt, owner_id, app.config['EXPORT_BATCH_SIZE'])), mimetype=device_io.FORMATS[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename=devices.{fmt}'
+        return response
+
+    @app.route('/api/devices/<mac_address>/events', methods=['GET'])
+    @jwt_required()
+    @device_access_required
+    @limiter.limit("60/minute")
+    def get_device_events(mac_address):
+        limit = min(request.args.get('limit', app.config['EVENTS_PAGE_SIZE'], type=int),
+                    app.config['MAX_EVENTS_PAGE_SIZE'])
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        before = None
+        if request.args.get('before'):
+            try:
+                before = repository.parse_event_cursor(request.args['before'])
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+        event_types = [event_type for event_type in request.args.get('type', '').split(',')
+                       if event_type]
+
+        # One extra row tells whether there is an older page
+        device = get_current_device()
+        events = repository.list_device_events(
+            device.id, before=before, limit=limit + 1, event_types=event_types)
+        page = events[:limit]
+        response = jsonify([event.to_dict() for event in page])
+        if len(events) > limit:
+            response.headers['X-Next-Cursor'] = repository.event_cursor(page[-1])
+        return response
+
+    @app.route('/api/devices/<mac_address>/state', methods=['GET'])
+    @jwt_required()
+    @device_access_required
+    @limiter.limit("60/minute")
+    def get_device_state(mac_address):
+        device = get_current_device()
+        try:
+            at = _utc_arg('at')
+        except ValueError:
+            return jsonify({'error': 'at must be an ISO 8601 timestamp'}), 400
+        if at is None:
+            return jsonify({'state': device.state or {}}), 200
+
+        history = state_history.state_at(device.id, at)
+        if history is None:
+            return jsonify({'error': 'No state history at that time'}), 404
+        return jsonify({
+            'state': history['state'],
+            'complete': history['complete'],
+            'at': at.isoformat(),
+            'keyframe_at': history['keyframe_at'].isoformat(),
+            'replayed': history['replayed']
+        }), 200
+
+    @app.route('/api/devices/<mac_address>/telemetry', methods=['GET'])
+    @jwt_required()
+    @device_access_required
+    @limiter.limit("60/minute")
+    def get_device_telemetry(mac_address):
+        try:
+            end = _utc_arg('end') or datetime.utcnow()
+            start = _utc_arg('start') or end - timedelta(days=1)
+        except ValueError:
+            return jsonify({'error': 'start and end must be ISO 8601 timestamps'}), 400
+        if start >= end:
+            return jsonify({'error': 'start must be before end'}), 400
+        resolution = request.args.get('resolution', type=int)
+        if resolution is not None and resolution not in RESOLUTIONS:
+            return jsonify({'error': f"resolution must be one of {list(RESOLUTIONS)}"}), 400
+        max_points = request.args.get('max_points', app.config['TELEMETRY_MAX_POINTS'], type=int)
+        if max_points < 1:
+            return jsonify({'error': 'max_points must be positive'}), 400
+        keys = [key for key in request.args.get('keys', '').split(',') if key]
+
+        resolution, series = telemetry.series(
+            get_current_device().id, start, end, keys=keys,
+            max_points=max_points, resolution=resolution)
+        return jsonify({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'resolution': resolution,
+            'series': {key: [bucket.to_dict() for bucket in buckets]
+                       for key, buckets in series.items()}
+        }), 200
+
     @app.route('/api/devices/<mac_address>', methods=['DELETE'])
     @jwt_required()
     @device_access_required
     @limiter.limit("10/minute")
     def delete_device(mac_address):
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        device = get_current_device()
         if device:
             try:
                 db.session.delete(device)
@@ -275,6 +525,83 @@ def create_app(config_name='default'):
         else:
             return jsonify({'error': 'Failed to dequeue script'}), 400
 
+    @app.route('/api/reorder-script/<mac_address>', methods=['POST'])
+    @jwt_required()
+    @device_access_required
+    @limiter.limit("30/minute")
+    def api_reorder_script(mac_address):
+        data = request.get_json()
+        if not data or 'id' not in data:
+            return jsonify({'error': 'Queue item id is required'}), 400
+
+        success = device_manager.move_queued_script(
+            mac_address, data['id'], data.get('before'))
+
+        if success:
+            return jsonify({'success': True, 'message': 'Script moved'}), 200
+        else:
+            return jsonify({'error': 'Failed to move script'}), 400
+
+    @app.route('/api/claim-script/<mac_address>', methods=['POST'])
+    @device_access_required
+    @limiter.limit("60/minute")
+    def api_claim_script(mac_address):
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+        wait = min(max(wait, 0), app.config['SCRIPT_QUEUE_MAX_WAIT'])
+        if wait:
+            item = device_manager.wait_for_next_script(mac_address, wait)
+        else:
+            item = device_manager.claim_next_script(mac_address)
+
+        if item:
+            return jsonify(item), 200
+        return '', 204
+
+    @app.route('/api/complete-script/<mac_address>', methods=['POST'])
+    @device_access_required
+    @limiter.limit("60/minute")
+    def api_complete_script(mac_address):
+        return finish_script(mac_address, succeeded=True)
+
+    @app.route('/api/fail-script/<mac_address>', methods=['POST'])
+    @device_access_required
+    @limiter.limit("60/minute")
+    def api_fail_script(mac_address):
+        return finish_script(mac_address, succeeded=False)
+
+    def finish_script(mac_address, succeeded):
+        data = request.get_json()
+        if not data or 'id' not in data:
+            return jsonify({'error': 'Queue item id is required'}), 400
+
+        success = device_manager.finish_script(
+            mac_address, data['id'], succeeded, data.get('result'))
+
+        if success:
+            return jsonify({'success': True, 'message': 'Script result recorded'}), 200
+        else:
+            return jsonify({'error': 'No running script with that id'}), 409
+
+    @app.route('/api/scripts-queue/<mac_address>', methods=['GET'])
+    @device_access_required
+    @limiter.limit("60/minute")
+    def api_get_script_queue(mac_address):
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+        wait = min(max(wait, 0), app.config['SCRIPT_QUEUE_MAX_WAIT'])
+        if wait:
+            queue = device_manager.wait_for_script_queue(mac_address, wait)
+        else:
+            queue = device_manager.fetch_script_queue(mac_address)
+        return jsonify(queue), 200
+
     # Device status routes
     @app.route('/api/update-last-ping-time/<mac_address>', methods=['POST'])
     @device_access_required
@@ -282,11 +609,52 @@ def create_app(config_name='default'):
     def update_last_ping_time(mac_address):
         success = device_manager.update_last_ping_time(mac_address)
         if success:
-            socketio.emit('ping_received', {'mac_address': mac_address})
+            event_batcher.publish_pings([mac_address])
             return jsonify({'success': True, 'message': 'Last ping time updated'}), 200
         else:
             return jsonify({'error': 'Device not found'}), 404
 
+    @app.route('/api/heartbeats', methods=['POST'])
+    @jwt_required()
+    @limiter.limit("60/minute")
+    def bulk_update_last_ping_time():
+        data = request.get_json()
+        if not data or not isinstance(data.get('devices'), list):
+            return jsonify({'error': 'A list of devices is required'}), 400
+
+        entries = {}
+        for entry in data['devices']:
+            if not isinstance(entry, dict) or not isinstance(entry.get('mac_address'), str) \
+                    or not entry['mac_address']:
+                return jsonify({'error': 'Each device needs a mac_address'}), 400
+            entries[entry['mac_address']] = entry
+        if len(entries) > app.config['MAX_HEARTBEAT_BATCH']:
+            return jsonify({'error': 'Too many devices in one batch'}), 413
+
+        user = get_current_principal()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        if not user.is_active:
+            return jsonify({"error": "User account is inactive"}), 403
+
+        # A bad field fails only its own entry, not the batch UPDATE
+        invalid = {}
+        for mac_address, entry in entries.items():
+            error = device_manager.heartbeat_field_error(entry)
+            if error:
+                invalid[mac_address] = error
+
+        allowed, errors = authorize_devices(
+            user, [mac for mac in entries if mac not in invalid])
+        errors.update(invalid)
+        if allowed and not device_manager.update_last_ping_times(
+                [entries[mac] for mac in allowed]):
+            return jsonify({'error': 'Failed to update ping times'}), 500
+
+        if allowed:
+            event_batcher.publish_pings(allowed)
+        return jsonify({'updated': allowed, 'errors': errors}), 200
+
     @app.route('/api/get-last-ping-time/<mac_address>', methods=['GET'])
     @device_access_required
     @limiter.limit("60/minute")
@@ -299,5 +667,4 @@ def create_app(config_name='default'):
 
 if __name__ == '__main__':
     app = create_app(os.getenv('FLASK_CONFIG', 'default'))
-    socketio = SocketIO(app)
-    socketio.run(app, debug=app.config['DEBUG'], host='0.0.0.0')
+    realtime.socketio.run(app, debug=app.config['DEBUG'], host='0.0.0.0')
@@ -1,13 +1,60 @@
 from functools import wraps
-from flask import jsonify, request, current_app
+from flask import jsonify, request, current_app, g, has_request_context
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-from models import User, Device
+from models import db, User, Device
+from device_registry import device_registry
+from principal_cache import Principal, principals
+
+
+def get_current_principal():
+    """Get the id, role and active flag of the authenticated user.
+
+    Resolved once per request, from the principal cache when possible.
+    """
+    if 'principal' not in g:
+        g.principal = load_principal(get_jwt_identity())
+    return g.principal
+
+
+def load_principal(identity):
+    """Get the principal for a JWT identity, through the principal cache."""
+    principal = principals.get(identity)
+    if principal is None:
+        row = User.query.with_entities(
+            User.id, User.username, User.role, User.is_active)\
+            .filter_by(username=identity).first()
+        if row:
+            principal = Principal(*row)
+            principals.put(identity, principal)
+    return principal
 
 
 def get_current_user():
     """Get the current authenticated user."""
-    username = get_jwt_identity()
-    return User.query.filter_by(username=username).first()
+    if 'current_user' not in g:
+        g.current_user = User.query.filter_by(username=get_jwt_identity()).first()
+    return g.current_user
+
+
+def get_current_device():
+    """Get the device resolved by ``device_access_required`` for this request.
+
+    Access checks only read the device registry; the row itself is loaded
+    the first time a handler asks for it.
+    """
+    if 'device' not in g:
+        record = g.get('device_record')
+        g.device = db.session.get(Device, record.id) if record else None
+    return g.device
+
+
+def resolved_device(mac_address):
+    """Get the device already loaded for this request if it has this MAC."""
+    if not has_request_context():
+        return None
+    if g.get('device_mac') != mac_address:
+        return None
+    return get_current_device()
 
 
 def requires_roles(*roles):
@@ -16,7 +63,7 @@ def requires_roles(*roles):
         @wraps(fn)
         def decorator(*args, **kwargs):
             verify_jwt_in_request()
-            user = get_current_user()
+            user = get_current_principal()
 
             if not user:
                 return jsonify({"error": "User not found"}), 404
@@ -33,11 +80,15 @@ def requires_roles(*roles):
 
 
 def device_access_required(fn):
-    """Decorator to check if user has access to the device."""
+    """Decorator to check if user has access to the device.
+
+    The device is kept for the request; handlers get it from
+    ``get_current_device()`` instead of loading it again.
+    """
     @wraps(fn)
     def wrapper(*args, **kwargs):
         verify_jwt_in_request()
-        user = get_current_user()
+        user = get_current_principal()
 
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -51,17 +102,42 @@ def device_access_required(fn):
             return jsonify({"error": "Device MAC address not provided"}), 400
 
         # Check if user owns the device or is an admin
-        device = Device.query.filter_by(mac_address=mac_address).first()
-        if not device:
+        record = device_registry.find(mac_address)
+        if not record:
             return jsonify({"error": "Device not found"}), 404
 
-        if device.owner_id != user.id and user.role != 'admin':
+        if record.owner_id != user.id and user.role != 'admin':
             return jsonify({"error": "Access to device denied"}), 403
 
+        g.device_record = record
+        g.device_mac = mac_address
         return fn(*args, **kwargs)
     return wrapper
 
 
+def authorize_devices(user, mac_addresses):
+    """Resolve which of the given devices the user may access.
+
+    Devices are looked up in the device registry, with any it does not
+    hold yet checked in one query.
+
+    Returns:
+        tuple: (list of permitted MAC addresses, {mac_address: error})
+    """
+    allowed = []
+    errors = {}
+    records = device_registry.find_many(mac_addresses)
+    for mac_address in mac_addresses:
+        record = records.get(mac_address)
+        if record is None:
+            errors[mac_address] = "Device not found"
+        elif record.owner_id != user.id and user.role != 'admin':
+            errors[mac_address] = "Access to device denied"
+        else:
+            allowed.append(mac_address)
+    return allowed, errors
+
+
 def validate_registration_data(data):
     """Validate user registration data."""
     errors = []
@@ -1,6 +1,12 @@
 from datetime import datetime
 import pytz
-from models import db, Automation, Device, DeviceEvent
+from models import db, Automation, Device, Scene
+from trigger_index import trigger_index
+from conditions import compile_condition
+from action_executor import ActionExecutor
+from protocols.adapter_registry import adapter_registry
+from realtime import event_batcher
+from state_history import state_history
 import logging
 
 logger = logging.getLogger(__name__)
@@ -39,47 +45,23 @@ def check_time_trigger(trigger_data, timezone='UTC'):
 
 
 def check_condition_trigger(trigger_data, device=None, old_state=None, new_state=None):
-    """Check if a condition-based trigger should fire."""
-    condition_type = trigger_data.get('type')
+    """Check if a condition-based trigger should fire.
 
-    if condition_type == 'state_change':
-        # Check if specific state changed
-        if not device or not old_state or not new_state:
-            return False
-
-        target_state = trigger_data.get('state')
-        if not target_state:
-            return False
-
-        # Check if the state changed to the target state
-        for key, value in target_state.items():
-            if new_state.get(key) == value and old_state.get(key) != value:
-                return True
-
-    elif condition_type == 'threshold':
-        # Check if value crosses a threshold
-        if not device or not new_state:
-            return False
-
-        value = new_state.get(trigger_data.get('property'))
-        if value is None:
-            return False
+    Compiles ``trigger_data`` on every call; hot paths should use the
+    conditions compiled by the trigger index instead.
+    """
+    try:
+        condition = compile_condition(trigger_data)
+    except ValueError as e:
+        logger.error(f"Invalid condition trigger: {str(e)}")
+        return False
+    return condition(device, old_state or {}, new_state or {}, _current_state)
 
-        threshold = trigger_data.get('threshold')
-        operator = trigger_data.get('operator', '>')
 
-        if operator == '>':
-            return value > threshold
-        elif operator == '<':
-            return value < threshold
-        elif operator == '>=':
-            return value >= threshold
-        elif operator == '<=':
-            return value <= threshold
-        elif operator == '==':
-            return value == threshold
-
-    return False
+def _current_state(device_id):
+    """Get the current state of a device referenced by a compound condition."""
+    device = db.session.get(Device, device_id)
+    return device.state if device else None
 
 
 def execute_action(action, device=None):
@@ -111,8 +93,8 @@ def execute_action(action, device=None):
             )
 
         elif action_type == 'delay':
-            # Add delay between actions
-            time.sleep(action.get('duration', 0))
+            # Delays are handled by the action executor between actions
+            pass
 
         return True
 
@@ -121,46 +103,49 @@ def execute_action(action, device=None):
         return False
 
 
+action_executor = ActionExecutor(execute_action)
+
+
 def check_device_triggers(device, old_state, new_state):
     """Check and execute automation triggers for device state changes."""
     try:
-        # Get all enabled automations for the device's home
-        automations = Automation.query.filter_by(
-            home_id=device.room.home_id,
-            is_enabled=True
-        ).all()
-
-        for automation in automations:
-            should_trigger = False
-
-            if automation.trigger_type == 'condition':
-                should_trigger = check_condition_trigger(
-                    automation.trigger_data,
-                    device=device,
-                    old_state=old_state,
-                    new_state=new_state
-                )
+        changed_keys = [
+            key for key in set(old_state) | set(new_state)
+            if old_state.get(key) != new_state.get(key)
+        ]
+        if not changed_keys:
+            return
+
+        # Only automations watching a changed key need evaluating
+        home_id = device.room.home_id if device.room else None
+        triggers = trigger_index.candidates(device.id, home_id, changed_keys)
+
+        for trigger in triggers:
+            should_trigger = trigger.condition.test(
+                device, old_state, new_state, _current_state)
 
             if should_trigger:
-                # Execute all actions in sequence
-                for action in automation.actions:
-                    if not execute_action(action):
-                        break
+                automation = db.session.get(Automation, trigger.automation_id)
+                if not automation:
+                    continue
+                fired = (automation.id, automation.home_id, automation.name)
+
+                # Run the actions on the executor, not the caller's thread
+                action_executor.submit(automation.actions)
 
                 # Update last triggered time
                 automation.last_triggered = datetime.utcnow()
                 db.session.commit()
 
-                # Create automation event
-                event = DeviceEvent(
-                    device_id=device.id,
+                # Create automation event with the change that fired it
+                event = state_history.record(
+                    device.id, old_state, new_state,
                     event_type='automation_triggered',
-                    message=f"Automation '{automation.name}' triggered",
-                    old_state=old_state,
-                    new_state=new_state
+                    message=f"Automation '{automation.name}' triggered"
                 )
                 db.session.add(event)
                 db.session.commit()
+                event_batcher.publish_automation(*fired)
 
     except Exception as e:
         logger.error(f"Error checking device triggers: {str(e)}")
@@ -174,25 +159,16 @@ def execute_scene(scene_id):
         if not scene or not scene.is_enabled:
             return False
 
-        # Execute all scene actions in parallel or sequence based on configuration
-        for action in scene.actions:
-            execute_action(action)
-
-        return True
+        # Scenes with delays must keep their order; others fan out
+        if scene.mode == 'sequence' or any(
+                action.get('type') == 'delay' for action in scene.actions):
+            return action_executor.submit(scene.actions)
+        return action_executor.submit_parallel(scene.actions)
 
     except Exception as e:
         logger.error(f"Error executing scene: {str(e)}")
         return False
 
-# Protocol handlers (to be implemented)
-
-
 def get_protocol_handler(protocol):
-    """Get the appropriate protocol handler for a device."""
-    handlers = {
-        'mqtt': MQTTHandler(),
-        'zwave': ZWaveHandler(),
-        'zigbee': ZigbeeHandler(),
-        'wifi': WiFiHandler(),
-    }
-    return handlers.get(protocol)
+    """Get the shared protocol adapter for a device's protocol."""
+    return adapter_registry.get(protocol)
@@ -0,0 +1,96 @@
+# Encode/decode speed of the JSON codecs on device payloads.
+#
+#   python benchmarks/json_codec_bench.py [--devices 200] [--repeat 2000]
+#
+# Times every installed codec on an MQTT state message, as decoded in
+# _on_message and encoded by send_command, and on an /api/devices
+# listing encoded through CodecJSONProvider with Flask's default() and
+# sorted keys. Each codec's output must decode to the same value as the
+# stdlib codec's.
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+import json_codec  # noqa: E402
+from models import Device, DeviceCapability, DeviceType  # noqa: E402
+
+
+def state_message(rng):
+    """Get a lock's state report as it arrives over MQTT."""
+    return {
+        'locked': rng.random() < 0.5,
+        'door_open': rng.random() < 0.1,
+        'battery': rng.randint(0, 100),
+        'temperature': round(rng.uniform(15, 30), 2),
+        'signal': -rng.randint(30, 90),
+        'last_user': f"user{rng.randint(1, 20)}",
+        'auto_lock_seconds': 30,
+        'firmware': '2.4.1',
+    }
+
+
+def device_listing(rng, count):
+    """Get an /api/devices page of ``count`` devices."""
+    start = datetime(2024, 1, 1)
+    devices = []
+    for i in range(count):
+        device = Device(
+            id=i + 1, mac_address=f"02:00:00:00:{i // 256:02X}:{i % 256:02X}",
+            name=f"Front door {i}", device_type=DeviceType.LOCK,
+            capabilities=[DeviceCapability.LOCK_UNLOCK, DeviceCapability.TEMPERATURE],
+            state=state_message(rng), config={'payload_encoding': 'json'},
+            emoji='', status='online', last_ping_time=1.7e9 + i,
+            firmware_version='2.4.1', ip_address=f"10.0.{i // 256}.{i % 256}",
+            protocol='mqtt', room_id=i % 10 + 1, owner_id=i % 50 + 1,
+            created_at=start, updated_at=start + timedelta(seconds=i))
+        devices.append(device.to_dict(include_scripts=False))
+    # A datetime left for the provider's default(), as some routes return
+    return {'devices': devices, 'total': count, 'generated_at': start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JSON codecs')
+    parser.add_argument('--devices', type=int, default=200, help='devices in the listing')
+    parser.add_argument('--repeat', type=int, default=2000, help='runs timed per payload')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    message = state_message(rng)
+    listing = device_listing(rng, args.devices)
+    app = Flask(__name__)
+    json_codec.init_app(app)
+
+    names = [name for name in json_codec.CODECS if json_codec._AVAILABLE[name]]
+    skipped = [name for name in json_codec.CODECS if name not in names]
+    reference = json_codec.JSONCodec()
+    expected = reference.loads(reference.dumps(listing, default=app.json.default,
+                                               sort_keys=True))
+
+    print(f"{'codec':>8} {'state decode':>13} {'state encode':>13} "
+          f"{f'{args.devices} devices':>13}")
+    for name in names:
+        codec = json_codec.use_codec(name)
+        raw = codec.dumpb(message)
+        encoded = app.json.dumps(listing)
+        if codec.loads(raw) != message or codec.loads(encoded) != expected:
+            sys.exit(f"{name} output differs from the stdlib codec")
+
+        decode = timeit.timeit(lambda: codec.loads(raw), number=args.repeat)
+        encode = timeit.timeit(lambda: codec.dumpb(message), number=args.repeat)
+        # Few runs: the listing is large
+        runs = max(1, args.repeat // 20)
+        provider = timeit.timeit(lambda: app.json.dumps(listing), number=runs)
+        print(f"{name:>8} {decode / args.repeat * 1e6:10.2f} us "
+              f"{encode / args.repeat * 1e6:10.2f} us {provider / runs * 1000:10.2f} ms")
+    if skipped:
+        print(f"Not installed: {', '.join(skipped)}")
+
+
+if __name__ == '__main__':
+    main()
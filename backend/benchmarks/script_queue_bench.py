@@ -0,0 +1,116 @@
+# Cost of script queue edits as the queue grows.
+#
+#   python benchmarks/script_queue_bench.py [--sizes 100 1000 10000] [--ops 200]
+#
+# Fills one device's queue to each size, then times enqueue, dequeue,
+# pop-head and reorder through device_manager and counts the SQL
+# statements each runs. Reorders move the tail item in front of the same
+# target every time, which uses up the gap there and makes _open_gap
+# respread it. With sparse positions every column should stay flat.
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from config import config, TestingConfig  # noqa: E402
+from app import create_app  # noqa: E402
+import device_manager  # noqa: E402
+from models import db, Device, DeviceType, Script, ScriptQueue, User  # noqa: E402
+
+SCRIPT_NAMES = ('unlock', 'lock', 'report', 'reboot')
+
+
+def fill_queue(device_id, size):
+    """Replace the device's queue with ``size`` evenly spaced items."""
+    ScriptQueue.query.filter_by(device_id=device_id).delete()
+    scripts = Script.query.filter_by(device_id=device_id).all()
+    db.session.bulk_insert_mappings(ScriptQueue, [
+        {'device_id': device_id, 'script_id': scripts[i % len(scripts)].id,
+         'position': i * device_manager.QUEUE_POSITION_STEP, 'status': 'pending'}
+        for i in range(size)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark script queue edits')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--ops', type=int, default=200, help='operations timed per kind')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        LOG_FILE = os.path.join(directory, 'app.log')
+        MAX_QUEUE_SIZE = max(args.sizes) + args.ops
+
+    config['bench'] = BenchConfig
+    app = create_app('bench')
+    # Per-operation INFO logs would dominate the timings
+    logging.disable(logging.INFO)
+    statements = [0]
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *a: statements.__setitem__(0, statements[0] + 1))
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench')
+        device = Device(mac_address='02:00:00:00:00:01', name='Bench',
+                        device_type=DeviceType.LOCK, owner=user)
+        db.session.add_all([user, device])
+        db.session.add_all(Script(name=name, content='print(1)', device=device)
+                           for name in SCRIPT_NAMES)
+        db.session.commit()
+        mac, device_id = device.mac_address, device.id
+
+        def measure(operation):
+            times, counts = [], []
+            for i in range(args.ops):
+                statements[0] = 0
+                began = time.perf_counter()
+                assert operation(i) is not False
+                times.append((time.perf_counter() - began) * 1000)
+                counts.append(statements[0])
+                db.session.remove()
+            return times, counts
+
+        def move(i):
+            ids = [item_id for item_id, in ScriptQueue.query.with_entities(ScriptQueue.id)
+                   .filter_by(device_id=device_id).order_by(ScriptQueue.position.desc())
+                   .limit(1)]
+            statements[0] = 0
+            return device_manager.move_queued_script(mac, ids[0], target_id)
+
+        print(f"{'size':>6} {'operation':>9} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'stmts p50':>9} {'stmts max':>9}")
+        for size in args.sizes:
+            results = {}
+            with app.test_request_context():
+                fill_queue(device_id, size)
+                results['enqueue'] = measure(
+                    lambda i: device_manager.enqueue_script(mac, SCRIPT_NAMES[i % 4]))
+                results['dequeue'] = measure(
+                    lambda i: device_manager.dequeue_script(mac, SCRIPT_NAMES[i % 4]))
+                results['pop'] = measure(lambda i: device_manager.pop_script(mac))
+
+                fill_queue(device_id, size)
+                target_id = ScriptQueue.query.filter_by(device_id=device_id)\
+                    .order_by(ScriptQueue.position).offset(size // 2).first().id
+                db.session.remove()
+                results['move'] = measure(move)
+
+            for name, (times, counts) in results.items():
+                times.sort()
+                print(f"{size:>6} {name:>9} {statistics.median(times):8.2f} "
+                      f"{times[int(len(times) * 0.99) - 1]:8.2f} "
+                      f"{statistics.median(counts):9.0f} {max(counts):9d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Socket.IO fan-out of device pings to many connected dashboards.
+#
+#   python benchmarks/socket_fanout_bench.py [--clients 200] [--owners 50] [--devices 2000]
+#
+# Connects in-process Socket.IO test clients for a set of device owners
+# (several dashboards each) plus one admin, with the devices spread over
+# homes whose other members do not own them. Every device then pings a
+# few times per tick and the batcher is flushed once per tick. Reports the
+# frames sent against broadcasting each ping to every client, and checks
+# that no client is sent a device it could not read over REST.
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from config import config, TestingConfig  # noqa: E402
+from app import create_app  # noqa: E402
+from device_registry import device_registry  # noqa: E402
+from models import db, Device, DeviceType, Home, Room, User  # noqa: E402
+from realtime import BATCH_EVENT, event_batcher, socketio  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark socket event fan-out')
+    parser.add_argument('--clients', type=int, default=200, help='owner dashboards connected')
+    parser.add_argument('--owners', type=int, default=50)
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--homes', type=int, default=10)
+    parser.add_argument('--ticks', type=int, default=5)
+    parser.add_argument('--pings', type=int, default=2, help='pings per device per tick')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        LOG_FILE = os.path.join(directory, 'app.log')
+        # Ticks are driven by hand below
+        SOCKET_BATCH_INTERVAL = 3600
+
+    config['bench'] = BenchConfig
+    app = create_app('bench')
+    logging.disable(logging.INFO)
+
+    with app.app_context():
+        admin = User(username='bench-admin', email='admin@example.com', role='admin')
+        owners = [User(username=f"owner{i}", email=f"owner{i}@example.com")
+                  for i in range(args.owners)]
+        for user in [admin, *owners]:
+            user.set_password('bench')
+        db.session.add_all([admin, *owners])
+        db.session.flush()
+
+        homes = [Home(name=f"Home {i}", owner_id=owners[i % args.owners].id)
+                 for i in range(args.homes)]
+        db.session.add_all(homes)
+        db.session.flush()
+        rooms = [Room(name='Hall', home_id=home.id) for home in homes]
+        db.session.add_all(rooms)
+        db.session.flush()
+        # Every owner is also a member of a home holding other owners' devices
+        for i, user in enumerate(owners):
+            user.home_id = homes[i % args.homes].id
+
+        devices = [Device(mac_address=f"02:00:00:{i // 65536:02X}:{i // 256 % 256:02X}:{i % 256:02X}",
+                          name=f"Device {i}", device_type=DeviceType.SENSOR,
+                          owner_id=owners[i % args.owners].id, room_id=rooms[i % args.homes].id)
+                   for i in range(args.devices)]
+        db.session.add_all(devices)
+        db.session.commit()
+        device_registry.load()
+
+        owned = {user.id: {device.mac_address for device in devices if device.owner_id == user.id}
+                 for user in owners}
+        clients = []
+        for i in range(args.clients):
+            user = owners[i % args.owners]
+            token = create_access_token(identity=user.username)
+            clients.append((owned[user.id], socketio.test_client(app, auth={'token': token})))
+        admin_client = socketio.test_client(
+            app, auth={'token': create_access_token(identity=admin.username)})
+        macs = [device.mac_address for device in devices]
+
+        began = time.perf_counter()
+        for _ in range(args.ticks):
+            for _ in range(args.pings):
+                event_batcher.publish_pings(macs)
+            event_batcher.flush()
+        elapsed = time.perf_counter() - began
+
+        frames = Counter()
+        leaked = payloads = 0
+        for allowed, client in clients:
+            for message in client.get_received():
+                if message['name'] != BATCH_EVENT:
+                    continue
+                frames[id(client)] += 1
+                for frame in message['args']:
+                    for ping in frame.get('ping_received', ()):
+                        payloads += 1
+                        leaked += ping['mac_address'] not in allowed
+        admin_frames = sum(message['name'] == BATCH_EVENT
+                           for message in admin_client.get_received())
+
+    pings = args.devices * args.pings * args.ticks
+    print(f"{args.clients} dashboards for {args.owners} owners + 1 admin, "
+          f"{args.devices} devices in {args.homes} homes, {pings} pings over {args.ticks} ticks")
+    print(f"  frames sent:      {sum(frames.values()) + admin_frames} "
+          f"(max {max(frames.values()) / args.ticks:.0f} per dashboard per tick, "
+          f"admin {admin_frames / args.ticks:.0f} per tick)")
+    print(f"  pings delivered:  {payloads} to dashboards, {leaked} for devices not owned")
+    print(f"  broadcast:        {pings * (args.clients + 1)} messages")
+    print(f"  publish + flush:  {elapsed * 1000:.0f} ms")
+    if leaked:
+        sys.exit("Dashboards were sent devices they cannot access")
+
+
+if __name__ == '__main__':
+    main()
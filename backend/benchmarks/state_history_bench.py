@@ -0,0 +1,92 @@
+# Storage and reconstruction latency of delta-encoded state history.
+#
+#   python benchmarks/state_history_bench.py [--keys 42] [--updates 2000]
+#
+# Writes a stream of state updates for one device that each change a few
+# keys, then compares the bytes stored per update against full old/new
+# snapshots and times state_at() at random moments, checking every
+# reconstruction against the true state.
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+import json_codec  # noqa: E402
+from models import db, Device, DeviceEvent, DeviceType, User  # noqa: E402
+from state_history import StateHistory  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark delta-encoded state history')
+    parser.add_argument('--keys', type=int, default=42, help='state keys per device')
+    parser.add_argument('--updates', type=int, default=2000, help='state updates written')
+    parser.add_argument('--changed', type=int, default=2, help='keys changed per update')
+    parser.add_argument('--lookups', type=int, default=300, help='state_at() calls timed')
+    parser.add_argument('--keyframe-interval', type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    db.init_app(app)
+    history = StateHistory(args.keyframe_interval)
+    rng = random.Random(0)
+
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench')
+        device = Device(mac_address='02:00:00:00:00:01', name='Bench',
+                        device_type=DeviceType.SENSOR, owner=user)
+        db.session.add_all([user, device])
+        db.session.commit()
+
+        state = {f'key{i}': rng.random() for i in range(args.keys)}
+        start = datetime(2024, 1, 1)
+        truth = []
+        full_bytes = 0
+        for i in range(args.updates):
+            new_state = dict(state)
+            for key in rng.sample(sorted(state), args.changed):
+                new_state[key] = rng.random()
+            event = history.record(device.id, state, new_state)
+            event.created_at = start + timedelta(seconds=i)
+            db.session.add(event)
+            full_bytes += len(json_codec.dumpb(state)) + len(json_codec.dumpb(new_state))
+            truth.append((event.created_at, new_state))
+            state = new_state
+        db.session.commit()
+
+        stored_bytes = sum(
+            len(json_codec.dumpb(old or {})) + len(json_codec.dumpb(new or {}))
+            for old, new in db.session.query(DeviceEvent.old_state, DeviceEvent.new_state))
+
+        latencies = []
+        matched = 0
+        for _ in range(args.lookups):
+            at, expected = rng.choice(truth)
+            began = time.perf_counter()
+            result = history.state_at(device.id, at)
+            latencies.append((time.perf_counter() - began) * 1000)
+            matched += result['state'] == expected and result['complete']
+
+    latencies.sort()
+    print(f"{args.updates} updates of {args.keys} keys, {args.changed} changed each, "
+          f"keyframe every {args.keyframe_interval}")
+    print(f"  full snapshots: {full_bytes / args.updates:8.0f} B/update")
+    print(f"  deltas:         {stored_bytes / args.updates:8.0f} B/update "
+          f"({full_bytes / stored_bytes:.1f}x smaller)")
+    print(f"  state_at:       p50 {statistics.median(latencies):.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} ms")
+    print(f"  reconstructions matching the true state: {matched}/{args.lookups}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Dispatching state updates through the trigger index.
+#
+#   python benchmarks/trigger_index_bench.py [--automations 10000] [--updates 20000]
+#
+# Indexes condition automations over a fleet of devices, then replays a
+# stream of state updates that each change one or two keys. Each update
+# is dispatched twice: through TriggerIndex.candidates(), as
+# check_device_triggers does, and by walking every compiled automation for
+# those watching a changed key. Both must fire the same automations.
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Automation  # noqa: E402
+from trigger_index import TriggerIndex, indexed_trigger  # noqa: E402
+
+KEYS = ('locked', 'battery', 'temperature', 'humidity', 'motion', 'door_open',
+        'brightness', 'power', 'signal', 'tamper')
+
+
+def random_trigger(rng, devices):
+    """Get trigger data for a device or, one time in five, a whole home."""
+    device_id = rng.choice(devices) if rng.random() >= 0.2 else None
+    key = rng.choice(KEYS)
+    if rng.random() < 0.5:
+        leaf = {'type': 'threshold', 'property': key,
+                'operator': rng.choice(('>', '<')), 'threshold': rng.random()}
+    else:
+        leaf = {'type': 'state_change', 'state': {key: True}}
+    if device_id is not None:
+        leaf['device_id'] = device_id
+    return leaf
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the automation trigger index')
+    parser.add_argument('--automations', type=int, default=10000)
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--homes', type=int, default=50)
+    parser.add_argument('--updates', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    devices = list(range(1, args.devices + 1))
+    homes = list(range(1, args.homes + 1))
+    device_home = {device_id: rng.choice(homes) for device_id in devices}
+
+    index = TriggerIndex()
+    triggers = []
+    began = time.perf_counter()
+    for automation_id in range(1, args.automations + 1):
+        trigger_data = random_trigger(rng, devices)
+        home_id = device_home.get(trigger_data.get('device_id'), rng.choice(homes))
+        trigger = indexed_trigger(Automation(
+            id=automation_id, home_id=home_id, trigger_type='condition',
+            trigger_data=trigger_data, is_enabled=True))
+        triggers.append(trigger)
+    index.apply({trigger.automation_id: trigger for trigger in triggers})
+    build_ms = (time.perf_counter() - began) * 1000
+
+    states = {device_id: {key: rng.random() for key in KEYS} for device_id in devices}
+    updates = []
+    for _ in range(args.updates):
+        device_id = rng.choice(devices)
+        old_state = states[device_id]
+        new_state = dict(old_state)
+        for key in rng.sample(KEYS, rng.choice((1, 2))):
+            new_state[key] = rng.random() if rng.random() < 0.8 else True
+        states[device_id] = new_state
+        updates.append((SimpleNamespace(id=device_id), device_home[device_id],
+                        old_state, new_state))
+
+    def lookup(device_id):
+        return states.get(device_id)
+
+    indexed_times, scan_times = [], []
+    fired_indexed = fired_scan = examined = 0
+    for device, home_id, old_state, new_state in updates:
+        changed = [key for key in new_state if old_state.get(key) != new_state[key]]
+
+        began = time.perf_counter()
+        candidates = index.candidates(device.id, home_id, changed)
+        fired = {trigger.automation_id for trigger in candidates
+                 if trigger.condition.test(device, old_state, new_state, lookup)}
+        indexed_times.append(time.perf_counter() - began)
+        examined += len(candidates)
+
+        began = time.perf_counter()
+        # Walk every automation for those watching a changed key of the
+        # device or of any device in its home
+        changed_keys = set(changed)
+        expected = {trigger.automation_id for trigger in triggers
+                    if any(key in changed_keys and (watched == device.id or (
+                        watched is None and trigger.home_id == home_id))
+                        for watched, key in trigger.watches)
+                    and trigger.condition.test(device, old_state, new_state, lookup)}
+        scan_times.append(time.perf_counter() - began)
+
+        if fired != expected:
+            sys.exit(f"Index fired {sorted(fired)}, scan fired {sorted(expected)}")
+        fired_indexed += len(fired)
+        fired_scan += len(expected)
+
+    def summary(times):
+        times = sorted(times)
+        return (f"p50 {statistics.median(times) * 1e6:8.1f} us, "
+                f"p99 {times[int(len(times) * 0.99) - 1] * 1e6:8.1f} us, "
+                f"{len(times) / sum(times):10.0f} updates/s")
+
+    print(f"{args.automations} automations over {args.devices} devices in {args.homes} homes; "
+          f"index built in {build_ms:.0f} ms")
+    print(f"{args.updates} state updates, {fired_indexed} fires "
+          f"(scan: {fired_scan}), {examined / args.updates:.1f} candidates per update")
+    print(f"  trigger index: {summary(indexed_times)}")
+    print(f"  full scan:     {summary(scan_times)}")
+
+
+if __name__ == '__main__':
+    main()
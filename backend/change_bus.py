@@ -0,0 +1,148 @@
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+import json_codec
+import logging
+
+logger = logging.getLogger(__name__)
+
+MEMORY_BUS_SCHEME = 'memory://'
+# Delivered locally after the transport reconnects, since notifications
+# sent while disconnected are lost and caches must reload
+RESYNC = 'resync'
+
+
+class MemoryTransport:
+    """In-process stand-in for Redis pub/sub.
+
+    Transports opened on the same ``memory://<channel>`` URL receive what
+    the others send, on a thread of their own as with Redis. For tests
+    and single-host experiments only.
+    """
+
+    # channel -> inboxes of the transports listening on it
+    _inboxes: Dict[str, List[queue.Queue]] = {}
+    _inboxes_lock = threading.Lock()
+
+    def __init__(self, channel: str, on_message: Callable[[bytes], None]):
+        self._channel = channel
+        self._on_message = on_message
+        self._inbox = queue.Queue()
+        with self._inboxes_lock:
+            self._inboxes.setdefault(channel, []).append(self._inbox)
+        threading.Thread(target=self._run, name='change-bus', daemon=True).start()
+
+    def send(self, message: bytes) -> None:
+        with self._inboxes_lock:
+            inboxes = list(self._inboxes.get(self._channel, ()))
+        for inbox in inboxes:
+            inbox.put(message)
+
+    def _run(self):
+        while True:
+            self._on_message(self._inbox.get())
+
+
+class RedisTransport:
+    """Redis pub/sub on one channel, resubscribing after connection loss."""
+
+    def __init__(self, url: str, channel: str, on_message: Callable[[bytes], None],
+                 on_resync: Callable[[], None]):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._channel = channel
+        self._on_message = on_message
+        self._on_resync = on_resync
+        threading.Thread(target=self._run, name='change-bus', daemon=True).start()
+
+    def send(self, message: bytes) -> None:
+        self._client.publish(self._channel, message)
+
+    def _run(self):
+        connected_before = False
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                if connected_before:
+                    self._on_resync()
+                connected_before = True
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._on_message(message['data'])
+            except Exception as e:
+                logger.error(f"Change bus connection lost: {str(e)}")
+                time.sleep(1)
+
+
+class ChangeBus:
+    """Tells the other worker processes what this one changed.
+
+    Each process keeps caches (device registry, ETag versions, scheduled
+    automations); after a commit the owner of a cache publishes the ids
+    it changed here, and the other processes apply them to their copies.
+    Without ``CHANGE_BUS_URL`` nothing leaves the process.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[Any], None]]] = {}
+        self._origin = uuid.uuid4().hex
+        self._transport = None
+        self._app = None
+
+    def init_app(self, app) -> None:
+        """Connect to the bus named by ``CHANGE_BUS_URL``, if any.
+
+        Raises:
+            ValueError: If the URL scheme is not supported
+        """
+        self._app = app
+        url = app.config.get('CHANGE_BUS_URL')
+        channel = app.config.get('CHANGE_BUS_CHANNEL', 'doorlock-changes')
+        if self._transport is not None or not url:
+            return
+        if url.startswith(MEMORY_BUS_SCHEME):
+            self._transport = MemoryTransport(
+                url[len(MEMORY_BUS_SCHEME):] or channel, self._receive)
+        elif url.startswith(('redis://', 'rediss://')):
+            self._transport = RedisTransport(url, channel, self._receive, self._resync)
+        else:
+            raise ValueError(f"Unsupported change bus: {url}")
+        logger.info(f"Change bus connected: {url}")
+
+    def subscribe(self, topic: str, handler: Callable[[Any], None]) -> None:
+        """Call a handler, inside an app context, for changes from elsewhere."""
+        handlers = self._handlers.setdefault(topic, [])
+        if handler not in handlers:
+            handlers.append(handler)
+
+    def publish(self, topic: str, data: Any) -> None:
+        """Send a change to the other processes; never fails the caller."""
+        if self._transport is None:
+            return
+        try:
+            self._transport.send(json_codec.dumpb(
+                {'origin': self._origin, 'topic': topic, 'data': data}))
+        except Exception as e:
+            logger.error(f"Error publishing {topic} change: {str(e)}")
+
+    def _receive(self, message: bytes):
+        try:
+            message = json_codec.loads(message)
+            if message['origin'] != self._origin:
+                self._dispatch(message['topic'], message['data'])
+        except Exception as e:
+            logger.error(f"Error applying change notification: {str(e)}")
+
+    def _resync(self):
+        self._dispatch(RESYNC, None)
+
+    def _dispatch(self, topic: str, data: Any):
+        with self._app.app_context():
+            for handler in self._handlers.get(topic, ()):
+                handler(data)
+
+
+change_bus = ChangeBus()
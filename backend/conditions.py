@@ -0,0 +1,181 @@
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+# (device_id or None for "any device in the home", state key)
+Watch = Tuple[Optional[int], str]
+
+# Returns the current state of another device, used by compound conditions
+StateLookup = Callable[[int], Optional[Dict[str, Any]]]
+
+# test(device, old_state, new_state, lookup) -> bool
+Predicate = Callable[[Any, Dict, Dict, Optional[StateLookup]], bool]
+
+
+class Condition:
+    """Compiled automation condition.
+
+    Built once from ``trigger_data`` by :func:`compile_condition`. ``test``
+    is a plain closure with operators and thresholds already resolved, so
+    evaluating it does no dict walking or string dispatch; call it with the
+    device whose state changed, its old and new state and a lookup for the
+    state of other devices.
+    """
+
+    __slots__ = ('test', 'watches')
+
+    def __init__(self, test: Predicate, watches: List[Watch]):
+        self.test = test
+        self.watches = tuple(dict.fromkeys(watches))
+
+    def __call__(self, device, old_state: Dict, new_state: Dict,
+                 lookup: Optional[StateLookup] = None) -> bool:
+        return self.test(device, old_state, new_state, lookup)
+
+
+def compile_condition(trigger_data: Dict) -> Condition:
+    """Compile condition ``trigger_data`` into a Condition.
+
+    Supported types are ``state_change``, ``threshold`` and the compound
+    ``and``/``or`` (with a ``conditions`` list) and ``not`` (with a single
+    ``condition``). Leaves may name a ``device_id``; a leaf about a device
+    other than the one that changed is tested against that device's
+    current state.
+
+    Raises:
+        ValueError: If the trigger data is malformed
+    """
+    test, watches = _compile(trigger_data)
+    return Condition(test, watches)
+
+
+def _compile(trigger_data: Dict) -> Tuple[Predicate, List[Watch]]:
+    condition_type = trigger_data.get('type')
+    device_id = trigger_data.get('device_id')
+
+    if condition_type == 'state_change':
+        targets = tuple((trigger_data.get('state') or {}).items())
+        return (_state_change(targets, device_id),
+                [(device_id, key) for key, _ in targets])
+
+    elif condition_type == 'threshold':
+        prop = trigger_data.get('property')
+        if not prop:
+            raise ValueError("Threshold condition needs a property")
+        op = trigger_data.get('operator', '>')
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {op}")
+        return (_threshold(prop, OPERATORS[op], trigger_data.get('threshold'), device_id),
+                [(device_id, prop)])
+
+    elif condition_type in ('and', 'or'):
+        compiled = [_compile(sub) for sub in trigger_data.get('conditions', [])]
+        if not compiled:
+            raise ValueError(
+                f"'{condition_type}' condition needs sub-conditions")
+        tests = tuple(test for test, _ in compiled)
+        watches = [watch for _, sub_watches in compiled for watch in sub_watches]
+        if condition_type == 'and':
+            def test(device, old_state, new_state, lookup=None):
+                for sub in tests:
+                    if not sub(device, old_state, new_state, lookup):
+                        return False
+                return True
+        else:
+            def test(device, old_state, new_state, lookup=None):
+                for sub in tests:
+                    if sub(device, old_state, new_state, lookup):
+                        return True
+                return False
+        return test, watches
+
+    elif condition_type == 'not':
+        if not trigger_data.get('condition'):
+            raise ValueError("'not' condition needs a sub-condition")
+        inner, watches = _compile(trigger_data['condition'])
+
+        def test(device, old_state, new_state, lookup=None):
+            return not inner(device, old_state, new_state, lookup)
+        return test, watches
+
+    return _never, []
+
+
+def _state_change(targets, device_id) -> Predicate:
+    """True when a target key changes to its value. For a device other
+    than the one that changed, true while it is in the target state."""
+    def test(device, old_state, new_state, lookup=None):
+        if device_id is not None and (device is None or device.id != device_id):
+            state = lookup(device_id) if lookup else None
+            if not state:
+                return False
+            for key, value in targets:
+                if state.get(key) == value:
+                    return True
+            return False
+
+        if not old_state or not new_state:
+            return False
+        for key, value in targets:
+            if new_state.get(key) == value and old_state.get(key) != value:
+                return True
+        return False
+    return test
+
+
+def _threshold(prop, compare, threshold, device_id) -> Predicate:
+    """True when a state value compares against a threshold. Numeric
+    thresholds are coerced once; string readings are coerced per call."""
+    threshold, numeric = _coerce(threshold)
+
+    def test(device, old_state, new_state, lookup=None):
+        if device_id is not None and (device is None or device.id != device_id):
+            new_state = lookup(device_id) if lookup else None
+        if not new_state:
+            return False
+
+        value = new_state.get(prop)
+        if value is None:
+            return False
+        if numeric and isinstance(value, str):
+            value, is_number = _coerce(value)
+            if not is_number:
+                return False
+        try:
+            return compare(value, threshold)
+        except TypeError:
+            return False
+    return test
+
+
+def _never(device, old_state, new_state, lookup=None):
+    return False
+
+
+def _coerce(value) -> Tuple[Any, bool]:
+    """Convert numbers and numeric strings to float.
+
+    Returns:
+        tuple: (value, whether it is numeric)
+    """
+    if isinstance(value, bool):
+        return value, False
+    if isinstance(value, (int, float)):
+        return float(value), True
+    if isinstance(value, str):
+        try:
+            return float(value), True
+        except ValueError:
+            pass
+    return value, False
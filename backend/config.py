@@ -14,6 +14,8 @@ class Config:
     JWT_COOKIE_SECURE = False  # Set to True in production
     JWT_COOKIE_CSRF_PROTECT = True
     JWT_ERROR_MESSAGE_KEY = 'error'
+    PRINCIPAL_CACHE_TTL = 30  # seconds a user's role/active flag is cached
+    PRINCIPAL_CACHE_SIZE = 1024  # users kept in the principal cache
 
     # Admin User
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
@@ -47,7 +49,10 @@ class Config:
     CORS_ORIGINS = ['http://localhost:3000']
     CORS_METHODS = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS']
     CORS_ALLOW_HEADERS = ['Content-Type', 'Authorization']
-    CORS_EXPOSE_HEADERS = ['Content-Range', 'X-Total-Count']
+    CORS_EXPOSE_HEADERS = ['Content-Range', 'X-Total-Count', 'X-Next-Cursor', 'ETag']
+
+    # JSON: orjson, msgspec, json, or auto for the fastest installed codec
+    JSON_CODEC = 'auto'
 
     # Rate Limiting
     RATELIMIT_DEFAULT = "200 per day"
@@ -71,11 +76,66 @@ class Config:
     SOCKETIO_PING_TIMEOUT = 10
     SOCKETIO_PING_INTERVAL = 25
     SOCKETIO_ASYNC_MODE = 'eventlet'
+    # Queue relaying emits between worker processes: redis://... or, for
+    # tests, memory://<channel>. Unset for a single process.
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    # Pub/sub channel telling other workers which cached devices, owners
+    # and automations changed: redis://... or memory://<channel> for tests
+    CHANGE_BUS_URL = os.environ.get('CHANGE_BUS_URL')
 
     # Device Settings
     DEVICE_PING_TIMEOUT = 60  # seconds
     DEVICE_OFFLINE_THRESHOLD = 300  # seconds
     MAX_QUEUE_SIZE = 100  # maximum scripts in queue per device
+    SCRIPT_LEASE_SECONDS = 600  # seconds a claimed script may run before it is handed out again
+    SCRIPT_QUEUE_RETAIN = 20  # finished queue items kept per device
+    SCRIPT_QUEUE_MAX_WAIT = 30  # seconds a queue long-poll may block
+    HEARTBEAT_FLUSH_INTERVAL = 5  # seconds between ping time flushes
+    MAX_HEARTBEAT_BATCH = 500  # maximum devices per bulk heartbeat request
+    DEVICE_MISS_TTL = 5  # seconds an unknown MAC is answered without a query
+    DEVICES_PAGE_SIZE = 100  # default devices per /api/devices page
+    MAX_DEVICES_PAGE_SIZE = 500  # largest page a client may ask for
+    STATE_FLUSH_INTERVAL = 0.25  # seconds device state updates are merged for
+    STATE_BATCH_SIZE = 500  # maximum devices written per state transaction
+    STATE_WRITE_ATTEMPTS = 5  # failed writes before a device's state update is dropped
+    SOCKET_BATCH_INTERVAL = 0.25  # seconds of device events merged per socket frame
+    EVENTS_PAGE_SIZE = 100  # default events per /api/devices/<mac>/events page
+    MAX_EVENTS_PAGE_SIZE = 1000  # largest events page a client may ask for
+    STATE_KEYFRAME_INTERVAL = 50  # state changes per full snapshot in event history
+    TELEMETRY_FLUSH_INTERVAL = 5  # seconds sensor readings are buffered before rollup
+    TELEMETRY_WRITE_ATTEMPTS = 5  # failed flushes before rollups are written per device
+    TELEMETRY_MAX_POINTS = 500  # default buckets per key in a telemetry response
+    # Days each rollup resolution (seconds per bucket) is kept; None keeps forever
+    TELEMETRY_RETENTION_DAYS = {60: 7, 3600: 180, 86400: None}
+    EVENT_RETENTION_DAYS = 90  # device events older than this are removed
+    EVENT_PARTITIONS_AHEAD = 2  # monthly event partitions created in advance
+    EVENT_MAINTENANCE_INTERVAL = 3600  # seconds between retention runs
+    EVENT_PRUNE_BATCH = 5000  # rows per delete when pruning without partitions
+    MAX_IMPORT_ROWS = 10000  # largest /api/devices/import upload, in devices
+    IMPORT_BATCH_SIZE = 1000  # devices per INSERT statement during an import
+    EXPORT_BATCH_SIZE = 500  # devices read per query while streaming an export
+
+    # Protocols
+    PROTOCOL_CONFIGS = {
+        'mqtt': {
+            'host': os.environ.get('MQTT_BROKER_HOST', 'localhost'),
+            'port': int(os.environ.get('MQTT_BROKER_PORT', 1883)),
+            # Messages waiting for the database writer, and what to do
+            # when that fills up: drop_oldest, coalesce or block
+            'ingest_queue_size': 10000,
+            'ingest_overflow': 'coalesce',
+            # Workers in the same shared subscription group split device
+            # messages between them instead of each receiving all of them
+            'shared_group': os.environ.get('MQTT_SHARED_GROUP')
+        }
+    }
+    PROTOCOL_HEALTH_INTERVAL = 15  # seconds between adapter health checks
+    PROTOCOL_RECONNECT_MAX_DELAY = 60  # seconds, cap for reconnect backoff
+
+    # Automations
+    ACTION_WORKERS = 4  # threads running automation and scene actions
+    ACTION_QUEUE_SIZE = 1000  # queued action sequences before dropping
+    SCENE_MAX_CONCURRENCY = 4  # parallel actions per scene
 
     # Cache
     CACHE_TYPE = 'simple'
@@ -91,6 +151,7 @@ class DevelopmentConfig(Config):
 
     # Development-specific settings
     SEND_FILE_MAX_AGE_DEFAULT = 0
+    QUERY_BUDGET = 10  # warn when a request runs more SQL statements
     TEMPLATES_AUTO_RELOAD = True
 
     # Mail settings for development
@@ -112,6 +173,7 @@ class TestingConfig(Config):
     BCRYPT_LOG_ROUNDS = 4  # Lower for faster tests
     RATELIMIT_ENABLED = False
     MAIL_SUPPRESS_SEND = True
+    QUERY_BUDGET = 10
 
 
 class ProductionConfig(Config):
@@ -130,6 +192,10 @@ class ProductionConfig(Config):
     # Production-specific settings
     RATELIMIT_STORAGE_URL = os.environ.get(
         'REDIS_URL', 'redis://redis:6379/0')
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get(
+        'SOCKETIO_MESSAGE_QUEUE', os.environ.get('REDIS_URL', 'redis://redis:6379/0'))
+    CHANGE_BUS_URL = os.environ.get(
+        'CHANGE_BUS_URL', os.environ.get('REDIS_URL', 'redis://redis:6379/0'))
     LOG_LEVEL = 'ERROR'
     CACHE_TYPE = 'redis'
     CACHE_REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/1')
@@ -167,6 +233,8 @@ class StagingConfig(ProductionConfig):
     # Different Redis instance for staging
     RATELIMIT_STORAGE_URL = os.environ.get('STAGING_REDIS_URL')
     CACHE_REDIS_URL = os.environ.get('STAGING_REDIS_URL')
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('STAGING_REDIS_URL')
+    CHANGE_BUS_URL = os.environ.get('STAGING_REDIS_URL')
 
 
 config = {
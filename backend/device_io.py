@@ -0,0 +1,349 @@
+import csv
+import io
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Device, DeviceType, Script
+from device_registry import device_registry
+from device_versions import device_versions
+from change_bus import change_bus
+import json_codec
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Import and export formats; JSON arrays (the shape of devices.json) are
+# accepted on import as well
+FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_FIELDS = ('mac_address', 'name', 'emoji', 'description', 'device_type',
+              'last_ping_time', 'scripts')
+# Values of omitted fields for devices that do not exist yet
+DEFAULTS = {
+    'name': 'Unknown',
+    'emoji': '',
+    'description': None,
+    'device_type': DeviceType.CUSTOM,
+    'last_ping_time': 0.0,
+}
+UPDATED_FIELDS = tuple(DEFAULTS) + ('updated_at',)
+
+INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+MAC_LENGTH = 17
+MAC_SEPARATORS = np.arange(2, MAC_LENGTH, 3)
+
+
+def valid_macs(macs: Sequence[str]) -> np.ndarray:
+    """Check MAC addresses the way Device.validate_mac_address does, at once.
+
+    The addresses are laid out as a matrix of code points, one row each,
+    and every position is checked for a hex digit or a ``:``/``-``
+    separator with array comparisons.
+
+    Returns:
+        np.ndarray: One bool per address
+    """
+    if not len(macs):
+        return np.zeros(0, dtype=bool)
+    text = np.array(macs, dtype=str)
+    valid = np.char.str_len(text) == MAC_LENGTH
+    codes = text.astype(f'U{MAC_LENGTH}').view(np.uint32).reshape(len(macs), MAC_LENGTH)
+    lower = codes | 0x20
+    hex_digit = ((codes >= ord('0')) & (codes <= ord('9'))) | \
+        ((lower >= ord('a')) & (lower <= ord('f')))
+    separator = (codes == ord(':')) | (codes == ord('-'))
+    expected = np.zeros(MAC_LENGTH, dtype=bool)
+    expected[MAC_SEPARATORS] = True
+    return valid & np.where(expected, separator, hex_digit).all(axis=1)
+
+
+def parse(data: str, fmt: str) -> List[Tuple[int, Any]]:
+    """Split an import into rows.
+
+    Args:
+        data: The uploaded text
+        fmt: ``jsonl``, ``csv`` or ``json``
+
+    Returns:
+        List[Tuple[int, Any]]: Line (record number for JSON arrays) and
+            row, which is a dict, or a ValueError for rows that do not parse
+
+    Raises:
+        ValueError: If the format is unknown or a JSON array does not parse
+    """
+    if fmt == 'json':
+        rows = json_codec.loads(data)
+        if not isinstance(rows, list):
+            raise ValueError("Expected a JSON array of devices")
+        return list(enumerate(rows, start=1))
+    if fmt == 'jsonl':
+        rows = []
+        for line, text in enumerate(data.splitlines(), start=1):
+            if not text.strip():
+                continue
+            try:
+                rows.append((line, json_codec.loads(text)))
+            except ValueError:
+                rows.append((line, ValueError("Invalid JSON")))
+        return rows
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(data))
+        rows = []
+        for row in reader:
+            row = {key: value for key, value in row.items()
+                   if key is not None and value not in (None, '')}
+            if row.get('scripts'):
+                try:
+                    row['scripts'] = json_codec.loads(row['scripts'])
+                except ValueError:
+                    row = ValueError("scripts must be a JSON object")
+            rows.append((reader.line_num, row))
+        return rows
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _fields(row: Any) -> Dict[str, Any]:
+    """Get the importable fields of a row.
+
+    Raises:
+        ValueError: With the message reported for the row
+    """
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("Expected an object")
+    fields = {}
+    for key, limit in (('name', 100), ('emoji', 10), ('description', None)):
+        if row.get(key) is not None:
+            value = row[key]
+            if not isinstance(value, str) or (limit and len(value) > limit):
+                raise ValueError(f"{key} must be a string of at most {limit} characters"
+                                 if limit else f"{key} must be a string")
+            fields[key] = value
+    if row.get('device_type') is not None:
+        try:
+            fields['device_type'] = DeviceType(str(row['device_type']).lower())
+        except ValueError:
+            raise ValueError(f"Unknown device_type: {row['device_type']}")
+    if row.get('last_ping_time') is not None:
+        try:
+            fields['last_ping_time'] = float(row['last_ping_time'])
+        except (TypeError, ValueError):
+            raise ValueError("last_ping_time must be a number")
+    scripts = row.get('scripts')
+    if scripts is not None:
+        if not isinstance(scripts, dict) or not all(
+                isinstance(name, str) and 0 < len(name) <= 100 and isinstance(content, str)
+                for name, content in scripts.items()):
+            raise ValueError("scripts must map names to script contents")
+        fields['scripts'] = scripts
+    return fields
+
+
+def import_devices(rows: List[Tuple[int, Any]], owner_id: int, is_admin: bool = False,
+                   dry_run: bool = False, batch_size: int = 1000) -> Optional[Dict[str, Any]]:
+    """Create or update many devices and their scripts in one transaction.
+
+    MACs are validated in one vectorized pass, then each batch of devices
+    is written with a single multi-row ``INSERT ... ON CONFLICT`` and
+    their scripts with another. Fields a row omits keep their stored
+    values, or take the defaults for new devices; scripts a row lists
+    are created or replaced and others are left alone. New devices
+    belong to ``owner_id``; existing ones keep their owner, and only
+    admins may update devices owned by someone else.
+
+    Args:
+        rows: Rows as returned by parse()
+        owner_id: ID of the importing user
+        is_admin: Whether the importing user is an admin
+        dry_run: Validate and report without writing
+        batch_size: Devices per INSERT statement
+
+    Returns:
+        Optional[Dict[str, Any]]: Counts of ``created`` and ``updated``
+            devices and ``scripts``, and ``errors`` with the line, MAC and
+            message of each rejected row; None if the write failed
+    """
+    errors = []
+    macs = [row.get('mac_address') if isinstance(row, dict) else None for _, row in rows]
+    macs = [mac.strip() if isinstance(mac, str) else '' for mac in macs]
+    valid = valid_macs(macs)
+    # Only the first row of a MAC is imported
+    first = np.zeros(len(macs), dtype=bool)
+    if macs:
+        first[np.unique(np.array(macs, dtype=str), return_index=True)[1]] = True
+
+    accepted: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    for index, (line, row) in enumerate(rows):
+        mac = macs[index]
+        try:
+            fields = _fields(row)
+            if not valid[index]:
+                raise ValueError("Invalid MAC address")
+            if not first[index]:
+                raise ValueError(f"Duplicate MAC address {mac}")
+        except ValueError as e:
+            errors.append({'line': line, 'mac_address': mac or None, 'error': str(e)})
+            continue
+        accepted[mac] = (line, fields)
+
+    existing = {}
+    accepted_macs = list(accepted)
+    for start in range(0, len(accepted_macs), batch_size):
+        for row in db.session.execute(
+                select(Device.mac_address, Device.owner_id, *(
+                    getattr(Device, field) for field in DEFAULTS))
+                .where(Device.mac_address.in_(accepted_macs[start:start + batch_size]))):
+            existing[row.mac_address] = row._asdict()
+
+    now = datetime.utcnow()
+    values = []
+    scripts = {}
+    for mac, (line, fields) in accepted.items():
+        current = existing.get(mac)
+        if current is not None and current['owner_id'] != owner_id and not is_admin:
+            errors.append({'line': line, 'mac_address': mac,
+                           'error': "Device belongs to another user"})
+            continue
+        # Every row of a multi-row INSERT needs the same columns; those
+        # not in UPDATED_FIELDS only apply to new devices
+        row = {**DEFAULTS, 'owner_id': owner_id, 'created_at': now, 'status': 'offline',
+               'capabilities': [], 'state': {}, 'config': {}, **(current or {})}
+        if 'scripts' in fields:
+            scripts[mac] = fields.pop('scripts')
+        row.update(fields, mac_address=mac, updated_at=now)
+        values.append(row)
+
+    report = {
+        'created': sum(1 for row in values if row['mac_address'] not in existing),
+        'updated': sum(1 for row in values if row['mac_address'] in existing),
+        'scripts': sum(len(device_scripts) for device_scripts in scripts.values()),
+        'errors': sorted(errors, key=lambda error: error['line']),
+        'dry_run': dry_run
+    }
+    if dry_run or not values:
+        return report
+
+    try:
+        written = {}
+        for start in range(0, len(values), batch_size):
+            written.update(_upsert_devices(values[start:start + batch_size], is_admin))
+        script_rows = [{'device_id': written[mac][0], 'name': name, 'content': content,
+                        'created_at': now, 'updated_at': now}
+                       for mac, device_scripts in scripts.items() if mac in written
+                       for name, content in device_scripts.items()]
+        for start in range(0, len(script_rows), batch_size):
+            _upsert_scripts(script_rows[start:start + batch_size])
+        db.session.commit()
+        report['scripts'] = len(script_rows)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error importing devices: {str(e)}")
+        return None
+
+    # Claimed by another user between the check and the write
+    for row in values:
+        if row['mac_address'] not in written:
+            report['created' if row['mac_address'] not in existing else 'updated'] -= 1
+            report['errors'].append({'line': accepted[row['mac_address']][0],
+                                     'mac_address': row['mac_address'],
+                                     'error': "Device belongs to another user"})
+    report['errors'].sort(key=lambda error: error['line'])
+
+    # Core statements skip the mapper events that keep caches current
+    device_ids = [device_id for device_id, _ in written.values()]
+    device_registry.reload(device_ids)
+    change_bus.publish('devices', device_ids)
+    device_versions.bump({owner for _, owner in written.values()})
+    logger.info(f"Imported {len(written)} devices ({report['created']} new)")
+    return report
+
+
+def _upsert_devices(rows: List[Dict[str, Any]], is_admin: bool) -> Dict[str, Tuple[int, int]]:
+    """Write one batch of devices; returns MAC -> (id, owner id) of those written."""
+    table = Device.__table__
+    statement = INSERTS[db.engine.dialect.name](table).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=['mac_address'],
+        set_={field: statement.excluded[field] for field in UPDATED_FIELDS},
+        # Leaves devices another user created meanwhile untouched
+        where=None if is_admin else table.c.owner_id == statement.excluded.owner_id
+    ).returning(table.c.mac_address, table.c.id, table.c.owner_id)
+    return {mac: (device_id, owner) for mac, device_id, owner in db.session.execute(statement)}
+
+
+def _upsert_scripts(rows: List[Dict[str, Any]]):
+    table = Script.__table__
+    statement = INSERTS[db.engine.dialect.name](table).values(rows)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['device_id', 'name'],
+        set_={'content': statement.excluded.content,
+              'updated_at': statement.excluded.updated_at}))
+
+
+def export_devices(fmt: str, owner_id: Optional[int] = None,
+                   batch_size: int = 500) -> Iterator[str]:
+    """Stream devices in the import format, a batch of devices at a time.
+
+    Batches are read by id ranges, each with its scripts, so memory stays
+    flat however many devices there are. Must be iterated inside an
+    application context.
+
+    Args:
+        fmt: ``jsonl`` or ``csv``
+        owner_id: Only export this user's devices, or None for all
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    if fmt == 'csv':
+        yield _csv_line(CSV_FIELDS)
+
+    after = 0
+    while True:
+        query = select(Device.id, Device.mac_address, *(
+            getattr(Device, field) for field in DEFAULTS))\
+            .where(Device.id > after).order_by(Device.id).limit(batch_size)
+        if owner_id is not None:
+            query = query.where(Device.owner_id == owner_id)
+        devices = db.session.execute(query).all()
+        if not devices:
+            return
+        after = devices[-1].id
+
+        scripts: Dict[int, Dict[str, str]] = {}
+        for device_id, name, content in db.session.execute(
+                select(Script.device_id, Script.name, Script.content)
+                .where(Script.device_id.in_([device.id for device in devices]))
+                .order_by(Script.device_id, Script.name)):
+            scripts.setdefault(device_id, {})[name] = content
+
+        chunk = []
+        for device in devices:
+            row = device._asdict()
+            device_id = row.pop('id')
+            row['device_type'] = row['device_type'].value if row['device_type'] else None
+            row['scripts'] = scripts.get(device_id, {})
+            if fmt == 'jsonl':
+                chunk.append(json_codec.dumps(row) + '\n')
+            else:
+                row['scripts'] = json_codec.dumps(row['scripts'])
+                chunk.append(_csv_line(row.get(field) for field in CSV_FIELDS))
+        yield ''.join(chunk)
+
+
+def _csv_line(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow(
+        '' if value is None else value for value in values)
+    return buffer.getvalue()
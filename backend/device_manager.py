@@ -1,10 +1,50 @@
 import time
+from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+from flask import current_app
+from sqlalchemy import and_, bindparam, func, or_, update
 from models import db, Device, Script, ScriptQueue
+from auth import resolved_device
+from heartbeat import heartbeats
+from device_versions import device_versions
+from device_registry import device_registry
+from queue_notifier import queue_notifier
+import repository
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Gap left between consecutive queue positions so items can be inserted
+# or moved without renumbering the rest of the queue
+QUEUE_POSITION_STEP = 1024
+
+# Items respread in front of a move target once there is no gap left
+REORDER_WINDOW = 16
+
+# Attempts at claiming the queue head before giving up on contention
+CLAIM_RETRIES = 5
+
+# Queue statuses an item leaves the queue in
+FINISHED_STATUSES = ('completed', 'failed')
+
+# Optional device fields accepted alongside a heartbeat
+HEARTBEAT_FIELDS = ('status', 'firmware_version', 'ip_address')
+
+
+def _find_device(mac_address: str) -> Optional[Device]:
+    """Get a device by MAC, reusing the one the request already resolved."""
+    device = resolved_device(mac_address)
+    if device is None:
+        record = device_registry.find(mac_address)
+        device = db.session.get(Device, record.id) if record else None
+    return device
+
+
+def _find_device_id(mac_address: str) -> Optional[int]:
+    """Get a device's id by MAC from the device registry."""
+    record = device_registry.find(mac_address)
+    return record.id if record else None
+
 
 def load_devices() -> Dict[str, Device]:
     """Load all devices from the database."""
@@ -19,7 +59,7 @@ def load_devices() -> Dict[str, Device]:
 def add_device(mac_address: str, name: str = "Unknown", emoji: str = "", scripts: Dict[str, str] = None) -> bool:
     """Add a new device to the database."""
     try:
-        if Device.query.filter_by(mac_address=mac_address).first():
+        if device_registry.find(mac_address):
             logger.warning(f"Device with MAC {mac_address} already exists")
             return False
 
@@ -45,7 +85,7 @@ def add_device(mac_address: str, name: str = "Unknown", emoji: str = "", scripts
 def remove_device(mac_address: str) -> bool:
     """Remove a device from the database."""
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        device = _find_device(mac_address)
         if device:
             db.session.delete(device)
             db.session.commit()
@@ -61,7 +101,7 @@ def remove_device(mac_address: str) -> bool:
 def fetch_scripts_for_device(mac_address: str) -> Dict[str, str]:
     """Fetch all scripts for a device."""
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        device = _find_device(mac_address)
         if device:
             return {script.name: script.content for script in device.scripts}
         logger.warning(f"Device with MAC {mac_address} not found")
@@ -74,7 +114,7 @@ def fetch_scripts_for_device(mac_address: str) -> Dict[str, str]:
 def add_script_to_device(mac_address: str, script_name: str, script_content: str) -> bool:
     """Add a script to a device."""
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        device = _find_device(mac_address)
         if not device:
             logger.warning(f"Device with MAC {mac_address} not found")
             return False
@@ -102,7 +142,7 @@ def add_script_to_device(mac_address: str, script_name: str, script_content: str
 def remove_script_from_device(mac_address: str, script_name: str) -> bool:
     """Remove a script from a device."""
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        device = _find_device(mac_address)
         if not device:
             logger.warning(f"Device with MAC {mac_address} not found")
             return False
@@ -126,7 +166,7 @@ def remove_script_from_device(mac_address: str, script_name: str) -> bool:
 def enqueue_script(mac_address: str, script_name: str) -> bool:
     """Add a script to the device's execution queue."""
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        device = _find_device(mac_address)
         if not device:
             logger.warning(f"Device with MAC {mac_address} not found")
             return False
@@ -138,16 +178,25 @@ def enqueue_script(mac_address: str, script_name: str) -> bool:
                 f"Script {script_name} not found for device {mac_address}")
             return False
 
-        # Get the highest position in the queue
-        last_queue_item = ScriptQueue.query.filter_by(
-            device_id=device.id).order_by(ScriptQueue.position.desc()).first()
-        next_position = (last_queue_item.position +
-                         1) if last_queue_item else 0
+        queued = db.session.query(func.count(ScriptQueue.id))\
+            .filter(ScriptQueue.device_id == device.id,
+                    ScriptQueue.status.in_(('pending', 'running'))).scalar()
+        max_size = current_app.config['MAX_QUEUE_SIZE']
+        if queued >= max_size:
+            logger.warning(
+                f"Queue for device {mac_address} is full ({max_size} scripts)")
+            return False
+
+        # Append after the current tail; a single (device_id, position) index seek
+        tail = db.session.query(func.max(ScriptQueue.position))\
+            .filter(ScriptQueue.device_id == device.id).scalar()
+        next_position = tail + QUEUE_POSITION_STEP if tail is not None else 0
 
         queue_item = ScriptQueue(
             device=device, script=script, position=next_position)
         db.session.add(queue_item)
         db.session.commit()
+        queue_notifier.notify(mac_address)
         logger.info(
             f"Successfully enqueued script {script_name} for device {mac_address}")
         return True
@@ -161,7 +210,7 @@ def enqueue_script(mac_address: str, script_name: str) -> bool:
 def dequeue_script(mac_address: str, script_name: str) -> bool:
     """Remove a script from the device's execution queue."""
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        device = _find_device(mac_address)
         if not device:
             logger.warning(f"Device with MAC {mac_address} not found")
             return False
@@ -174,21 +223,13 @@ def dequeue_script(mac_address: str, script_name: str) -> bool:
             return False
 
         queue_item = ScriptQueue.query.filter_by(
-            device_id=device.id, script_id=script.id).first()
+            device_id=device.id, script_id=script.id, status='pending')\
+            .order_by(ScriptQueue.position).first()
         if queue_item:
-            removed_position = queue_item.position
+            # Positions are sparse, so the rest of the queue stays put
             db.session.delete(queue_item)
-
-            # Update positions of remaining items
-            remaining_items = ScriptQueue.query.filter(
-                ScriptQueue.device_id == device.id,
-                ScriptQueue.position > removed_position
-            ).all()
-
-            for item in remaining_items:
-                item.position -= 1
-
             db.session.commit()
+            queue_notifier.notify(mac_address)
             logger.info(
                 f"Successfully dequeued script {script_name} from device {mac_address}")
             return True
@@ -200,29 +241,410 @@ def dequeue_script(mac_address: str, script_name: str) -> bool:
         return False
 
 
-def update_last_ping_time(mac_address: str) -> bool:
-    """Update the last ping time for a device."""
+def pop_script(mac_address: str) -> Optional[Dict]:
+    """Remove and return the script at the head of the device's queue."""
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
-        if device:
-            device.last_ping_time = time.time()
-            db.session.commit()
-            logger.info(f"Updated last ping time for device {mac_address}")
-            return True
-        logger.warning(f"Device with MAC {mac_address} not found")
+        queue_item = ScriptQueue.query.join(Device)\
+            .filter(Device.mac_address == mac_address,
+                    ScriptQueue.status == 'pending')\
+            .order_by(ScriptQueue.position).first()
+        if not queue_item:
+            return None
+
+        data = {
+            'id': queue_item.id,
+            'name': queue_item.script.name,
+            'content': queue_item.script.content
+        }
+        db.session.delete(queue_item)
+        db.session.commit()
+        queue_notifier.notify(mac_address)
+        return data
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error popping script: {str(e)}")
+        return None
+
+
+def move_queued_script(mac_address: str, item_id: int, before_id: Optional[int] = None) -> bool:
+    """Move a queue item in front of another item, or to the tail.
+
+    The item takes the midpoint between its new neighbours. Only when two
+    neighbours have no gap left are the next ``REORDER_WINDOW`` items
+    respread, so a move runs a fixed number of statements.
+    """
+    try:
+        device = _find_device(mac_address)
+        if not device:
+            logger.warning(f"Device with MAC {mac_address} not found")
+            return False
+
+        item = ScriptQueue.query.filter_by(
+            id=item_id, device_id=device.id).first()
+        if not item:
+            logger.warning(
+                f"Queue item {item_id} not found for device {mac_address}")
+            return False
+
+        if before_id is None:
+            tail = db.session.query(func.max(ScriptQueue.position))\
+                .filter(ScriptQueue.device_id == device.id).scalar()
+            if tail != item.position:
+                item.position = tail + QUEUE_POSITION_STEP
+        else:
+            before = ScriptQueue.query.filter_by(
+                id=before_id, device_id=device.id).first()
+            if not before:
+                logger.warning(
+                    f"Queue item {before_id} not found for device {mac_address}")
+                return False
+
+            new_position = _position_before(device.id, before, item)
+            if new_position is None:
+                _open_gap(device.id, before)
+                new_position = _position_before(device.id, before, item)
+            if new_position is not None:
+                item.position = new_position
+
+        db.session.commit()
+        queue_notifier.notify(mac_address)
+        logger.info(
+            f"Moved queue item {item_id} for device {mac_address}")
+        return True
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error moving queued script: {str(e)}")
         return False
+
+
+def _position_before(device_id: int, before: ScriptQueue, item: ScriptQueue) -> Optional[int]:
+    """Pick a free position directly in front of ``before``.
+
+    Returns ``item.position`` if it is already there, or None if there is
+    no gap left between ``before`` and its predecessor.
+    """
+    previous = ScriptQueue.query.filter(
+        ScriptQueue.device_id == device_id,
+        ScriptQueue.position < before.position
+    ).order_by(ScriptQueue.position.desc()).first()
+
+    if previous is item or before is item:
+        return item.position
+    if previous is None:
+        return before.position - QUEUE_POSITION_STEP
+    if before.position - previous.position < 2:
+        return None
+    return (previous.position + before.position) // 2
+
+
+def _open_gap(device_id: int, before: ScriptQueue) -> None:
+    """Make room in front of ``before``.
+
+    ``before`` and the items after it, up to ``REORDER_WINDOW`` of them,
+    are spread evenly between its predecessor and the first item past the
+    window. If even that span is used up, everything from ``before`` on
+    is pushed back a step in one UPDATE.
+    """
+    previous = db.session.query(func.max(ScriptQueue.position)).filter(
+        ScriptQueue.device_id == device_id,
+        ScriptQueue.position < before.position).scalar()
+    window = ScriptQueue.query.filter(
+        ScriptQueue.device_id == device_id,
+        ScriptQueue.position >= before.position
+    ).order_by(ScriptQueue.position).limit(REORDER_WINDOW + 1).all()
+
+    if len(window) <= REORDER_WINDOW:
+        # The window reaches the tail, so there is no upper bound
+        step = QUEUE_POSITION_STEP
+    else:
+        step = (window.pop().position - previous) // (len(window) + 1)
+
+    if step >= 2:
+        for i, item in enumerate(window, 1):
+            item.position = previous + step * i
+    else:
+        ScriptQueue.query.filter(
+            ScriptQueue.device_id == device_id,
+            ScriptQueue.position >= before.position
+        ).update({'position': ScriptQueue.position + QUEUE_POSITION_STEP},
+                 synchronize_session='evaluate')
+    db.session.flush()
+
+
+def _claimable(now: datetime):
+    """Filter for queue items a claim may take: pending ones, and running
+    ones whose lease has expired because the device never finished them."""
+    expired = now - timedelta(seconds=current_app.config['SCRIPT_LEASE_SECONDS'])
+    return or_(
+        ScriptQueue.status == 'pending',
+        and_(ScriptQueue.status == 'running',
+             or_(ScriptQueue.claimed_at.is_(None), ScriptQueue.claimed_at < expired)))
+
+
+def claim_next_script(mac_address: str) -> Optional[Dict]:
+    """Atomically move the head of a device's queue from pending to running.
+
+    A running item whose lease (``SCRIPT_LEASE_SECONDS``) has expired, say
+    because the device died mid-script, is claimed again in its place.
+
+    On PostgreSQL the head row is locked with ``FOR UPDATE SKIP LOCKED`` so
+    concurrent workers each claim a different item. Other databases use a
+    conditional UPDATE that re-checks the item is claimable and retry if
+    another worker won the race.
+
+    Returns:
+        Optional[Dict]: The claimed item, or None if nothing is pending
+    """
+    try:
+        device_id = _find_device_id(mac_address)
+        if device_id is None:
+            logger.warning(f"Device with MAC {mac_address} not found")
+            return None
+
+        now = datetime.utcnow()
+        claimable = ScriptQueue.query.filter(
+            ScriptQueue.device_id == device_id, _claimable(now))\
+            .order_by(ScriptQueue.position)
+
+        reclaimed = False
+        if db.session.get_bind().dialect.name == 'postgresql':
+            item = claimable.with_for_update(skip_locked=True).first()
+            if item:
+                reclaimed = item.status == 'running'
+                item.status = 'running'
+                item.claimed_at = now
+        else:
+            item = None
+            for _ in range(CLAIM_RETRIES):
+                head = claimable.with_entities(
+                    ScriptQueue.id, ScriptQueue.status).first()
+                if head is None:
+                    break
+                claimed = ScriptQueue.query.filter(
+                    ScriptQueue.id == head.id, _claimable(now))\
+                    .update({'status': 'running', 'claimed_at': now},
+                            synchronize_session=False)
+                if claimed:
+                    # Re-read, in case the session already holds the row
+                    # as it was before the UPDATE
+                    item = db.session.get(ScriptQueue, head.id, populate_existing=True)
+                    reclaimed = head.status == 'running'
+                    break
+
+        if not item:
+            db.session.rollback()
+            return None
+        if reclaimed:
+            logger.warning(
+                f"Lease on queue item {item.id} for device {mac_address} "
+                f"expired; handing it out again")
+
+        data = {
+            'id': item.id,
+            'name': item.script.name,
+            'content': item.script.content,
+            'status': item.status
+        }
+        db.session.commit()
+        logger.info(
+            f"Device {mac_address} claimed queued script {data['name']}")
+        return data
+
     except Exception as e:
         db.session.rollback()
+        logger.error(f"Error claiming script: {str(e)}")
+        return None
+
+
+def wait_for_next_script(mac_address: str, timeout: float) -> Optional[Dict]:
+    """Claim the next queued script, waiting up to ``timeout`` seconds for
+    one to be enqueued if nothing is pending."""
+    deadline = time.monotonic() + timeout
+    while True:
+        version = queue_notifier.version(mac_address)
+        item = claim_next_script(mac_address)
+        remaining = deadline - time.monotonic()
+        if item or remaining <= 0:
+            return item
+
+        db.session.close()
+        if not queue_notifier.wait(mac_address, version, remaining):
+            return None
+
+
+def finish_script(mac_address: str, item_id: int, succeeded: bool, result: Optional[str] = None) -> bool:
+    """Record the outcome of a running queue item.
+
+    Only an item that is currently running on the given device can be
+    finished; it moves to ``completed`` or ``failed``. The device's oldest
+    finished items beyond ``SCRIPT_QUEUE_RETAIN`` are then deleted.
+    """
+    try:
+        device_id = _find_device_id(mac_address)
+        if device_id is None:
+            logger.warning(f"Device with MAC {mac_address} not found")
+            return False
+
+        status = 'completed' if succeeded else 'failed'
+        updated = ScriptQueue.query.filter_by(
+            id=item_id, device_id=device_id, status='running')\
+            .update({
+                'status': status,
+                'result': result,
+                'executed_at': datetime.utcnow()
+            }, synchronize_session=False)
+        if updated:
+            _prune_finished(device_id)
+        db.session.commit()
+
+        if not updated:
+            logger.warning(
+                f"No running queue item {item_id} for device {mac_address}")
+            return False
+        logger.info(
+            f"Queue item {item_id} on device {mac_address} {status}")
+        return True
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error finishing script: {str(e)}")
+        return False
+
+
+def _prune_finished(device_id: int) -> None:
+    """Delete a device's finished queue items beyond the newest
+    ``SCRIPT_QUEUE_RETAIN``."""
+    stale = [row.id for row in ScriptQueue.query
+             .with_entities(ScriptQueue.id)
+             .filter(ScriptQueue.device_id == device_id,
+                     ScriptQueue.status.in_(FINISHED_STATUSES))
+             .order_by(ScriptQueue.executed_at.desc(), ScriptQueue.id.desc())
+             .offset(current_app.config['SCRIPT_QUEUE_RETAIN'])]
+    if stale:
+        ScriptQueue.query.filter(ScriptQueue.id.in_(stale))\
+            .delete(synchronize_session=False)
+
+
+def fetch_script_queue(mac_address: str) -> List[Dict]:
+    """Fetch the pending script queue for a device in execution order."""
+    try:
+        items = repository.list_queue(mac_address)
+        return [{
+            'id': item.id,
+            'name': item.script.name,
+            'content': item.script.content,
+            'position': index,
+            'status': item.status
+        } for index, item in enumerate(items)]
+    except Exception as e:
+        logger.error(f"Error fetching script queue: {str(e)}")
+        return []
+
+
+def wait_for_script_queue(mac_address: str, timeout: float) -> List[Dict]:
+    """Fetch a device's script queue, waiting up to ``timeout`` seconds for
+    an item to be enqueued if it is currently empty."""
+    deadline = time.monotonic() + timeout
+    while True:
+        version = queue_notifier.version(mac_address)
+        items = fetch_script_queue(mac_address)
+        remaining = deadline - time.monotonic()
+        if items or remaining <= 0:
+            return items
+
+        # Give the connection back to the pool while blocked
+        db.session.close()
+        if not queue_notifier.wait(mac_address, version, remaining):
+            return []
+
+
+def update_last_ping_time(mac_address: str) -> bool:
+    """Record a ping for a device.
+
+    The ping time is held in the in-memory heartbeat table and written
+    to the database by its background flusher.
+    """
+    try:
+        heartbeats.record(mac_address)
+        logger.debug(f"Updated last ping time for device {mac_address}")
+        return True
+    except Exception as e:
         logger.error(f"Error updating ping time: {str(e)}")
         return False
 
 
+def heartbeat_field_error(entry: Dict) -> Optional[str]:
+    """Check a heartbeat's optional fields fit their device columns.
+
+    Returns:
+        Optional[str]: What is wrong with the entry, or None if it is valid
+    """
+    for field in HEARTBEAT_FIELDS:
+        value = entry.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            return f"{field} must be a string"
+        max_length = Device.__table__.c[field].type.length
+        if len(value) > max_length:
+            return f"{field} must be at most {max_length} characters"
+    return None
+
+
+def update_last_ping_times(entries: List[Dict]) -> bool:
+    """Record pings for many devices at once.
+
+    Each entry holds a ``mac_address`` and optionally ``status``,
+    ``firmware_version`` and ``ip_address``, already checked with
+    ``heartbeat_field_error``. Ping times go to the heartbeat table; the
+    optional fields are written with a single UPDATE statement.
+    """
+    try:
+        now = time.time()
+        rows = []
+        for entry in entries:
+            heartbeats.record(entry['mac_address'], now)
+            if any(entry.get(field) is not None for field in HEARTBEAT_FIELDS):
+                rows.append({
+                    'mac': entry['mac_address'],
+                    **{field: entry.get(field) for field in HEARTBEAT_FIELDS}
+                })
+
+        if rows:
+            devices = Device.__table__
+            stmt = update(devices)\
+                .where(devices.c.mac_address == bindparam('mac'))\
+                .values({
+                    field: func.coalesce(bindparam(field), devices.c[field])
+                    for field in HEARTBEAT_FIELDS
+                })
+            db.session.execute(stmt, rows)
+            db.session.commit()
+            device_versions.bump_for_macs(row['mac'] for row in rows)
+
+        logger.debug(f"Updated last ping time for {len(entries)} devices")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error updating ping times: {str(e)}")
+        return False
+
+
 def get_last_ping_time(mac_address: str) -> float:
-    """Get the last ping time for a device."""
+    """Get the last ping time for a device.
+
+    This worker's heartbeat table can be behind a ping another worker has
+    flushed, so the later of it and the stored time is returned.
+    """
     try:
-        device = Device.query.filter_by(mac_address=mac_address).first()
+        last_ping_time = heartbeats.get(mac_address)
+        device = _find_device(mac_address)
         if device:
-            return device.last_ping_time
+            return max(last_ping_time or 0.0, device.last_ping_time or 0.0)
+        if last_ping_time is not None:
+            return last_ping_time
         logger.warning(f"Device with MAC {mac_address} not found")
         return 0.0
     except Exception as e:
@@ -236,4 +658,5 @@ def example_usage():
     devices = load_devices()
 
 
-example_usage()
+if __name__ == '__main__':
+    example_usage()
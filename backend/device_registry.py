@@ -0,0 +1,252 @@
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from models import db, Device
+from change_bus import change_bus, RESYNC
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRecord(NamedTuple):
+    """The parts of a device that lookups and access checks need.
+
+    Only columns written through the ORM belong here; fast-changing ones
+    updated in bulk (status, ping times, state) stay in the database.
+    """
+    id: int
+    mac_address: str
+    name: str
+    owner_id: int
+    room_id: Optional[int]
+    protocol: Optional[str]
+
+
+RECORD_COLUMNS = tuple(getattr(Device, field) for field in DeviceRecord._fields)
+
+# Unknown MACs remembered at once; past this, expired ones are dropped
+MAX_MISSES = 10000
+
+
+def _record(device: Device) -> DeviceRecord:
+    return DeviceRecord(device.id, device.mac_address, device.name,
+                        device.owner_id, device.room_id, device.protocol)
+
+
+class DeviceRegistry:
+    """In-process index of all devices by MAC, id, owner, room and protocol.
+
+    Loaded once at startup and kept current from committed ORM writes,
+    so hot lookups are dictionary reads. Other workers' writes arrive as
+    device ids over the change bus and are reloaded from the database.
+    MACs the database does not know are remembered for ``miss_ttl``
+    seconds, so unknown devices do not cost a query per message.
+    """
+
+    def __init__(self, miss_ttl: float = 5.0):
+        self._by_id: Dict[int, DeviceRecord] = {}
+        self._by_mac: Dict[str, DeviceRecord] = {}
+        self._by_owner: Dict[int, Set[int]] = {}
+        self._by_room: Dict[Optional[int], Set[int]] = {}
+        self._by_protocol: Dict[Optional[str], Set[int]] = {}
+        # MAC -> monotonic time its miss expires
+        self._misses: Dict[str, float] = {}
+        self._miss_ttl = miss_ttl
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Load every device and follow changes made by other workers."""
+        self._miss_ttl = app.config.get('DEVICE_MISS_TTL', self._miss_ttl)
+        with app.app_context():
+            self.load()
+        change_bus.subscribe('devices', self.reload)
+        change_bus.subscribe(RESYNC, self._resync)
+
+    def load(self) -> int:
+        """Replace the index with every device in the database.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: Number of devices loaded
+        """
+        rows = db.session.query(*RECORD_COLUMNS).all()
+        with self._lock:
+            for index in (self._by_id, self._by_mac, self._by_owner,
+                          self._by_room, self._by_protocol, self._misses):
+                index.clear()
+            for row in rows:
+                self._add(DeviceRecord(*row))
+        logger.info(f"Device registry loaded {len(rows)} devices")
+        return len(rows)
+
+    def reload(self, device_ids: Iterable[int]) -> None:
+        """Refresh some devices from the database, dropping deleted ones.
+
+        Must be called inside an application context.
+        """
+        device_ids = set(device_ids)
+        rows = db.session.query(*RECORD_COLUMNS)\
+            .filter(Device.id.in_(device_ids)).all()
+        self.apply({device_id: None for device_id in device_ids} |
+                   {row.id: DeviceRecord(*row) for row in rows})
+
+    def apply(self, changes: Dict[int, Optional[DeviceRecord]]) -> None:
+        """Store new records, or remove devices whose record is None."""
+        with self._lock:
+            for device_id, record in changes.items():
+                self._remove(device_id)
+                if record is not None:
+                    self._add(record)
+
+    def by_mac(self, mac_address: str) -> Optional[DeviceRecord]:
+        return self._by_mac.get(mac_address)
+
+    def find(self, mac_address: str) -> Optional[DeviceRecord]:
+        """Get a device by MAC, checking the database on a miss.
+
+        Covers a device another worker created whose notification has not
+        arrived yet. Must be called inside an application context.
+        """
+        record = self._by_mac.get(mac_address)
+        if record is None and not self._missed(mac_address):
+            row = db.session.query(*RECORD_COLUMNS)\
+                .filter(Device.mac_address == mac_address).first()
+            if row is not None:
+                record = DeviceRecord(*row)
+                self.apply({record.id: record})
+            else:
+                self._remember_misses([mac_address])
+        return record
+
+    def find_many(self, mac_addresses: Iterable[str]) -> Dict[str, DeviceRecord]:
+        """Get devices by MAC, checking the database for all misses at once.
+
+        Must be called inside an application context.
+
+        Returns:
+            Dict[str, DeviceRecord]: Records of the MACs that exist
+        """
+        found = {}
+        missing = []
+        for mac_address in mac_addresses:
+            record = self._by_mac.get(mac_address)
+            if record is not None:
+                found[mac_address] = record
+            elif not self._missed(mac_address):
+                missing.append(mac_address)
+        if missing:
+            records = [DeviceRecord(*row) for row in db.session.query(*RECORD_COLUMNS)
+                       .filter(Device.mac_address.in_(set(missing))).all()]
+            if records:
+                self.apply({record.id: record for record in records})
+                found.update((record.mac_address, record) for record in records)
+            self._remember_misses(set(missing) - found.keys())
+        return found
+
+    def by_id(self, device_id: int) -> Optional[DeviceRecord]:
+        return self._by_id.get(device_id)
+
+    def by_owner(self, owner_id: int) -> List[DeviceRecord]:
+        return self._records(self._by_owner.get(owner_id, ()))
+
+    def by_room(self, room_id: Optional[int]) -> List[DeviceRecord]:
+        return self._records(self._by_room.get(room_id, ()))
+
+    def by_protocol(self, protocol: Optional[str]) -> List[DeviceRecord]:
+        return self._records(self._by_protocol.get(protocol, ()))
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def _resync(self, _):
+        self.load()
+
+    def _missed(self, mac_address: str) -> bool:
+        expires = self._misses.get(mac_address)
+        return expires is not None and expires > time.monotonic()
+
+    def _remember_misses(self, mac_addresses: Iterable[str]):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._misses) >= MAX_MISSES:
+                self._misses = {mac: expires for mac, expires in self._misses.items()
+                                if expires > now}
+                if len(self._misses) >= MAX_MISSES:
+                    self._misses.clear()
+            for mac_address in mac_addresses:
+                # A device added since the query started is not a miss
+                if mac_address not in self._by_mac:
+                    self._misses[mac_address] = now + self._miss_ttl
+
+    def _records(self, device_ids) -> List[DeviceRecord]:
+        with self._lock:
+            return sorted((self._by_id[device_id] for device_id in device_ids),
+                          key=lambda record: record.id)
+
+    def _add(self, record: DeviceRecord):
+        self._by_id[record.id] = record
+        self._by_mac[record.mac_address] = record
+        self._misses.pop(record.mac_address, None)
+        self._by_owner.setdefault(record.owner_id, set()).add(record.id)
+        self._by_room.setdefault(record.room_id, set()).add(record.id)
+        self._by_protocol.setdefault(record.protocol, set()).add(record.id)
+
+    def _remove(self, device_id: int):
+        record = self._by_id.pop(device_id, None)
+        if record is None:
+            return
+        if self._by_mac.get(record.mac_address) is record:
+            del self._by_mac[record.mac_address]
+        for index, key in ((self._by_owner, record.owner_id),
+                           (self._by_room, record.room_id),
+                           (self._by_protocol, record.protocol)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(device_id)
+                if not ids:
+                    del index[key]
+
+
+device_registry = DeviceRegistry()
+
+
+@event.listens_for(Device, 'after_insert')
+def _track_device_insert(mapper, connection, device):
+    session = object_session(device)
+    if session is not None:
+        session.info.setdefault('registry_changes', {})[device.id] = _record(device)
+
+
+@event.listens_for(Device, 'after_update')
+def _track_device_update(mapper, connection, device):
+    # State and status writes are frequent and leave the record unchanged
+    attrs = inspect(device).attrs
+    if not any(getattr(attrs, field).history.has_changes()
+               for field in DeviceRecord._fields):
+        return
+    session = object_session(device)
+    if session is not None:
+        session.info.setdefault('registry_changes', {})[device.id] = _record(device)
+
+
+@event.listens_for(Device, 'after_delete')
+def _track_device_delete(mapper, connection, device):
+    session = object_session(device)
+    if session is not None:
+        session.info.setdefault('registry_changes', {})[device.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(session):
+    changes = session.info.pop('registry_changes', None)
+    if changes:
+        device_registry.apply(changes)
+        change_bus.publish('devices', list(changes))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('registry_changes', None)
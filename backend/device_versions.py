@@ -0,0 +1,123 @@
+import threading
+import uuid
+import zlib
+from typing import Iterable, Optional
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, object_session
+from models import db, Device, Script
+from change_bus import change_bus
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceVersions:
+    """Per-owner counters that change whenever an owner's devices change.
+
+    Device and script writes bump their owner's counter after commit, so a
+    device listing can be revalidated with an ETag without touching the
+    database. Counters live in process memory; the epoch changes on every
+    restart so ETags from an earlier process never match. Bumps are relayed
+    over the change bus so other workers' counters move too.
+
+    Heartbeat flushes do not bump: with a live fleet every owner would get
+    a new ETag every flush. A revalidated listing may therefore carry older
+    ``last_ping_time`` values; current ones arrive as ``ping_received``
+    socket events and from the last-ping-time endpoint.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._total = 0
+        self._epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Follow bumps made by other workers."""
+        change_bus.subscribe('device_owners', self._bump_remote)
+
+    def bump(self, owner_ids: Iterable[int], publish: bool = True) -> None:
+        """Mark the devices of the given owners as changed."""
+        owner_ids = list(owner_ids)
+        with self._lock:
+            for owner_id in owner_ids:
+                self._versions[owner_id] = self._versions.get(owner_id, 0) + 1
+                self._total += 1
+        if publish and owner_ids:
+            change_bus.publish('device_owners', owner_ids)
+
+    def bump_for_macs(self, mac_addresses: Iterable[str]) -> None:
+        """Bump the owners of devices changed by a bulk UPDATE.
+
+        Must be called inside an application context.
+        """
+        owner_ids = db.session.execute(
+            select(Device.owner_id).distinct()
+            .where(Device.mac_address.in_(list(mac_addresses)))
+        ).scalars().all()
+        self.bump(owner_ids)
+
+    def _bump_remote(self, owner_ids):
+        self.bump(owner_ids, publish=False)
+
+    def version(self, owner_id: Optional[int] = None) -> str:
+        """Get an owner's version, or the version of all devices if None."""
+        with self._lock:
+            count = self._total if owner_id is None else self._versions.get(owner_id, 0)
+        return f"{self._epoch}.{count}"
+
+    def etag(self, owner_id: Optional[int], variant: bytes = b'') -> str:
+        """Build an ETag for a listing of an owner's devices.
+
+        Args:
+            owner_id: Owner whose devices are listed, or None for all devices
+            variant: Anything else that shapes the response, such as the
+                query string
+        """
+        scope = 'all' if owner_id is None else owner_id
+        return f"devices-{scope}-{self.version(owner_id)}-{zlib.crc32(variant):08x}"
+
+
+device_versions = DeviceVersions()
+
+
+def _changed_owners(session) -> set:
+    return session.info.setdefault('changed_device_owners', set())
+
+
+@event.listens_for(Device, 'after_insert')
+@event.listens_for(Device, 'after_update')
+@event.listens_for(Device, 'after_delete')
+def _track_device_change(mapper, connection, device):
+    session = object_session(device)
+    if session is None:
+        return
+    owners = _changed_owners(session)
+    owners.add(device.owner_id)
+    # A device moved to another owner changes both listings
+    owners.update(inspect(device).attrs.owner_id.history.deleted or ())
+
+
+@event.listens_for(Script, 'after_insert')
+@event.listens_for(Script, 'after_update')
+@event.listens_for(Script, 'after_delete')
+def _track_script_change(mapper, connection, script):
+    session = object_session(script)
+    if session is None:
+        return
+    owner_id = connection.execute(
+        select(Device.owner_id).where(Device.id == script.device_id)).scalar()
+    if owner_id is not None:
+        _changed_owners(session).add(owner_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_committed(session):
+    owners = session.info.pop('changed_device_owners', None)
+    if owners:
+        device_versions.bump(owners)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('changed_device_owners', None)
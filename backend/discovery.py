@@ -5,7 +5,8 @@ import logging
 from zeroconf import ServiceBrowser, ServiceListener, Zeroconf
 from typing import Dict, List, Optional
 from models import Device, db
-from protocols.mqtt_handler import MQTTHandler
+from device_registry import device_registry
+from protocols.adapter_registry import adapter_registry
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +15,6 @@ class DeviceDiscoveryService:
     """Service for discovering IoT devices on the network."""
 
     def __init__(self):
-        self.mqtt_handler = MQTTHandler()
         self.zeroconf = Zeroconf()
         self.discovered_devices: Dict[str, Dict] = {}
         self.discovery_thread = None
@@ -41,8 +41,12 @@ class DeviceDiscoveryService:
     def _discover_devices(self):
         """Run device discovery on all protocols."""
         try:
-            # Start MQTT discovery
-            self.mqtt_handler.discover_devices()
+            # Start MQTT discovery over the shared, app-managed connection
+            mqtt = adapter_registry.get('mqtt')
+            if mqtt:
+                mqtt.discover_devices()
+            else:
+                logger.warning("MQTT adapter unavailable; skipping MQTT discovery")
 
             # Start mDNS discovery
             browser = ServiceBrowser(self.zeroconf, "_iot._tcp.local.",
@@ -108,8 +112,9 @@ class DeviceDiscoveryService:
                 return
 
             # Check if device already exists
-            device = Device.query.filter_by(mac_address=device_id).first()
-            if device:
+            record = device_registry.find(device_id)
+            if record:
+                device = db.session.get(Device, record.id)
                 # Update existing device
                 self._update_device(device, device_info)
             else:
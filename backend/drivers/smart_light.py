@@ -2,6 +2,7 @@ from typing import Dict, Any, Optional, List
 import colorsys
 import logging
 from models import Device, DeviceCapability
+from protocols.adapter_registry import adapter_registry
 
 logger = logging.getLogger(__name__)
 
@@ -34,15 +35,8 @@ class SmartLightDriver:
                 self.device.capabilities.append(DeviceCapability.COLOR.value)
 
     def _get_protocol_handler(self):
-        """Get the appropriate protocol handler for the device."""
-        from protocols.mqtt_handler import MQTTHandler
-        # Add more protocol handlers as needed
-        handlers = {
-            'mqtt': MQTTHandler,
-            # 'zigbee': ZigbeeHandler,
-            # 'wifi': WiFiHandler,
-        }
-        return handlers.get(self.device.protocol)()
+        """Get the shared protocol adapter for the device."""
+        return adapter_registry.get(self.device.protocol)
 
     def _supports_color(self) -> bool:
         """Check if device supports color based on manufacturer and model."""
@@ -0,0 +1,184 @@
+import atexit
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import PrimaryKeyConstraint
+from models import db, DeviceEvent
+import logging
+
+logger = logging.getLogger(__name__)
+
+TABLE = DeviceEvent.__tablename__
+# device_events_y2026m01 holds January 2026
+PARTITION_NAME = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+# Arbitrary key so only one worker maintains partitions at a time
+MAINTENANCE_LOCK_KEY = 0x6465766576
+
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _partition_key_in_primary_key(constraint, compiler, **kw):
+    # A partitioned table's primary key must include the partition key
+    if constraint.table is not None and constraint.table.name == TABLE:
+        return 'PRIMARY KEY (id, created_at)'
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
+def month_start(moment: datetime, offset: int = 0) -> datetime:
+    """Get the first instant of the month ``offset`` months from ``moment``."""
+    index = moment.year * 12 + moment.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+class EventStore:
+    """Housekeeping for the append-only ``device_events`` table.
+
+    On PostgreSQL events are range partitioned by month: partitions are
+    created ahead of time, and those wholly older than the retention
+    period are dropped in one statement each. Elsewhere (SQLite), or on a
+    table created before partitioning, expired rows are deleted in
+    batches through the ``created_at`` index instead.
+    """
+
+    def __init__(self, retention_days: int = 90, months_ahead: int = 2,
+                 interval: float = 3600, batch_size: int = 5000):
+        self._retention_days = retention_days
+        self._months_ahead = months_ahead
+        self._interval = interval
+        self._batch_size = batch_size
+        self._app = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def init_app(self, app) -> None:
+        """Prepare the events table and start periodic maintenance."""
+        self._app = app
+        self._retention_days = app.config.get('EVENT_RETENTION_DAYS', self._retention_days)
+        self._months_ahead = app.config.get('EVENT_PARTITIONS_AHEAD', self._months_ahead)
+        self._interval = app.config.get('EVENT_MAINTENANCE_INTERVAL', self._interval)
+        self._batch_size = app.config.get('EVENT_PRUNE_BATCH', self._batch_size)
+        with app.app_context():
+            self.ensure_indexes()
+            self.maintain()
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='event-store', daemon=True)
+            self._thread.start()
+            atexit.register(self._stop.set)
+
+    def is_partitioned(self) -> bool:
+        """Check whether the events table is a PostgreSQL partitioned table."""
+        if db.engine.dialect.name != 'postgresql':
+            return False
+        return db.session.execute(text(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = :table"), {'table': TABLE}).first() is not None
+
+    def ensure_indexes(self) -> None:
+        """Create indexes missing from a table made by an older release."""
+        existing = {index['name'] for index in inspect(db.engine).get_indexes(TABLE)}
+        for index in DeviceEvent.__table__.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                logger.info(f"Created index {index.name}")
+
+    def maintain(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Create upcoming partitions and drop or delete expired events.
+
+        Must be called inside an application context.
+
+        Returns:
+            Dict[str, Any]: Partitions ``created`` and ``dropped``, and the
+                number of rows ``deleted`` individually
+        """
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(days=self._retention_days)
+        result = {'created': [], 'dropped': [], 'deleted': 0}
+        try:
+            if self.is_partitioned():
+                if not db.session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"),
+                                          {'key': MAINTENANCE_LOCK_KEY}).scalar():
+                    # Another worker is on it
+                    db.session.rollback()
+                    return result
+                partitions = self._partitions()
+                result['created'] = self._create_partitions(now, partitions)
+                result['dropped'] = self._drop_partitions(cutoff, partitions)
+                db.session.commit()
+            # Without partitions, and in the partition straddling the
+            # cutoff, expired rows go one batch at a time
+            result['deleted'] = self._delete_before(cutoff)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error maintaining device events: {str(e)}")
+        return result
+
+    def _create_partitions(self, now: datetime, partitions: Dict[str, datetime]) -> List[str]:
+        created = []
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {TABLE}_default PARTITION OF {TABLE} DEFAULT"))
+        for offset in range(self._months_ahead + 1):
+            start, end = month_start(now, offset), month_start(now, offset + 1)
+            name = f"{TABLE}_y{start.year:04d}m{start.month:02d}"
+            if name in partitions:
+                continue
+            db.session.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"))
+            created.append(name)
+            logger.info(f"Created event partition {name}")
+        return created
+
+    def _drop_partitions(self, cutoff: datetime, partitions: Dict[str, datetime]) -> List[str]:
+        dropped = []
+        for name, start in partitions.items():
+            if month_start(start, 1) <= cutoff:
+                db.session.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+                logger.info(f"Dropped event partition {name}")
+        return dropped
+
+    def _partitions(self) -> Dict[str, datetime]:
+        rows = db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table"), {'table': TABLE})
+        partitions = {}
+        for (name,) in rows:
+            match = PARTITION_NAME.match(name)
+            if match:
+                partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1)
+        return partitions
+
+    def _delete_before(self, cutoff: datetime) -> int:
+        # Small batches keep each transaction, and its locks, short
+        removed = 0
+        while True:
+            expired = db.session.query(DeviceEvent.id)\
+                .filter(DeviceEvent.created_at < cutoff)\
+                .limit(self._batch_size).scalar_subquery()
+            deleted = DeviceEvent.query\
+                .filter(DeviceEvent.created_at < cutoff, DeviceEvent.id.in_(expired))\
+                .delete(synchronize_session=False)
+            db.session.commit()
+            removed += deleted
+            if deleted < self._batch_size:
+                break
+        if removed:
+            logger.info(f"Deleted {removed} events older than {cutoff.isoformat()}")
+        return removed
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                with self._app.app_context():
+                    self.maintain()
+            except Exception as e:
+                logger.error(f"Error running event store maintenance: {str(e)}")
+
+
+event_store = EventStore()
@@ -0,0 +1,119 @@
+import atexit
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+from sqlalchemy import and_, bindparam, or_, update
+from models import db, Device
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatTable:
+    """In-memory table of device ping times with write-behind to the database.
+
+    Ping times are recorded into a flat array of doubles indexed by a
+    MAC address -> slot mapping, so a heartbeat never waits on a database
+    write. Dirty slots are flushed to ``Device.last_ping_time`` in a single
+    batched UPDATE every ``flush_interval`` seconds. A flush never moves a
+    ping time backwards, so a newer one written by another worker stays.
+    """
+
+    __slots__ = ('_slots', '_macs', '_times', '_dirty', '_lock',
+                 '_app', '_flush_interval', '_thread', '_stop')
+
+    def __init__(self, flush_interval: float = 5.0):
+        self._slots: Dict[str, int] = {}
+        self._macs: List[str] = []
+        self._times = array('d')
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._app = None
+        self._flush_interval = flush_interval
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def init_app(self, app) -> None:
+        """Bind the table to an app and start the background flusher."""
+        self._app = app
+        self._flush_interval = app.config.get(
+            'HEARTBEAT_FLUSH_INTERVAL', self._flush_interval)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='heartbeat-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def record(self, mac_address: str, timestamp: Optional[float] = None) -> float:
+        """Record a ping for a device and return the stored timestamp."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            slot = self._slots.get(mac_address)
+            if slot is None:
+                slot = len(self._macs)
+                self._slots[mac_address] = slot
+                self._macs.append(mac_address)
+                self._times.append(timestamp)
+            else:
+                self._times[slot] = timestamp
+            self._dirty.add(slot)
+        return timestamp
+
+    def get(self, mac_address: str) -> Optional[float]:
+        """Get the last recorded ping time, or None if never seen."""
+        slot = self._slots.get(mac_address)
+        if slot is None:
+            return None
+        return self._times[slot]
+
+    def flush(self) -> int:
+        """Write all dirty ping times to the database in one batched UPDATE.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: Number of devices flushed
+        """
+        with self._lock:
+            if not self._dirty:
+                return 0
+            rows = [{'mac': self._macs[slot], 'ts': self._times[slot]}
+                    for slot in self._dirty]
+            self._dirty = set()
+
+        devices = Device.__table__
+        stmt = update(devices)\
+            .where(and_(devices.c.mac_address == bindparam('mac'),
+                        or_(devices.c.last_ping_time.is_(None),
+                            devices.c.last_ping_time < bindparam('ts'))))\
+            .values(last_ping_time=bindparam('ts'))
+        try:
+            db.session.execute(stmt, rows)
+            db.session.commit()
+            # Ping times are not part of the listing ETag; see DeviceVersions
+            logger.debug(f"Flushed {len(rows)} heartbeats")
+            return len(rows)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error flushing heartbeats: {str(e)}")
+            # Mark the rows dirty again so the next flush retries them
+            with self._lock:
+                for row in rows:
+                    self._dirty.add(self._slots[row['mac']])
+            return 0
+
+    def stop(self) -> None:
+        """Stop the background flusher and write any pending heartbeats."""
+        self._stop.set()
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self._flush_interval):
+            with self._app.app_context():
+                self.flush()
+
+
+heartbeats = HeartbeatTable()
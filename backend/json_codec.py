@@ -0,0 +1,140 @@
+import json
+from typing import Any, Callable, Optional, Union
+from flask.json.provider import DefaultJSONProvider
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class JSONCodec:
+    """A JSON backend: ``loads`` takes str or bytes, ``dumpb`` returns bytes."""
+
+    name = 'json'
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    def dumpb(self, obj: Any, default: Optional[Callable] = None,
+              sort_keys: bool = False) -> bytes:
+        return json.dumps(obj, default=default, sort_keys=sort_keys,
+                          separators=(',', ':')).encode()
+
+    def dumps(self, obj: Any, default: Optional[Callable] = None,
+              sort_keys: bool = False) -> str:
+        return self.dumpb(obj, default, sort_keys).decode()
+
+
+class OrjsonCodec(JSONCodec):
+    name = 'orjson'
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+    def dumpb(self, obj: Any, default: Optional[Callable] = None,
+              sort_keys: bool = False) -> bytes:
+        # Datetimes go through ``default`` so output matches the stdlib codec
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+
+
+class MsgspecCodec(JSONCodec):
+    name = 'msgspec'
+
+    def __init__(self):
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder()
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        try:
+            return self._decoder.decode(data)
+        except msgspec.DecodeError as e:
+            # Callers catch ValueError, as for the other codecs
+            raise ValueError(str(e)) from e
+
+    def dumpb(self, obj: Any, default: Optional[Callable] = None,
+              sort_keys: bool = False) -> bytes:
+        if default is None and not sort_keys:
+            return self._encoder.encode(obj)
+        if sort_keys:
+            return msgspec.json.encode(obj, enc_hook=default, order='sorted')
+        return msgspec.json.encode(obj, enc_hook=default)
+
+
+CODECS = {'orjson': OrjsonCodec, 'msgspec': MsgspecCodec, 'json': JSONCodec}
+_AVAILABLE = {'orjson': orjson is not None, 'msgspec': msgspec is not None, 'json': True}
+
+codec: JSONCodec = JSONCodec()
+
+
+def use_codec(name: str = 'auto') -> JSONCodec:
+    """Select the JSON backend used across the app.
+
+    Args:
+        name: orjson, msgspec, json, or auto for the fastest installed one
+
+    Returns:
+        JSONCodec: The codec now in use
+    """
+    global codec
+    if name == 'auto':
+        name = next(n for n in ('orjson', 'msgspec', 'json') if _AVAILABLE[n])
+    elif not _AVAILABLE.get(name):
+        logger.warning(f"JSON codec {name} not available, using stdlib json")
+        name = 'json'
+    codec = CODECS[name]()
+    logger.info(f"Using {codec.name} JSON codec")
+    return codec
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Decode JSON with the active codec."""
+    return codec.loads(data)
+
+
+def dumps(obj: Any, *args, **kwargs) -> str:
+    """Encode JSON to str with the active codec.
+
+    Formatting arguments such as ``separators`` are accepted and ignored,
+    so this module can stand in for ``json`` (Socket.IO passes them).
+    """
+    return codec.dumps(obj)
+
+
+def dumpb(obj: Any) -> bytes:
+    """Encode JSON to bytes with the active codec."""
+    return codec.dumpb(obj)
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by the active codec."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return codec.dumps(obj, default=self.default, sort_keys=self.sort_keys)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return codec.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            codec.dumpb(obj, default=self.default, sort_keys=self.sort_keys),
+            mimetype=self.mimetype)
+
+
+def init_app(app) -> None:
+    """Pick the codec from ``JSON_CODEC`` and install it as Flask's JSON provider."""
+    use_codec(app.config.get('JSON_CODEC', 'auto'))
+    app.json_provider_class = CodecJSONProvider
+    app.json = CodecJSONProvider(app)
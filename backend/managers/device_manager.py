@@ -1,9 +1,11 @@
 import logging
+from functools import partial
 from typing import Dict, Any, Optional, List
-from datetime import datetime
 from models import Device, DeviceEvent, db
-from protocols.protocol_factory import ProtocolFactory
+from protocols.adapter_registry import adapter_registry
 from protocols.protocol_adapter import ProtocolAdapter
+from state_sink import state_sink
+import repository
 
 logger = logging.getLogger(__name__)
 
@@ -25,28 +27,25 @@ class DeviceManager:
         """
         for protocol_name, config in protocol_configs.items():
             try:
-                if ProtocolFactory.validate_protocol_config(protocol_name, config):
-                    adapter = ProtocolFactory.create_adapter(
-                        protocol_name, config)
-                    if adapter.connect():
-                        self._protocol_adapters[protocol_name] = adapter
-                        logger.info(f"Initialized {protocol_name} adapter")
-                    else:
-                        logger.error(
-                            f"Failed to connect {protocol_name} adapter")
+                adapter_registry.configure(protocol_name, config)
+                adapter = adapter_registry.get(protocol_name)
+                if adapter and adapter.connect():
+                    self._protocol_adapters[protocol_name] = adapter
+                    logger.info(f"Initialized {protocol_name} adapter")
+                else:
+                    logger.error(
+                        f"Failed to connect {protocol_name} adapter")
             except Exception as e:
                 logger.error(
                     f"Error initializing {protocol_name} adapter: {str(e)}")
 
     def cleanup(self) -> None:
-        """Clean up all protocol adapters."""
-        for protocol_name, adapter in self._protocol_adapters.items():
-            try:
-                adapter.disconnect()
-                logger.info(f"Disconnected {protocol_name} adapter")
-            except Exception as e:
-                logger.error(
-                    f"Error disconnecting {protocol_name} adapter: {str(e)}")
+        """Release protocol adapters.
+
+        Adapters are shared through the registry, which disconnects them
+        on shutdown.
+        """
+        self._protocol_adapters.clear()
 
     def add_device(self, device_data: Dict[str, Any]) -> Optional[Device]:
         """Add a new device to the system.
@@ -80,20 +79,24 @@ class DeviceManager:
                     f"No adapter available for protocol: {protocol_name}")
                 return None
 
-            # Register device with protocol adapter
-            if adapter.register_device(device, self._handle_device_state_update):
-                db.session.add(device)
+            # Register device with protocol adapter once it has an id
+            db.session.add(device)
+            db.session.flush()
+            callback = partial(self._handle_device_state_update, device.id)
+            if adapter.register_device(device, callback):
                 db.session.commit()
 
                 self._device_protocols[device.id] = protocol_name
                 logger.info(f"Added device: {device.name} ({device.id})")
                 return device
             else:
+                db.session.rollback()
                 logger.error(
                     f"Failed to register device with protocol adapter")
                 return None
 
         except Exception as e:
+            db.session.rollback()
             logger.error(f"Error adding device: {str(e)}")
             return None
 
@@ -273,38 +276,21 @@ class DeviceManager:
             device_id: ID of the device
             state: New device state
         """
-        try:
-            device = self.get_device(device_id)
-            if device:
-                device.state = state
-                device.last_seen = datetime.utcnow()
-                db.session.commit()
-
-                # Log state change event
-                event = DeviceEvent(
-                    device_id=device_id,
-                    event_type='state_changed',
-                    message=f"State updated: {state}"
-                )
-                db.session.add(event)
-                db.session.commit()
-            else:
-                logger.warning(f"State update for unknown device: {device_id}")
-
-        except Exception as e:
-            logger.error(f"Error handling state update: {str(e)}")
+        # The sink merges bursts and writes the state and its event in
+        # one batched transaction
+        state_sink.submit(device_id, state)
 
-    def get_device_events(self, device_id: str, limit: int = 100) -> List[DeviceEvent]:
-        """Get recent events for a device.
+    def get_device_events(self, device_id: str, limit: int = 100,
+                          before: Optional[str] = None) -> List[DeviceEvent]:
+        """Get recent events for a device, newest first.
 
         Args:
             device_id: ID of the device
             limit: Maximum number of events to return
+            before: Cursor of the last event of the previous page
 
         Returns:
             List[DeviceEvent]: List of device events
         """
-        return DeviceEvent.query.filter_by(device_id=device_id)\
-            .order_by(DeviceEvent.timestamp.desc())\
-            .limit(limit)\
-            .all()
+        cursor = repository.parse_event_cursor(before) if before else None
+        return repository.list_device_events(device_id, before=cursor, limit=limit)
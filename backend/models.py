@@ -35,7 +35,7 @@ class User(db.Model):
 
     # Relationships
     devices = db.relationship('Device', backref='owner', lazy=True)
-    home = db.relationship('Home', backref='users')
+    home = db.relationship('Home', backref='users', foreign_keys=[home_id])
 
     def set_password(self, password):
         """Hash and set the user's password."""
@@ -121,6 +121,9 @@ class Home(db.Model):
     name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.Text)
     timezone = db.Column(db.String(50), default='UTC')
+    # Used to compute local sunrise and sunset
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
@@ -134,6 +137,8 @@ class Home(db.Model):
             'name': self.name,
             'address': self.address,
             'timezone': self.timezone,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'owner_id': self.owner_id,
             'created_at': self.created_at.isoformat(),
             'rooms': [room.to_dict() for room in self.rooms]
@@ -189,50 +194,53 @@ class Device(db.Model):
     def update_state(self, new_state):
         """Update device state and create an event."""
         old_state = self.state.copy() if self.state else {}
-        self.state.update(new_state)
+        # Assign a new dict; in-place changes to a JSON column aren't flushed
+        self.state = {**old_state, **new_state}
 
-        # Create state change event
-        event = DeviceEvent(
-            device_id=self.id,
-            event_type='state_change',
-            old_state=old_state,
-            new_state=self.state
-        )
-        db.session.add(event)
+        # Create state change event, holding only the keys that changed
+        from state_history import state_history
+        db.session.add(state_history.record(self.id, old_state, self.state))
+
+        from telemetry import telemetry, is_sensor
+        if is_sensor(self.capabilities):
+            telemetry.observe(self.id, new_state)
 
         # Check automation triggers
         from automation_engine import check_device_triggers
         check_device_triggers(self, old_state, self.state)
 
-    def to_dict(self, include_scripts=True):
-        """Convert device to dictionary representation."""
-        data = {
-            'id': self.id,
-            'mac_address': self.mac_address,
-            'name': self.name,
-            'device_type': self.device_type.value,
-            'capabilities': [cap.value for cap in self.capabilities],
-            'state': self.state,
-            'config': self.config,
-            'emoji': self.emoji,
-            'description': self.description,
-            'status': self.status,
-            'last_ping_time': self.last_ping_time,
-            'firmware_version': self.firmware_version,
-            'ip_address': self.ip_address,
-            'protocol': self.protocol,
-            'manufacturer': self.manufacturer,
-            'model': self.model,
-            'room_id': self.room_id,
-            'owner_id': self.owner_id,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
-        }
+    # Fields serialized by to_dict; each is a column of the same name
+    SERIALIZED_FIELDS = (
+        'id', 'mac_address', 'name', 'device_type', 'capabilities', 'state',
+        'config', 'emoji', 'description', 'status', 'last_ping_time',
+        'firmware_version', 'ip_address', 'protocol', 'manufacturer', 'model',
+        'room_id', 'owner_id', 'created_at', 'updated_at'
+    )
+
+    def to_dict(self, include_scripts=True, fields=None):
+        """Convert device to dictionary representation.
+
+        Args:
+            include_scripts: Embed script contents keyed by script name
+            fields: Subset of SERIALIZED_FIELDS to include; all if None
+        """
+        data = {field: self._serialize_field(field)
+                for field in (fields or self.SERIALIZED_FIELDS)}
         if include_scripts:
             data['scripts'] = {
                 script.name: script.content for script in self.scripts}
         return data
 
+    def _serialize_field(self, field):
+        value = getattr(self, field)
+        if field == 'device_type':
+            return value.value
+        if field == 'capabilities':
+            return [cap.value for cap in value]
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
+
 
 class Script(db.Model):
     """Script model for storing device scripts.
@@ -285,17 +293,27 @@ class ScriptQueue(db.Model):
     device_id = db.Column(db.Integer, db.ForeignKey(
         'devices.id'), nullable=False)
     script_id = db.Column(db.Integer, db.ForeignKey(
-        'scripts.id'), nullable=False)
-    position = db.Column(db.Integer, nullable=False)
+        'scripts.id'), nullable=False, index=True)
+    # Sparse ordering key; only relative order is meaningful
+    position = db.Column(db.BigInteger, nullable=False)
     # pending, running, completed, failed
     status = db.Column(db.String(20), default='pending')
     result = db.Column(db.Text)
     scheduled_time = db.Column(db.DateTime)
+    # When a device last claimed the item; a running item whose lease has
+    # run out is handed to the next claim
+    claimed_at = db.Column(db.DateTime)
     executed_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     script = db.relationship('Script')
 
+    __table_args__ = (
+        db.Index('ix_script_queue_device_position', 'device_id', 'position'),
+        db.Index('ix_script_queue_device_status_position',
+                 'device_id', 'status', 'position'),
+    )
+
     def to_dict(self):
         """Convert queue item to dictionary representation."""
         return {
@@ -305,14 +323,26 @@ class ScriptQueue(db.Model):
             'status': self.status,
             'result': self.result,
             'scheduled_time': self.scheduled_time.isoformat() if self.scheduled_time else None,
+            'claimed_at': self.claimed_at.isoformat() if self.claimed_at else None,
             'executed_at': self.executed_at.isoformat() if self.executed_at else None,
             'created_at': self.created_at.isoformat()
         }
 
 
 class DeviceEvent(db.Model):
-    """Model for tracking device state changes and events."""
+    """Model for tracking device state changes and events.
+
+    Append-only. On PostgreSQL the table is range partitioned by month of
+    ``created_at`` so retention drops whole partitions; see event_store.
+    """
     __tablename__ = 'device_events'
+    __table_args__ = (
+        # Latest N events of a device, and keyset pages after that
+        db.Index('ix_device_events_device_created', 'device_id', 'created_at', 'id'),
+        # Retention sweeps where partitions are unavailable
+        db.Index('ix_device_events_created', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.Integer, db.ForeignKey(
@@ -322,7 +352,7 @@ class DeviceEvent(db.Model):
     old_state = db.Column(db.JSON)
     new_state = db.Column(db.JSON)
     message = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def to_dict(self):
         return {
@@ -334,3 +364,97 @@ class DeviceEvent(db.Model):
             'message': self.message,
             'created_at': self.created_at.isoformat()
         }
+
+
+class TelemetryRollup(db.Model):
+    """Min/max/sum/count of one numeric state key over one time bucket.
+
+    Buckets are kept at several resolutions (seconds per bucket) so range
+    reads touch a few rows instead of every raw event.
+    """
+    __tablename__ = 'telemetry_rollups'
+    __table_args__ = (
+        # Retention sweeps per resolution
+        db.Index('ix_telemetry_rollups_resolution_bucket', 'resolution', 'bucket_start'),
+    )
+
+    device_id = db.Column(db.Integer, db.ForeignKey('devices.id'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    resolution = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+
+    def to_dict(self):
+        return {
+            'bucket_start': self.bucket_start.isoformat(),
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'avg': self.sum / self.count
+        }
+
+
+class Automation(db.Model):
+    """Automation rule that runs actions when its trigger fires.
+
+    Condition triggers watch device state keys, time triggers fire on a
+    schedule. Actions are a list of action dicts executed in order.
+    """
+    __tablename__ = 'automations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    home_id = db.Column(db.Integer, db.ForeignKey('homes.id'), nullable=False)
+    # condition, time
+    trigger_type = db.Column(db.String(20), nullable=False)
+    trigger_data = db.Column(db.JSON, nullable=False, default=dict)
+    actions = db.Column(db.JSON, nullable=False, default=list)
+    is_enabled = db.Column(db.Boolean, default=True)
+    last_triggered = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'home_id': self.home_id,
+            'trigger_type': self.trigger_type,
+            'trigger_data': self.trigger_data,
+            'actions': self.actions,
+            'is_enabled': self.is_enabled,
+            'last_triggered': self.last_triggered.isoformat() if self.last_triggered else None,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class Scene(db.Model):
+    """Named set of actions that can be run together."""
+    __tablename__ = 'scenes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    home_id = db.Column(db.Integer, db.ForeignKey('homes.id'), nullable=False)
+    actions = db.Column(db.JSON, nullable=False, default=list)
+    # parallel, sequence
+    mode = db.Column(db.String(20), default='parallel')
+    is_enabled = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'home_id': self.home_id,
+            'actions': self.actions,
+            'mode': self.mode,
+            'is_enabled': self.is_enabled,
+            'created_at': self.created_at.isoformat()
+        }
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from change_bus import change_bus
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Principal(NamedTuple):
+    """The parts of a user that authorization checks need."""
+    id: int
+    username: str
+    role: str
+    is_active: bool
+
+
+class PrincipalCache:
+    """Size-bounded LRU of principals keyed by JWT identity.
+
+    Entries expire after ``ttl`` seconds as a backstop; changes should
+    call :meth:`invalidate`, which also reaches the other workers.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_size: int = 1024):
+        self._ttl = ttl
+        self._max_size = max_size
+        # identity -> (expires_at, principal)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Load cache limits from the app config."""
+        self._ttl = app.config.get('PRINCIPAL_CACHE_TTL', self._ttl)
+        self._max_size = app.config.get('PRINCIPAL_CACHE_SIZE', self._max_size)
+        change_bus.subscribe('principals', self._invalidate_remote)
+
+    def get(self, identity: str) -> Optional[Principal]:
+        """Get a cached principal, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(identity)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                del self._entries[identity]
+                return None
+            self._entries.move_to_end(identity)
+            return principal
+
+    def put(self, identity: str, principal: Principal) -> None:
+        """Cache a principal, evicting the least recently used if full."""
+        if self._ttl <= 0:
+            return
+        with self._lock:
+            self._entries[identity] = (time.monotonic() + self._ttl, principal)
+            self._entries.move_to_end(identity)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, identity: str, publish: bool = True) -> None:
+        """Drop a principal so the next request reloads it."""
+        with self._lock:
+            self._entries.pop(identity, None)
+        if publish:
+            change_bus.publish('principals', identity)
+
+    def _invalidate_remote(self, identity):
+        self.invalidate(identity, publish=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+principals = PrincipalCache()
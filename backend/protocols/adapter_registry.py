@@ -0,0 +1,194 @@
+import atexit
+import threading
+import time
+from typing import Any, Dict, Optional
+from .protocol_adapter import ProtocolAdapter
+from .protocol_factory import ProtocolFactory
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _AdapterState:
+    """Connection bookkeeping for one protocol."""
+
+    __slots__ = ('adapter', 'failures', 'next_attempt', 'creating')
+
+    def __init__(self):
+        self.adapter: Optional[ProtocolAdapter] = None
+        self.failures = 0
+        self.next_attempt = 0.0
+        # Held while the adapter is built, so only one caller builds it
+        # and lookups of other protocols never wait on a connect
+        self.creating = threading.Lock()
+
+
+class AdapterRegistry:
+    """Process-wide cache of protocol adapters.
+
+    Adapters are created through :class:`ProtocolFactory` the first time a
+    protocol is asked for and then shared, so every caller uses the same
+    broker connection and network thread. A monitor thread checks each
+    adapter's connection and reconnects with exponential backoff.
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 60.0,
+                 check_interval: float = 15.0):
+        self._configs: Dict[str, Dict[str, Any]] = {}
+        self._states: Dict[str, _AdapterState] = {}
+        self._lock = threading.Lock()
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._check_interval = check_interval
+        self._monitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._app = None
+
+    def init_app(self, app) -> None:
+        """Load protocol settings from the app and start health monitoring."""
+        self._app = app
+        for protocol_name, config in app.config.get('PROTOCOL_CONFIGS', {}).items():
+            self.configure(protocol_name, config)
+        self._check_interval = app.config.get(
+            'PROTOCOL_HEALTH_INTERVAL', self._check_interval)
+        self._max_delay = app.config.get(
+            'PROTOCOL_RECONNECT_MAX_DELAY', self._max_delay)
+
+        with self._lock:
+            adapters = [state.adapter for state in self._states.values() if state.adapter]
+        for adapter in adapters:
+            self._bind(adapter)
+
+        if self._monitor is None:
+            self._monitor = threading.Thread(
+                target=self._run, name='protocol-health', daemon=True)
+            self._monitor.start()
+            atexit.register(self.shutdown)
+
+    def configure(self, protocol_name: str, config: Dict[str, Any]) -> None:
+        """Set the configuration used for a protocol's adapter.
+
+        An adapter that already exists is reconfigured in place.
+        """
+        protocol_name = protocol_name.lower()
+        with self._lock:
+            self._configs[protocol_name] = config
+            state = self._states.get(protocol_name)
+            adapter = state.adapter if state else None
+        if adapter is not None:
+            adapter.configure(config)
+
+    def get(self, protocol_name: Optional[str]) -> Optional[ProtocolAdapter]:
+        """Get the shared adapter for a protocol, creating it on first use.
+
+        Returns:
+            Optional[ProtocolAdapter]: The adapter, or None if the protocol is
+            unsupported or its adapter could not be created yet
+        """
+        if not protocol_name:
+            return None
+        protocol_name = protocol_name.lower()
+
+        with self._lock:
+            state = self._states.setdefault(protocol_name, _AdapterState())
+            config = self._configs.get(protocol_name)
+        if state.adapter is not None:
+            return state.adapter
+
+        with state.creating:
+            if state.adapter is not None:
+                return state.adapter
+            if time.monotonic() < state.next_attempt:
+                return None
+            try:
+                adapter = ProtocolFactory.create_adapter(protocol_name, config)
+                self._bind(adapter)
+                state.failures = 0
+                state.adapter = adapter
+                logger.info(f"Created shared {protocol_name} adapter")
+            except ValueError:
+                # Unsupported protocol; don't retry on every lookup
+                state.next_attempt = float('inf')
+            except Exception as e:
+                self._backoff(protocol_name, state, e)
+            return state.adapter
+
+    def health_check(self) -> Dict[str, Dict[str, Any]]:
+        """Get the connection health of every adapter that has been used."""
+        with self._lock:
+            states = dict(self._states)
+
+        report = {}
+        for protocol_name, state in states.items():
+            if state.next_attempt == float('inf'):
+                continue
+            report[protocol_name] = {
+                'created': state.adapter is not None,
+                'connected': self._is_connected(state.adapter),
+                'failures': state.failures,
+                'retry_in': max(0.0, state.next_attempt - time.monotonic())
+            }
+        return report
+
+    def shutdown(self) -> None:
+        """Stop monitoring and disconnect all adapters."""
+        self._stop.set()
+        with self._lock:
+            adapters = [(name, state.adapter)
+                        for name, state in self._states.items() if state.adapter]
+            self._states.clear()
+        for protocol_name, adapter in adapters:
+            try:
+                adapter.disconnect()
+            except Exception as e:
+                logger.error(
+                    f"Error disconnecting {protocol_name} adapter: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(self._check_interval):
+            self._reconnect_unhealthy()
+
+    def _reconnect_unhealthy(self):
+        with self._lock:
+            states = list(self._states.items())
+
+        now = time.monotonic()
+        for protocol_name, state in states:
+            if state.adapter is None or now < state.next_attempt:
+                continue
+            if self._is_connected(state.adapter):
+                state.failures = 0
+                continue
+            try:
+                if state.adapter.connect():
+                    state.failures = 0
+                    logger.info(f"Reconnected {protocol_name} adapter")
+                else:
+                    self._backoff(protocol_name, state)
+            except Exception as e:
+                self._backoff(protocol_name, state, e)
+
+    def _backoff(self, protocol_name: str, state: _AdapterState, error: Exception = None):
+        delay = min(self._base_delay * (2 ** state.failures), self._max_delay)
+        state.failures += 1
+        state.next_attempt = time.monotonic() + delay
+        logger.warning(
+            f"{protocol_name} adapter unavailable ({error or 'not connected'}), "
+            f"retrying in {delay:.0f}s")
+
+    def _bind(self, adapter: ProtocolAdapter):
+        # Adapters that write to the database need the app for a context
+        if self._app is not None and hasattr(adapter, 'init_app'):
+            adapter.init_app(self._app)
+
+    @staticmethod
+    def _is_connected(adapter: Optional[ProtocolAdapter]) -> bool:
+        if adapter is None:
+            return False
+        try:
+            return adapter.is_connected()
+        except Exception:
+            return False
+
+
+adapter_registry = AdapterRegistry()
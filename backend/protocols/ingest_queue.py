@@ -0,0 +1,146 @@
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'block')
+
+
+class _Entry:
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic: str, payload: Any):
+        self.topic = topic
+        self.payload = payload
+
+
+class IngestQueue:
+    """Bounded hand-off between a protocol's network thread and writers.
+
+    Overflow policies:
+
+    * ``drop_oldest`` - when full, discard the oldest queued message.
+    * ``coalesce`` - merge a message into one already queued for the same
+      topic (last writer wins per key); when full with a new topic, discard
+      the oldest message.
+    * ``block`` - when full, block the producer until there is room.
+    """
+
+    def __init__(self, maxsize: int = 10000, policy: str = 'coalesce'):
+        self.maxsize = maxsize
+        self.policy = policy
+        self._entries: deque = deque()
+        # topic -> queued entry, used by the coalesce policy
+        self._pending: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._stats = {'enqueued': 0, 'coalesced': 0,
+                       'dropped': 0, 'processed': 0, 'failed': 0}
+
+    @property
+    def policy(self) -> str:
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy: str):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self._policy = policy
+
+    def put(self, topic: str, payload: Any) -> None:
+        """Queue a decoded message, applying the overflow policy."""
+        with self._lock:
+            if self._policy == 'coalesce':
+                entry = self._pending.get(topic)
+                if entry is not None:
+                    if isinstance(entry.payload, dict) and isinstance(payload, dict):
+                        entry.payload.update(payload)
+                    else:
+                        entry.payload = payload
+                    self._stats['coalesced'] += 1
+                    return
+
+            if len(self._entries) >= self.maxsize:
+                if self._policy == 'block':
+                    while len(self._entries) >= self.maxsize:
+                        self._not_full.wait()
+                else:
+                    dropped = self._entries.popleft()
+                    if self._pending.get(dropped.topic) is dropped:
+                        del self._pending[dropped.topic]
+                    self._stats['dropped'] += 1
+
+            entry = _Entry(topic, payload)
+            self._entries.append(entry)
+            if self._policy == 'coalesce':
+                self._pending[topic] = entry
+            self._stats['enqueued'] += 1
+            self._not_empty.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[str, Any]]:
+        """Take the oldest message, waiting up to ``timeout`` seconds.
+
+        Returns:
+            Optional[Tuple[str, Any]]: (topic, payload), or None on timeout
+        """
+        with self._lock:
+            if not self._entries and not self._not_empty.wait_for(
+                    lambda: self._entries, timeout=timeout):
+                return None
+            entry = self._entries.popleft()
+            if self._pending.get(entry.topic) is entry:
+                del self._pending[entry.topic]
+            self._not_full.notify()
+            return entry.topic, entry.payload
+
+    def task_done(self, succeeded: bool = True) -> None:
+        """Count a message the writer finished with."""
+        with self._lock:
+            self._stats['processed' if succeeded else 'failed'] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """Get queue depth and message counters."""
+        with self._lock:
+            return {
+                'depth': len(self._entries),
+                'maxsize': self.maxsize,
+                'policy': self._policy,
+                **self._stats
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class IngestWriter:
+    """Drains an IngestQueue on its own thread inside an app context."""
+
+    def __init__(self, ingest: IngestQueue, dispatch: Callable[[str, Any], None],
+                 name: str = 'ingest-writer'):
+        self._ingest = ingest
+        self._dispatch = dispatch
+        self._name = name
+        self._app = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, app) -> None:
+        """Start the writer thread for an app."""
+        self._app = app
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            topic, payload = self._ingest.get()
+            try:
+                with self._app.app_context():
+                    self._dispatch(topic, payload)
+                self._ingest.task_done()
+            except Exception as e:
+                self._ingest.task_done(succeeded=False)
+                logger.error(f"Error writing message from {topic}: {str(e)}")
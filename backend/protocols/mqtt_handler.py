@@ -1,10 +1,17 @@
-import json
 import logging
 from typing import Dict, Any, Optional, Callable
 import paho.mqtt.client as mqtt
+import json_codec
 from models import Device, DeviceEvent, db
+from state_sink import state_sink
+from device_registry import device_registry
+from heartbeat import heartbeats
+from realtime import event_batcher
 from datetime import datetime
 from .protocol_adapter import ProtocolAdapter
+from .topic_router import TopicRouter
+from .ingest_queue import IngestQueue, IngestWriter
+from . import payload_codec
 
 logger = logging.getLogger(__name__)
 
@@ -12,23 +19,41 @@ logger = logging.getLogger(__name__)
 class MQTTHandler(ProtocolAdapter):
     """MQTT protocol adapter for IoT devices."""
 
+    # Broker subscriptions shared by all devices; per-device routing
+    # happens locally in the topic router
+    SHARED_SUBSCRIPTIONS = ('home/+/+/state', 'home/+/+/status')
+
     def __init__(self):
         self.client = mqtt.Client()
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
 
-        # Store callbacks for handling device messages
+        # Route incoming topics to device callbacks
+        self._router = TopicRouter()
+        # device_id -> (topic filter, callback)
         self._message_callbacks = {}
 
+        # The network thread only decodes and enqueues; database work
+        # happens on the writer thread once init_app() has started it
+        self.ingest = IngestQueue()
+        self._writer = IngestWriter(self.ingest, self._dispatch, name='mqtt-ingest')
+
         # Configure MQTT broker settings
         self.broker_host = "localhost"  # Default to local broker
         self.broker_port = 1883
         self.broker_keepalive = 60
         self.username = None
         self.password = None
+        # Shared subscription group ($share/<group>/...), so that with
+        # several workers each device message is handled by one of them
+        self.shared_group = None
+        # Connecting is left to connect(), once configure() has set the broker
 
-        self._connect()
+    def init_app(self, app) -> None:
+        """Start writing received messages to the app's database."""
+        self._writer.start(app)
 
     def configure(self, config: Dict[str, Any]):
         """Configure MQTT broker settings."""
@@ -37,6 +62,9 @@ class MQTTHandler(ProtocolAdapter):
         self.broker_keepalive = config.get('keepalive', self.broker_keepalive)
         self.username = config.get('username')
         self.password = config.get('password')
+        self.shared_group = config.get('shared_group', self.shared_group)
+        self.ingest.maxsize = config.get('ingest_queue_size', self.ingest.maxsize)
+        self.ingest.policy = config.get('ingest_overflow', self.ingest.policy)
 
         if self.username and self.password:
             self.client.username_pw_set(self.username, self.password)
@@ -44,9 +72,10 @@ class MQTTHandler(ProtocolAdapter):
         # Reconnect with new settings if already connected
         if self.client.is_connected():
             self.client.disconnect()
+            self.client.loop_stop()
             self._connect()
 
-    def _connect(self):
+    def _connect(self) -> bool:
         """Connect to MQTT broker."""
         try:
             self.client.connect(
@@ -55,74 +84,109 @@ class MQTTHandler(ProtocolAdapter):
                 self.broker_keepalive
             )
             self.client.loop_start()
+            return True
         except Exception as e:
             logger.error(f"Failed to connect to MQTT broker: {str(e)}")
+            return False
+
+    def connect(self) -> bool:
+        """Connect to the broker unless already connected."""
+        if self.client.is_connected():
+            return True
+        self.client.loop_stop()
+        return self._connect()
+
+    def disconnect(self) -> None:
+        """Disconnect from the broker and stop the network thread."""
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def is_connected(self) -> bool:
+        """Check if connected to the broker."""
+        return self.client.is_connected()
 
     def _on_connect(self, client, userdata, flags, rc):
         """Callback for when client connects to broker."""
         if rc == 0:
             logger.info("Connected to MQTT broker")
-            # Resubscribe to all device topics
-            for device_id in self._message_callbacks:
-                self._subscribe_device(device_id)
+            # One SUBSCRIBE covers every device
+            client.subscribe([(self._subscription(topic), 0)
+                              for topic in self.SHARED_SUBSCRIPTIONS])
         else:
             logger.error(f"Failed to connect to MQTT broker with code: {rc}")
 
+    def _subscription(self, topic: str) -> str:
+        """Get the filter to subscribe with, in the shared group if any."""
+        if self.shared_group:
+            return f"$share/{self.shared_group}/{topic}"
+        return topic
+
     def _on_disconnect(self, client, userdata, rc):
         """Callback for when client disconnects from broker."""
         if rc != 0:
+            # The network loop reconnects with backoff on its own
             logger.warning("Unexpected disconnection from MQTT broker")
-            # Attempt to reconnect
-            self._connect()
 
     def _on_message(self, client, userdata, message):
         """Callback for when message is received from broker."""
         try:
-            topic = message.topic
-            payload = json.loads(message.payload.decode())
-
-            # Extract device ID from topic
-            device_id = topic.split('/')[-1]
-
-            if device_id in self._message_callbacks:
-                self._message_callbacks[device_id](payload)
-            else:
-                logger.warning(
-                    f"Received message for unknown device: {device_id}")
-
-        except json.JSONDecodeError:
-            logger.error("Failed to decode message payload as JSON")
+            payload = payload_codec.decode(message.payload)
+            self.ingest.put(message.topic, payload)
+        except ValueError:
+            logger.error(f"Failed to decode message payload on {message.topic}")
         except Exception as e:
             logger.error(f"Error processing MQTT message: {str(e)}")
 
+    def _dispatch(self, topic: str, payload: Any):
+        """Apply a queued message; runs on the writer thread."""
+        handlers = self._router.match(topic)
+        levels = topic.split('/')
+        if len(levels) == 4 and levels[0] == 'home' and levels[3] in ('state', 'status'):
+            # A registered device's state goes to its callback instead, so
+            # each update reaches the state sink once
+            builtin = levels[3] == 'status' or not handlers
+            record = device_registry.find(levels[2]) if builtin else None
+            if builtin and record is None:
+                logger.debug(f"Received message for unknown device: {levels[2]}")
+            elif record is not None and levels[3] == 'state':
+                self._handle_state_update(record.id, payload)
+            elif record is not None:
+                self._handle_status_update(db.session.get(Device, record.id), payload)
+
+        for handler in handlers:
+            handler(payload)
+
     def _get_device_topic(self, device: Device, command: bool = False) -> str:
         """Get MQTT topic for device."""
         base_topic = f"home/{device.device_type.value}/{device.mac_address}"
         return f"{base_topic}/command" if command else f"{base_topic}/state"
 
-    def _subscribe_device(self, device_id: str):
-        """Subscribe to device state topic."""
-        topic = f"home/+/+/{device_id}/state"
-        self.client.subscribe(topic)
-        logger.debug(f"Subscribed to topic: {topic}")
+    def _get_state_filter(self, device: Device) -> str:
+        """Get the topic filter matching a device's state messages."""
+        return f"home/+/{device.mac_address}/state"
 
-    def register_device(self, device: Device, callback):
+    def register_device(self, device: Device, callback) -> bool:
         """Register device for state updates."""
-        self._message_callbacks[device.id] = callback
-        self._subscribe_device(device.id)
+        self.unregister_device(device)
+        topic_filter = self._get_state_filter(device)
+        self._router.add(topic_filter, callback)
+        self._message_callbacks[device.id] = (topic_filter, callback)
+        return True
 
-    def unregister_device(self, device: Device):
+    def unregister_device(self, device: Device) -> bool:
         """Unregister device from state updates."""
-        if device.id in self._message_callbacks:
-            topic = self._get_device_topic(device)
-            self.client.unsubscribe(topic)
-            del self._message_callbacks[device.id]
+        registration = self._message_callbacks.pop(device.id, None)
+        if registration is None:
+            return False
+        topic_filter, callback = registration
+        self._router.remove(topic_filter, callback)
+        return True
 
     def send_command(self, device: Device, command: Dict[str, Any]) -> bool:
         """Send command to device."""
         try:
             topic = self._get_device_topic(device, command=True)
-            payload = json.dumps(command)
+            payload = payload_codec.encode(command, self._get_encoding(device))
 
             result = self.client.publish(topic, payload)
             if result.rc != mqtt.MQTT_ERR_SUCCESS:
@@ -133,7 +197,7 @@ class MQTTHandler(ProtocolAdapter):
             event = DeviceEvent(
                 device_id=device.id,
                 event_type='command_sent',
-                message=f"Command sent: {payload}"
+                message=f"Command sent: {json_codec.dumps(command)}"
             )
             db.session.add(event)
             db.session.commit()
@@ -143,6 +207,28 @@ class MQTTHandler(ProtocolAdapter):
             logger.error(f"Error sending command: {str(e)}")
             return False
 
+    def get_device_state(self, device: Device) -> Optional[Dict[str, Any]]:
+        """Request a state update; the reply arrives through the callback."""
+        return self.get_last_state(device)
+
+    def validate_command(self, device: Device, command: Dict[str, Any]) -> bool:
+        """Validate a command is a non-empty dict."""
+        return isinstance(command, dict) and bool(command)
+
+    def handle_error(self, error: Exception, context: str) -> None:
+        """Log MQTT errors."""
+        logger.error(f"MQTT error during {context}: {str(error)}")
+
+    def get_protocol_info(self) -> Dict[str, Any]:
+        """Get MQTT adapter information."""
+        return {
+            'name': 'mqtt',
+            'broker_host': self.broker_host,
+            'broker_port': self.broker_port,
+            'connected': self.is_connected(),
+            'ingest': self.ingest.metrics()
+        }
+
     def get_last_state(self, device: Device) -> Optional[Dict[str, Any]]:
         """Get last known device state."""
         try:
@@ -166,37 +252,58 @@ class MQTTHandler(ProtocolAdapter):
         try:
             # Update device status
             device.status = payload.get('status', 'offline')
-            device.last_ping_time = datetime.utcnow().timestamp()
+            # The ping time goes through the heartbeat table like HTTP pings
+            heartbeats.record(device.mac_address)
 
             if 'firmware_version' in payload:
                 device.firmware_version = payload['firmware_version']
             if 'ip_address' in payload:
                 device.ip_address = payload['ip_address']
+            if 'encodings' in payload:
+                self._negotiate_encoding(device, payload['encodings'])
+            update = event_batcher.entry(device, {
+                'device_id': device.id,
+                'mac_address': device.mac_address,
+                'status': device.status,
+                'firmware_version': device.firmware_version,
+                'ip_address': device.ip_address
+            })
 
             db.session.commit()
+            event_batcher.publish('device_status_update', [update])
             logger.info(f"Updated status for device {device.name}")
 
         except Exception as e:
             db.session.rollback()
             logger.error(f"Error updating device status: {str(e)}")
 
-    def _handle_state_update(self, device: Device, payload: Dict[str, Any]):
+    def _get_encoding(self, device: Device) -> str:
+        """Get the payload encoding agreed with a device."""
+        return (device.config or {}).get('payload_encoding', payload_codec.DEFAULT_ENCODING)
+
+    def _negotiate_encoding(self, device: Device, offered):
+        """Switch a device to the most compact encoding it offers."""
+        encoding = payload_codec.negotiate(offered)
+        current = self._get_encoding(device)
+        if encoding == current:
+            return
+        # Tell the device in the encoding it is using now
+        self.client.publish(
+            self._get_device_topic(device, command=True),
+            payload_codec.encode({'type': 'set_encoding', 'encoding': encoding}, current))
+        device.config = {**(device.config or {}), 'payload_encoding': encoding}
+        logger.info(f"Device {device.name} switched to {encoding} payloads")
+
+    def _handle_state_update(self, device_id: int, payload: Dict[str, Any]):
         """Handle device state updates."""
-        try:
-            # Update device state
-            device.update_state(payload)
-            db.session.commit()
-            logger.info(f"Updated state for device {device.name}")
-
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Error updating device state: {str(e)}")
+        # Bursts for the same device are merged and written in batches
+        state_sink.submit(device_id, payload)
 
     def discover_devices(self):
         """Discover MQTT devices."""
         try:
             # Send discovery message
-            self.client.publish("home/discovery", json.dumps({
+            self.client.publish("home/discovery", json_codec.dumps({
                 "action": "discover",
                 "timestamp": datetime.utcnow().isoformat()
             }))
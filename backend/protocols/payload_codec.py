@@ -0,0 +1,76 @@
+from typing import Any, Dict, Iterable, Union
+import msgpack
+import json_codec
+from models import DeviceCapability
+
+# Encodings a device may offer, most compact first
+ENCODINGS = ('msgpack', 'json')
+DEFAULT_ENCODING = 'json'
+
+# Fields any device may report; integer ids 0-15
+COMMON_FIELDS = ('type', 'status', 'battery', 'timestamp',
+                 'firmware_version', 'ip_address', 'rssi', 'encodings')
+
+# State fields per capability. Each capability owns a block of 16 ids, so
+# fields may be appended without renumbering; never reorder either tuple.
+CAPABILITY_FIELDS = (
+    (DeviceCapability.ON_OFF, ('power', 'on')),
+    (DeviceCapability.BRIGHTNESS, ('brightness',)),
+    (DeviceCapability.COLOR, ('r', 'g', 'b', 'hue', 'sat', 'mired')),
+    (DeviceCapability.TEMPERATURE, ('temperature', 'target_temperature')),
+    (DeviceCapability.HUMIDITY, ('humidity',)),
+    (DeviceCapability.MOTION, ('motion', 'last_motion')),
+    (DeviceCapability.LOCK_UNLOCK, ('locked', 'lock_state', 'door')),
+    (DeviceCapability.VIDEO_STREAM, ('stream_url', 'recording')),
+    (DeviceCapability.CUSTOM_SCRIPT, ('script', 'result')),
+)
+BLOCK_SIZE = 16
+
+
+def _build_field_ids() -> Dict[str, int]:
+    field_ids = {name: index for index, name in enumerate(COMMON_FIELDS)}
+    for block, (_, fields) in enumerate(CAPABILITY_FIELDS, start=1):
+        for offset, name in enumerate(fields):
+            field_ids.setdefault(name, block * BLOCK_SIZE + offset)
+    return field_ids
+
+
+FIELD_IDS = _build_field_ids()
+FIELD_NAMES = {field_id: name for name, field_id in FIELD_IDS.items()}
+
+
+def negotiate(offered: Iterable[str]) -> str:
+    """Pick the most compact encoding a device offers."""
+    offered = set(offered or ())
+    return next((encoding for encoding in ENCODINGS if encoding in offered),
+                DEFAULT_ENCODING)
+
+
+def encode(payload: Dict[str, Any], encoding: str = DEFAULT_ENCODING) -> Union[bytes, str]:
+    """Encode a payload for the wire.
+
+    With ``msgpack``, known field names become their integer ids; unknown
+    names are sent as strings.
+    """
+    if encoding == 'msgpack':
+        return msgpack.packb({FIELD_IDS.get(key, key): value
+                              for key, value in payload.items()})
+    return json_codec.dumps(payload)
+
+
+def decode(data: bytes) -> Any:
+    """Decode a payload in either encoding into plain field names.
+
+    MessagePack maps and JSON objects start with different bytes, so the
+    encoding is detected from the payload itself.
+
+    Raises:
+        ValueError: If the payload is not valid in either encoding
+    """
+    if data and (0x80 <= data[0] <= 0x8f or data[0] in (0xde, 0xdf)):
+        try:
+            payload = msgpack.unpackb(data, strict_map_key=False)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack payload: {str(e)}") from e
+        return {FIELD_NAMES.get(key, key): value for key, value in payload.items()}
+    return json_codec.loads(data)
@@ -53,7 +53,8 @@ class ProtocolFactory:
             config: Optional configuration for the protocol
 
         Returns:
-            ProtocolAdapter: Configured protocol adapter instance
+            ProtocolAdapter: Configured protocol adapter instance, connected
+                if the connection could be made
 
         Raises:
             ValueError: If protocol is not supported
@@ -66,6 +67,9 @@ class ProtocolFactory:
             adapter = protocol_class()
             if config:
                 adapter.configure(config)
+            # A failed first connect is retried by the adapter registry
+            if not adapter.connect():
+                logger.warning(f"{protocol_name} adapter created but not connected")
             return adapter
         except Exception as e:
             logger.error(f"Error creating protocol adapter: {str(e)}")
@@ -0,0 +1,103 @@
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+class _Node:
+    """One topic level in the routing trie."""
+
+    __slots__ = ('children', 'handlers')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.handlers: List[Callable] = []
+
+
+class TopicRouter:
+    """Routes MQTT topics to handlers through a trie of topic levels.
+
+    Patterns follow MQTT filter syntax: ``+`` matches exactly one level and
+    a trailing ``#`` matches the parent level and everything below it.
+    Matching walks the trie once per topic level, so lookup cost depends
+    on topic depth, not on the number of registered patterns.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def add(self, pattern: str, handler: Callable[..., Any]) -> None:
+        """Register a handler for a topic filter."""
+        levels = pattern.split('/')
+        if '#' in levels[:-1]:
+            raise ValueError(f"'#' must be the last level: {pattern}")
+
+        with self._lock:
+            node = self._root
+            for level in levels:
+                node = node.children.setdefault(level, _Node())
+            node.handlers.append(handler)
+            self._count += 1
+
+    def remove(self, pattern: str, handler: Optional[Callable[..., Any]] = None) -> bool:
+        """Unregister a handler, or every handler, for a topic filter.
+
+        Returns:
+            bool: True if anything was removed
+        """
+        levels = pattern.split('/')
+        with self._lock:
+            path = [self._root]
+            for level in levels:
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+
+            node = path[-1]
+            before = len(node.handlers)
+            if handler is None:
+                node.handlers = []
+            else:
+                node.handlers = [h for h in node.handlers if h != handler]
+            removed = before - len(node.handlers)
+            self._count -= removed
+
+            # Prune levels that no longer lead anywhere
+            for level, parent in zip(reversed(levels), reversed(path[:-1])):
+                child = parent.children[level]
+                if child.handlers or child.children:
+                    break
+                del parent.children[level]
+            return removed > 0
+
+    def match(self, topic: str) -> List[Callable[..., Any]]:
+        """Get all handlers whose filter matches a concrete topic."""
+        levels = topic.split('/')
+        depth = len(levels)
+        matched = []
+
+        with self._lock:
+            stack = [(self._root, 0)]
+            while stack:
+                node, index = stack.pop()
+
+                multi = node.children.get('#')
+                # Wildcards don't match system topics like $SYS/...
+                if multi is not None and not (index == 0 and topic.startswith('$')):
+                    matched.extend(multi.handlers)
+
+                if index == depth:
+                    matched.extend(node.handlers)
+                    continue
+
+                exact = node.children.get(levels[index])
+                if exact is not None:
+                    stack.append((exact, index + 1))
+                single = node.children.get('+')
+                if single is not None and not (index == 0 and topic.startswith('$')):
+                    stack.append((single, index + 1))
+        return matched
+
+    def __len__(self):
+        return self._count
@@ -0,0 +1,58 @@
+import threading
+from typing import Dict, Iterable
+from change_bus import change_bus
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueNotifier:
+    """Wakes long-polling requests when a device's script queue changes.
+
+    Every device has a version counter that is bumped on each change.
+    Waiters remember the version they last saw and block until it moves,
+    so a change that lands between reading the queue and starting to wait
+    is never missed. Changes are relayed over the change bus so a
+    long-poll parked on another worker wakes as well.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._condition = threading.Condition()
+
+    def version(self, mac_address: str) -> int:
+        """Get the current change counter for a device's queue."""
+        with self._condition:
+            return self._versions.get(mac_address, 0)
+
+    def init_app(self, app) -> None:
+        """Wake waiters for queue changes made by other workers."""
+        change_bus.subscribe('script_queue', self._notify_remote)
+
+    def notify(self, mac_address: str, publish: bool = True) -> None:
+        """Signal that a device's queue has changed."""
+        with self._condition:
+            self._versions[mac_address] = self._versions.get(
+                mac_address, 0) + 1
+            self._condition.notify_all()
+        if publish:
+            change_bus.publish('script_queue', [mac_address])
+
+    def _notify_remote(self, mac_addresses: Iterable[str]):
+        for mac_address in mac_addresses:
+            self.notify(mac_address, publish=False)
+
+    def wait(self, mac_address: str, version: int, timeout: float) -> bool:
+        """Block until the queue moves past ``version`` or the timeout expires.
+
+        Returns:
+            bool: True if the queue changed, False on timeout
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._versions.get(mac_address, 0) != version,
+                timeout=timeout
+            )
+
+
+queue_notifier = QueueNotifier()
@@ -0,0 +1,266 @@
+import pickle
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import socketio as python_socketio
+from flask import current_app
+from flask_jwt_extended import decode_token
+from flask_socketio import SocketIO, join_room
+from models import db, Device, Home, User
+from auth import load_principal
+from device_registry import device_registry
+import json_codec
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Frame carrying device_state_update, device_status_update and
+# ping_received events, merged per device, once per tick
+BATCH_EVENT = 'device_updates'
+ADMIN_ROOM = 'admins'
+MEMORY_QUEUE_SCHEME = 'memory://'
+
+# The one SocketIO server of this process. Emits from any thread go
+# through its client manager, which relays them to the other workers
+# when a message queue is configured.
+socketio = SocketIO(json=json_codec)
+
+
+def user_room(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def home_room(home_id: int) -> str:
+    return f"home:{home_id}"
+
+
+def device_rooms(owner_id: int) -> Tuple[str, str]:
+    """Get the rooms that receive a device's events.
+
+    The same users as ``device_access_required`` lets through: the
+    device's owner and admins. Other members of the device's home are not
+    included, so home rooms only carry home-wide events.
+    """
+    return user_room(owner_id), ADMIN_ROOM
+
+
+class InProcessManager(python_socketio.PubSubManager):
+    """Message queue stand-in linking SocketIO servers in one process.
+
+    Servers bound to the same ``memory://<channel>`` URL receive what the
+    others publish, pickled as Redis would carry it between workers. For
+    tests and single-host experiments only.
+    """
+    name = 'memory'
+    # channel -> inboxes of the servers listening on it
+    _inboxes: Dict[str, List[queue.Queue]] = {}
+    _inboxes_lock = threading.Lock()
+
+    def initialize(self):
+        if not self.write_only:
+            self._inbox = queue.Queue()
+            with self._inboxes_lock:
+                self._inboxes.setdefault(self.channel, []).append(self._inbox)
+        super().initialize()
+
+    def _publish(self, data):
+        message = pickle.dumps(data)
+        with self._inboxes_lock:
+            inboxes = list(self._inboxes.get(self.channel, ()))
+        for inbox in inboxes:
+            inbox.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+
+def client_manager(url: Optional[str], channel: str = 'flask-socketio'):
+    """Build the client manager for a ``SOCKETIO_MESSAGE_QUEUE`` URL.
+
+    Returns:
+        The manager, or None for a single process without a queue
+
+    Raises:
+        ValueError: If the URL scheme is not supported
+    """
+    if not url:
+        return None
+    if url.startswith(MEMORY_QUEUE_SCHEME):
+        return InProcessManager(channel=url[len(MEMORY_QUEUE_SCHEME):] or channel)
+    if url.startswith(('redis://', 'rediss://')):
+        return python_socketio.RedisManager(url, channel=channel)
+    raise ValueError(f"Unsupported Socket.IO message queue: {url}")
+
+
+def init_socketio(app) -> SocketIO:
+    """Bind the shared SocketIO server to an app and start batching.
+
+    With ``SOCKETIO_MESSAGE_QUEUE`` set, every worker publishes its emits
+    to the queue and delivers those of the others to its own clients, so
+    any number of workers behave as one server.
+    """
+    socketio.init_app(
+        app,
+        cors_allowed_origins=app.config['CORS_ORIGINS'],
+        ping_timeout=app.config.get('SOCKETIO_PING_TIMEOUT', 10),
+        ping_interval=app.config.get('SOCKETIO_PING_INTERVAL', 25),
+        client_manager=client_manager(app.config.get('SOCKETIO_MESSAGE_QUEUE'))
+    )
+    event_batcher.init_app(app, socketio)
+    return socketio
+
+
+def authenticate(auth: Optional[Dict[str, Any]]):
+    """Resolve the principal behind a socket connection's access token.
+
+    Raises:
+        ConnectionRefusedError: If the token is missing or invalid, or the
+            user is unknown or inactive
+    """
+    token = (auth or {}).get('token')
+    if not token:
+        raise ConnectionRefusedError('Authentication required')
+    try:
+        identity = decode_token(token)[current_app.config['JWT_IDENTITY_CLAIM']]
+    except Exception:
+        raise ConnectionRefusedError('Invalid token')
+
+    principal = load_principal(identity)
+    if not principal or not principal.is_active:
+        raise ConnectionRefusedError('User not found or inactive')
+    return principal
+
+
+def join_rooms(principal) -> List[str]:
+    """Join the current connection to its owner and home rooms."""
+    if principal.role == 'admin':
+        rooms = [ADMIN_ROOM]
+    else:
+        home_ids = {home_id for (home_id,) in
+                    db.session.query(Home.id).filter(Home.owner_id == principal.id)}
+        member_of = db.session.query(User.home_id)\
+            .filter(User.id == principal.id).scalar()
+        if member_of is not None:
+            home_ids.add(member_of)
+        rooms = [user_room(principal.id)] + [home_room(home_id) for home_id in home_ids]
+    for room in rooms:
+        join_room(room)
+    return rooms
+
+
+class EventBatcher:
+    """Merges device events per socket room into one frame per tick.
+
+    Successive events of the same kind for the same device within a tick
+    are merged key by key, so a burst of updates costs each room a single
+    ``device_updates`` frame shaped ``{event: [payload, ...]}``.
+    """
+
+    def __init__(self, interval: float = 0.25):
+        # room -> event -> device key -> merged payload
+        self._pending: Dict[str, Dict[str, Dict[Any, Dict]]] = {}
+        self._lock = threading.Lock()
+        self._interval = interval
+        self._socketio = None
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'published': 0, 'frames': 0}
+
+    def init_app(self, app, socketio) -> None:
+        """Start emitting batched frames through a SocketIO instance."""
+        self._socketio = socketio
+        self._interval = app.config.get('SOCKET_BATCH_INTERVAL', self._interval)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='socket-batcher', daemon=True)
+            self._thread.start()
+
+    def publish(self, event: str, entries: Iterable[Tuple[int, str, Dict[str, Any]]]) -> None:
+        """Queue an event for each (owner_id, mac_address, payload).
+
+        Plain values rather than devices, so callers can capture them
+        before a commit expires the instances.
+        """
+        with self._lock:
+            for owner_id, mac_address, payload in entries:
+                self._add(device_rooms(owner_id), event, mac_address, payload)
+
+    @staticmethod
+    def entry(device: Device, payload: Dict[str, Any]) -> Tuple[int, str, Dict[str, Any]]:
+        """Capture what publish() needs from a device."""
+        return device.owner_id, device.mac_address, payload
+
+    def publish_pings(self, mac_addresses: Iterable[str],
+                      timestamp: Optional[float] = None) -> None:
+        """Queue ``ping_received`` for devices identified by MAC address.
+
+        Owners come from the device registry, so pings stay free of
+        database reads.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        records = [record for record in map(device_registry.by_mac, mac_addresses)
+                   if record is not None]
+        with self._lock:
+            for record in records:
+                self._add(device_rooms(record.owner_id),
+                          'ping_received', record.mac_address,
+                          {'mac_address': record.mac_address, 'last_ping_time': timestamp})
+
+    def publish_automation(self, automation_id: int, home_id: int, name: str,
+                           fired_at: Optional[float] = None) -> None:
+        """Queue ``automation_triggered`` for a home's members."""
+        fired_at = time.time() if fired_at is None else fired_at
+        with self._lock:
+            self._add((home_room(home_id), ADMIN_ROOM), 'automation_triggered',
+                      ('automation', automation_id),
+                      {'automation_id': automation_id, 'home_id': home_id,
+                       'name': name, 'triggered_at': fired_at})
+
+    def flush(self) -> int:
+        """Emit one frame per room with everything queued since the last tick.
+
+        Returns:
+            int: Number of frames emitted
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for room, events in pending.items():
+            frame = {event: list(payloads.values()) for event, payloads in events.items()}
+            self._socketio.emit(BATCH_EVENT, frame, to=room)
+        with self._lock:
+            self._stats['frames'] += len(pending)
+        return len(pending)
+
+    def metrics(self) -> Dict[str, int]:
+        """Get event and frame counters."""
+        with self._lock:
+            return {'pending_rooms': len(self._pending), **self._stats}
+
+    def _add(self, rooms, event, key, payload):
+        self._stats['published'] += 1
+        for room in rooms:
+            merged = self._pending.setdefault(room, {}).setdefault(event, {})
+            if key in merged:
+                merged[key].update(payload)
+            else:
+                merged[key] = dict(payload)
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error emitting socket batch: {str(e)}")
+
+
+event_batcher = EventBatcher()
+
+
+# Socket connections must carry an access token and only join the rooms
+# of devices their user can see
+@socketio.on('connect')
+def _connect(auth=None):
+    principal = authenticate(auth)
+    join_rooms(principal)
@@ -0,0 +1,152 @@
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+from flask import g, has_request_context, request
+from sqlalchemy import and_, event, or_
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from models import db, User, Home, Device, DeviceEvent, ScriptQueue
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Relationship paths each model's to_dict() can walk, and how to load them
+# up front. Collections use selectinload (one IN query per level, however
+# many parents); single objects use joinedload (no extra query).
+LOADERS = {
+    Device: {
+        'scripts': lambda: selectinload(Device.scripts),
+    },
+    ScriptQueue: {
+        'script': lambda: joinedload(ScriptQueue.script),
+    },
+    Home: {
+        'rooms': lambda: selectinload(Home.rooms),
+    },
+    User: {
+        'devices': lambda: selectinload(User.devices),
+        'devices.scripts': lambda: selectinload(User.devices).selectinload(Device.scripts),
+    },
+}
+
+
+def load_options(model, include: Iterable[str] = ()) -> list:
+    """Get loader options for the relationship paths a response includes.
+
+    Raises:
+        ValueError: If a path is not serializable for the model
+    """
+    loaders = LOADERS.get(model, {})
+    options = []
+    for path in include:
+        if path not in loaders:
+            raise ValueError(f"Cannot include {path} for {model.__name__}")
+        options.append(loaders[path]())
+    return options
+
+
+def shaped_query(model, include: Iterable[str] = (), fields: Optional[Sequence[str]] = None):
+    """Query a model, loading only the columns and relationships requested."""
+    query = model.query.options(*load_options(model, include))
+    if fields:
+        query = query.options(load_only(*(getattr(model, field) for field in fields)))
+    return query
+
+
+def list_devices(owner_id: Optional[int] = None, after: Optional[int] = None,
+                 limit: Optional[int] = None, include: Iterable[str] = (),
+                 fields: Optional[Sequence[str]] = None) -> List[Device]:
+    """List devices in id order, optionally for one owner and after a cursor."""
+    query = shaped_query(Device, include, fields).order_by(Device.id)
+    if owner_id is not None:
+        query = query.filter(Device.owner_id == owner_id)
+    if after is not None:
+        query = query.filter(Device.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def list_users(include_devices: bool = False) -> List[User]:
+    """List users, with devices and their scripts if they will be serialized."""
+    include = ('devices', 'devices.scripts') if include_devices else ()
+    return shaped_query(User, include).order_by(User.id).all()
+
+
+def list_homes(owner_id: Optional[int] = None) -> List[Home]:
+    """List homes with their rooms."""
+    query = shaped_query(Home, ('rooms',)).order_by(Home.id)
+    if owner_id is not None:
+        query = query.filter(Home.owner_id == owner_id)
+    return query.all()
+
+
+def list_queue(mac_address: str, status: Optional[str] = 'pending') -> List[ScriptQueue]:
+    """List a device's queue items in execution order, with their scripts."""
+    query = shaped_query(ScriptQueue, ('script',)).join(Device)\
+        .filter(Device.mac_address == mac_address)
+    if status is not None:
+        query = query.filter(ScriptQueue.status == status)
+    return query.order_by(ScriptQueue.position).all()
+
+
+def event_cursor(event: DeviceEvent) -> str:
+    """Get the keyset cursor that pages past an event."""
+    return f"{event.created_at.isoformat()}_{event.id}"
+
+
+def parse_event_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Split an event cursor into its creation time and id.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    created_at, _, event_id = cursor.rpartition('_')
+    return datetime.fromisoformat(created_at), int(event_id)
+
+
+def list_device_events(device_id: int, before: Optional[Tuple[datetime, int]] = None,
+                       limit: int = 100,
+                       event_types: Optional[Sequence[str]] = None) -> List[DeviceEvent]:
+    """List a device's events newest first, optionally older than a cursor.
+
+    Walks the (device_id, created_at, id) index backwards, so a page costs
+    the same however much history the device has.
+    """
+    query = DeviceEvent.query.filter(DeviceEvent.device_id == device_id)
+    if before is not None:
+        created_at, event_id = before
+        query = query.filter(or_(
+            DeviceEvent.created_at < created_at,
+            and_(DeviceEvent.created_at == created_at, DeviceEvent.id < event_id)))
+    if event_types:
+        query = query.filter(DeviceEvent.event_type.in_(event_types))
+    return query.order_by(DeviceEvent.created_at.desc(), DeviceEvent.id.desc())\
+        .limit(limit).all()
+
+
+def init_app(app) -> None:
+    """Count SQL statements per request and warn above ``QUERY_BUDGET``.
+
+    Listings should stay within a constant number of statements however
+    many rows they return; a warning here usually means a lazy load
+    inside a loop. Disabled when ``QUERY_BUDGET`` is unset.
+    """
+    budget = app.config.get('QUERY_BUDGET')
+    if not budget:
+        return
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _count_statement(conn, cursor, statement, parameters, context, executemany):
+            if has_request_context():
+                g.query_count = g.get('query_count', 0) + 1
+
+    @app.after_request
+    def _check_query_budget(response):
+        count = g.get('query_count', 0)
+        if count > budget:
+            logger.warning(
+                f"{request.method} {request.path} ran {count} queries "
+                f"(budget {budget})")
+        if app.debug or app.testing:
+            response.headers['X-Query-Count'] = str(count)
+        return response
@@ -0,0 +1,71 @@
+import math
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+# Sun's centre 50 arc-minutes below the horizon: refraction plus the
+# apparent radius of the disc
+OFFICIAL_ZENITH = 90.833
+
+
+def sun_event(day: date, latitude: float, longitude: float, rising: bool,
+              zenith: float = OFFICIAL_ZENITH) -> Optional[datetime]:
+    """Compute sunrise or sunset for a local calendar day.
+
+    Uses the almanac sunrise equation, accurate to about a minute between
+    the polar circles, with no network access.
+
+    Args:
+        day: Local calendar date at the location
+        latitude: Degrees north
+        longitude: Degrees east
+        rising: True for sunrise, False for sunset
+        zenith: Solar zenith angle that counts as the event
+
+    Returns:
+        Optional[datetime]: Naive UTC time of the event, or None if the sun
+        does not rise or set that day (polar day or night)
+    """
+    lng_hour = longitude / 15
+    local_hour = 6 if rising else 18
+    t = day.timetuple().tm_yday + (local_hour - lng_hour) / 24
+
+    # Sun's mean anomaly and true longitude
+    m = 0.9856 * t - 3.289
+    sun_lng = (m + 1.916 * _sin(m) + 0.020 * _sin(2 * m) + 282.634) % 360
+
+    # Right ascension, in the same quadrant as the true longitude
+    ra = math.degrees(math.atan(0.91764 * _tan(sun_lng))) % 360
+    ra += math.floor(sun_lng / 90) * 90 - math.floor(ra / 90) * 90
+    ra /= 15
+
+    sin_dec = 0.39782 * _sin(sun_lng)
+    cos_dec = math.cos(math.asin(sin_dec))
+    cos_h = (_cos(zenith) - sin_dec * _sin(latitude)) / \
+        (cos_dec * _cos(latitude))
+    if cos_h > 1 or cos_h < -1:
+        return None
+
+    h = math.degrees(math.acos(cos_h))
+    if rising:
+        h = 360 - h
+    h /= 15
+
+    local_mean_time = h + ra - 0.06571 * t - 6.622
+    ut = local_mean_time - lng_hour
+    # Pick the wrap of UT closest to the expected event so it stays on
+    # the requested local day
+    expected = local_hour - lng_hour
+    ut += 24 * round((expected - ut) / 24)
+    return datetime(day.year, day.month, day.day) + timedelta(hours=ut)
+
+
+def _sin(degrees):
+    return math.sin(math.radians(degrees))
+
+
+def _cos(degrees):
+    return math.cos(math.radians(degrees))
+
+
+def _tan(degrees):
+    return math.tan(math.radians(degrees))
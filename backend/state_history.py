@@ -0,0 +1,141 @@
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from sqlalchemy import and_, or_
+from models import db, DeviceEvent
+import logging
+
+logger = logging.getLogger(__name__)
+
+KEYFRAME_EVENT = 'state_keyframe'
+DELTA_EVENT = 'state_change'
+_MISSING = object()
+
+
+def diff(old_state: Dict[str, Any], new_state: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Get the keys a state change touched, before and after.
+
+    A key only in ``before`` was removed; a key only in ``after`` was added.
+    """
+    before = {key: value for key, value in old_state.items()
+              if new_state.get(key, _MISSING) != value}
+    after = {key: value for key, value in new_state.items()
+             if old_state.get(key, _MISSING) != value}
+    return before, after
+
+
+def apply(state: Dict[str, Any], before: Optional[Dict[str, Any]],
+          after: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Replay one state event onto a state, in place.
+
+    Works for deltas, keyframes (``after`` is the full state) and rows
+    written before delta encoding (full old and new snapshots).
+    """
+    after = after or {}
+    for key in before or ():
+        if key not in after:
+            state.pop(key, None)
+    state.update(after)
+    return state
+
+
+class StateHistory:
+    """Records device state changes as per-key deltas with keyframes.
+
+    Each ``state_change`` event holds only the keys that changed, their
+    old values in ``old_state`` and new ones in ``new_state``. Every
+    ``keyframe_interval`` changes of a device (and on its first change in
+    this process) the event is a ``state_keyframe`` whose ``new_state``
+    is the full state, so reconstruction replays a bounded number of
+    deltas. Retention removes keyframes along with deltas, so states from
+    before the oldest kept keyframe are reported as incomplete.
+    """
+
+    def __init__(self, keyframe_interval: int = 50):
+        self._keyframe_interval = keyframe_interval
+        # device_id -> deltas written since its last keyframe
+        self._since_keyframe: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Load the keyframe interval from the app config."""
+        self._keyframe_interval = app.config.get(
+            'STATE_KEYFRAME_INTERVAL', self._keyframe_interval)
+
+    def record(self, device_id: int, old_state: Dict[str, Any], new_state: Dict[str, Any],
+               event_type: Optional[str] = None, message: Optional[str] = None) -> DeviceEvent:
+        """Build the event for a state change; the caller adds and commits it.
+
+        Args:
+            device_id: ID of the device
+            old_state: State before the change
+            new_state: State after the change
+            event_type: Event type for other events carrying a change, such
+                as ``automation_triggered``; these never become keyframes
+            message: Optional event message
+
+        Returns:
+            DeviceEvent: The unsaved event
+        """
+        before, after = diff(old_state, new_state)
+        if event_type is None:
+            event_type = DELTA_EVENT
+            with self._lock:
+                count = self._since_keyframe.get(device_id)
+                if count is None or count + 1 >= self._keyframe_interval:
+                    event_type, after = KEYFRAME_EVENT, dict(new_state)
+                    self._since_keyframe[device_id] = 0
+                else:
+                    self._since_keyframe[device_id] = count + 1
+        return DeviceEvent(
+            device_id=device_id,
+            event_type=event_type,
+            old_state=before,
+            new_state=after,
+            message=message,
+            created_at=datetime.utcnow()
+        )
+
+    def state_at(self, device_id: int, at: datetime) -> Optional[Dict[str, Any]]:
+        """Reconstruct a device's state at a moment from its history.
+
+        Replays deltas forward from the nearest keyframe at or before
+        ``at``. Without one, as for moments before the oldest keyframe
+        retention kept, the replay starts from the latest change and only
+        holds the keys changed since, so ``complete`` is False.
+
+        Returns:
+            Optional[Dict[str, Any]]: ``state``, ``complete``,
+                ``keyframe_at`` and ``replayed`` (deltas applied), or None
+                without history
+        """
+        history = DeviceEvent.query.filter(
+            DeviceEvent.device_id == device_id,
+            DeviceEvent.created_at <= at)\
+            .order_by(DeviceEvent.created_at.desc(), DeviceEvent.id.desc())
+        keyframe = history.filter(DeviceEvent.event_type == KEYFRAME_EVENT).first() or \
+            history.filter(DeviceEvent.event_type == DELTA_EVENT).first()
+        if keyframe is None:
+            return None
+
+        deltas = db.session.query(DeviceEvent.old_state, DeviceEvent.new_state)\
+            .filter(DeviceEvent.device_id == device_id,
+                    DeviceEvent.event_type == DELTA_EVENT,
+                    DeviceEvent.created_at <= at,
+                    or_(DeviceEvent.created_at > keyframe.created_at,
+                        and_(DeviceEvent.created_at == keyframe.created_at,
+                             DeviceEvent.id > keyframe.id)))\
+            .order_by(DeviceEvent.created_at, DeviceEvent.id).all()
+
+        state = dict(keyframe.new_state or {})
+        for before, after in deltas:
+            apply(state, before, after)
+        return {
+            'state': state,
+            'complete': keyframe.event_type == KEYFRAME_EVENT,
+            'keyframe_at': keyframe.created_at,
+            'replayed': len(deltas)
+        }
+
+
+state_history = StateHistory()
@@ -0,0 +1,168 @@
+import atexit
+import threading
+from typing import Any, Dict, Optional
+from models import db, Device
+from state_history import state_history
+from telemetry import telemetry, is_sensor
+from realtime import event_batcher
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StateSink:
+    """Write-behind buffer for device state updates.
+
+    Updates to the same device that arrive within one flush window are
+    merged key by key (last writer wins), then every merged state and its
+    ``state_change`` event is written in a single transaction per batch.
+    Automation triggers see the merged change, so transitions that start
+    and end inside one window are not observed; keep the window short.
+    Rows are locked in id order while merging, so workers writing the
+    same device serialize instead of overwriting each other's keys.
+
+    A failed batch is retried with its devices written one per
+    transaction, so one bad update cannot hold back the rest; a device
+    whose update fails ``max_attempts`` times has it dropped.
+    """
+
+    def __init__(self, flush_interval: float = 0.25, batch_size: int = 500,
+                 max_attempts: int = 5):
+        # device_id -> merged pending update
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        # device_id -> failed writes of its pending update
+        self._attempts: Dict[int, int] = {}
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._app = None
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._thread: Optional[threading.Thread] = None
+
+    def init_app(self, app) -> None:
+        """Bind the sink to an app and start the background flusher."""
+        self._app = app
+        self._flush_interval = app.config.get(
+            'STATE_FLUSH_INTERVAL', self._flush_interval)
+        self._batch_size = app.config.get('STATE_BATCH_SIZE', self._batch_size)
+        self._max_attempts = app.config.get('STATE_WRITE_ATTEMPTS', self._max_attempts)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='state-sink', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def submit(self, device_id: int, state: Dict[str, Any]) -> None:
+        """Queue a partial state update for a device."""
+        with self._lock:
+            pending = self._pending.get(device_id)
+            if pending is None:
+                self._pending[device_id] = dict(state)
+            else:
+                pending.update(state)
+            full = len(self._pending) >= self._batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write pending states to the database, one transaction per batch.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: Number of devices whose state changed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            retrying = [(device_id, state) for device_id, state in pending.items()
+                        if device_id in self._attempts]
+
+        items = [(device_id, state) for device_id, state in pending.items()
+                 if device_id not in self._attempts]
+        changed = 0
+        for start in range(0, len(items), self._batch_size):
+            changed += self._write_batch(dict(items[start:start + self._batch_size]))
+        # Updates that failed before are written alone to isolate bad ones
+        for device_id, state in retrying:
+            changed += self._write_batch({device_id: state})
+        return changed
+
+    def stop(self) -> None:
+        """Stop the background flusher and write any pending states."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+    def _write_batch(self, batch: Dict[int, Dict[str, Any]]) -> int:
+        changes = []
+        updates = []
+        readings = []
+        try:
+            devices = Device.query.filter(Device.id.in_(batch.keys()))\
+                .order_by(Device.id).with_for_update().all()
+            for device in devices:
+                # Sensors repeating a value still count as a reading
+                if is_sensor(device.capabilities):
+                    readings.append((device.id, batch[device.id]))
+                old_state = dict(device.state or {})
+                new_state = {**old_state, **batch[device.id]}
+                if new_state == old_state:
+                    continue
+                device.state = new_state
+                db.session.add(state_history.record(device.id, old_state, new_state))
+                changes.append((device, old_state, new_state))
+                updates.append(event_batcher.entry(device, {
+                    'device_id': device.id,
+                    'mac_address': device.mac_address,
+                    'state': new_state
+                }))
+            db.session.commit()
+            logger.debug(f"Flushed state for {len(changes)} devices")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error flushing device states: {str(e)}")
+            self._requeue(batch)
+            return 0
+
+        if self._attempts:
+            with self._lock:
+                for device_id in batch:
+                    self._attempts.pop(device_id, None)
+
+        for device_id, state in readings:
+            telemetry.observe(device_id, state)
+        event_batcher.publish('device_state_update', updates)
+        from automation_engine import check_device_triggers
+        for device, old_state, new_state in changes:
+            check_device_triggers(device, old_state, new_state)
+        return len(changes)
+
+    def _requeue(self, batch: Dict[int, Dict[str, Any]]):
+        # Newer updates that arrived meanwhile take precedence
+        with self._lock:
+            for device_id, state in batch.items():
+                attempts = self._attempts.get(device_id, 0) + 1
+                if attempts >= self._max_attempts:
+                    self._attempts.pop(device_id, None)
+                    logger.error(f"Dropping state update of {sorted(state)} for device "
+                                 f"{device_id} after {attempts} failed writes")
+                    continue
+                self._attempts[device_id] = attempts
+                self._pending[device_id] = {**state, **self._pending.get(device_id, {})}
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                with self._app.app_context():
+                    self.flush()
+            except Exception as e:
+                logger.error(f"Error running state sink: {str(e)}")
+
+
+state_sink = StateSink()
@@ -0,0 +1,298 @@
+import atexit
+import math
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, DeviceCapability, TelemetryRollup
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds per bucket, finest first
+RESOLUTIONS = (60, 3600, 86400)
+SENSOR_CAPABILITIES = frozenset(capability.value for capability in (
+    DeviceCapability.TEMPERATURE, DeviceCapability.HUMIDITY, DeviceCapability.MOTION))
+MAX_KEY_LENGTH = 64
+
+# Dialect -> (insert construct, two-argument min, two-argument max)
+UPSERTS = {
+    'postgresql': (postgresql.insert, func.least, func.greatest),
+    'sqlite': (sqlite.insert, func.min, func.max),
+}
+
+
+def is_sensor(capabilities: Optional[Iterable]) -> bool:
+    """Check whether a device's capabilities make it report telemetry."""
+    return any(getattr(capability, 'value', capability) in SENSOR_CAPABILITIES
+               for capability in capabilities or ())
+
+
+def numeric_readings(state: Dict[str, Any]) -> Dict[str, float]:
+    """Get the numeric keys of a state; booleans (motion) count as 0 or 1."""
+    readings = {}
+    for key, value in state.items():
+        if isinstance(value, (bool, int, float)) and len(key) <= MAX_KEY_LENGTH:
+            value = float(value)
+            if math.isfinite(value):
+                readings[key] = value
+    return readings
+
+
+def rollup(series: np.ndarray, timestamps: np.ndarray, values: np.ndarray,
+           resolution: int) -> Tuple[np.ndarray, ...]:
+    """Aggregate samples into buckets of ``resolution`` seconds per series.
+
+    Returns:
+        Tuple[np.ndarray, ...]: series, bucket start (epoch seconds),
+            count, sum, min and max, one element per (series, bucket)
+    """
+    buckets = (timestamps // resolution).astype(np.int64) * resolution
+    order = np.lexsort((buckets, series))
+    series, buckets, values = series[order], buckets[order], values[order]
+    boundary = np.empty(len(values), dtype=bool)
+    boundary[:1] = True
+    boundary[1:] = (series[1:] != series[:-1]) | (buckets[1:] != buckets[:-1])
+    starts = np.flatnonzero(boundary)
+    counts = np.diff(np.append(starts, len(values)))
+    return (series[starts], buckets[starts], counts,
+            np.add.reduceat(values, starts),
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts))
+
+
+def choose_resolution(start: datetime, end: datetime, max_points: int) -> int:
+    """Get the finest resolution that covers a range in ``max_points`` buckets."""
+    span = (end - start).total_seconds()
+    for resolution in RESOLUTIONS:
+        if span / resolution <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+class TelemetryAggregator:
+    """Rolls numeric sensor readings up into min/max/sum/count buckets.
+
+    Readings are buffered in flat arrays and aggregated with NumPy at
+    every resolution on each flush, then merged into the stored buckets
+    with one upsert per flush, so the cost per reading is an array append.
+    Readings older than a resolution's retention are dropped from its
+    buckets by the same thread. After ``max_attempts`` failed flushes the
+    buckets are written one device per transaction and those that still
+    fail are dropped, so one bad device cannot grow the buffer forever.
+    """
+
+    def __init__(self, flush_interval: float = 5.0,
+                 retention_days: Optional[Dict[int, Optional[int]]] = None,
+                 max_attempts: int = 5):
+        # (device_id, key) -> series index, and back
+        self._series: Dict[Tuple[int, str], int] = {}
+        self._series_keys: List[Tuple[int, str]] = []
+        self._samples = (array('l'), array('d'), array('d'))
+        self._lock = threading.Lock()
+        self._flush_interval = flush_interval
+        self._retention_days = retention_days or {60: 7, 3600: 180, 86400: None}
+        self._app = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._last_prune = 0.0
+        self._max_attempts = max_attempts
+        self._failures = 0
+
+    def init_app(self, app) -> None:
+        """Bind the aggregator to an app and start the background flusher."""
+        self._app = app
+        self._flush_interval = app.config.get('TELEMETRY_FLUSH_INTERVAL', self._flush_interval)
+        self._retention_days = app.config.get('TELEMETRY_RETENTION_DAYS', self._retention_days)
+        self._max_attempts = app.config.get('TELEMETRY_WRITE_ATTEMPTS', self._max_attempts)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='telemetry', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def observe(self, device_id: int, state: Dict[str, Any],
+                timestamp: Optional[float] = None) -> int:
+        """Buffer the numeric keys of a sensor's state update.
+
+        Returns:
+            int: Number of readings buffered
+        """
+        readings = numeric_readings(state)
+        if not readings:
+            return 0
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            series_ids, timestamps, values = self._samples
+            for key, value in readings.items():
+                series = self._series.get((device_id, key))
+                if series is None:
+                    series = len(self._series_keys)
+                    self._series[(device_id, key)] = series
+                    self._series_keys.append((device_id, key))
+                series_ids.append(series)
+                timestamps.append(timestamp)
+                values.append(value)
+        return len(readings)
+
+    def flush(self) -> int:
+        """Merge buffered readings into the stored buckets.
+
+        Must be called inside an application context.
+
+        Returns:
+            int: Number of buckets written
+        """
+        with self._lock:
+            samples, self._samples = self._samples, (array('l'), array('d'), array('d'))
+            series_keys = list(self._series_keys)
+        if not samples[0]:
+            return 0
+
+        series_ids, timestamps, values = (np.frombuffer(column, dtype=column.typecode)
+                                          for column in samples)
+        rows = []
+        for resolution in RESOLUTIONS:
+            for series, start, count, total, low, high in zip(
+                    *rollup(series_ids, timestamps, values, resolution)):
+                device_id, key = series_keys[series]
+                rows.append({
+                    'device_id': device_id,
+                    'key': key,
+                    'resolution': resolution,
+                    'bucket_start': datetime.utcfromtimestamp(int(start)),
+                    'count': int(count),
+                    'sum': float(total),
+                    'min': float(low),
+                    'max': float(high)
+                })
+        try:
+            self._upsert(rows)
+            db.session.commit()
+            self._failures = 0
+            return len(rows)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error writing telemetry rollups: {str(e)}")
+            self._failures += 1
+            if self._failures < self._max_attempts:
+                self._requeue(samples)
+                return 0
+
+        self._failures = 0
+        return self._write_per_device(rows)
+
+    def series(self, device_id: int, start: datetime, end: datetime,
+               keys: Optional[Sequence[str]] = None, max_points: int = 500,
+               resolution: Optional[int] = None) -> Tuple[int, Dict[str, List[TelemetryRollup]]]:
+        """Read a device's buckets for a time range.
+
+        Args:
+            device_id: ID of the device
+            start: Naive UTC start of the range
+            end: Naive UTC end of the range
+            keys: State keys to read, or None for all of them
+            max_points: Most buckets per key the caller wants; picks the
+                finest resolution that fits unless ``resolution`` is given
+            resolution: Seconds per bucket, one of RESOLUTIONS
+
+        Returns:
+            Tuple[int, Dict[str, List[TelemetryRollup]]]: Resolution read,
+                and each key's buckets in time order
+        """
+        resolution = resolution or choose_resolution(start, end, max_points)
+        query = TelemetryRollup.query.filter(
+            TelemetryRollup.device_id == device_id,
+            TelemetryRollup.resolution == resolution,
+            TelemetryRollup.bucket_start >= start - timedelta(seconds=resolution - 1),
+            TelemetryRollup.bucket_start <= end)
+        if keys:
+            query = query.filter(TelemetryRollup.key.in_(keys))
+        result: Dict[str, List[TelemetryRollup]] = {}
+        for bucket in query.order_by(TelemetryRollup.key, TelemetryRollup.bucket_start):
+            result.setdefault(bucket.key, []).append(bucket)
+        return resolution, result
+
+    def prune(self, now: Optional[datetime] = None) -> int:
+        """Delete buckets older than their resolution's retention.
+
+        Returns:
+            int: Number of buckets deleted
+        """
+        now = now or datetime.utcnow()
+        deleted = 0
+        try:
+            for resolution, days in self._retention_days.items():
+                if days is None:
+                    continue
+                deleted += TelemetryRollup.query.filter(
+                    TelemetryRollup.resolution == resolution,
+                    TelemetryRollup.bucket_start < now - timedelta(days=days))\
+                    .delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error pruning telemetry rollups: {str(e)}")
+            return 0
+        return deleted
+
+    def stop(self) -> None:
+        """Stop the background flusher and write any buffered readings."""
+        self._stop.set()
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+    def _upsert(self, rows: List[Dict[str, Any]]):
+        insert, least, greatest = UPSERTS[db.engine.dialect.name]
+        table = TelemetryRollup.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={
+                'count': table.c.count + statement.excluded['count'],
+                'sum': table.c.sum + statement.excluded['sum'],
+                'min': least(table.c.min, statement.excluded['min']),
+                'max': greatest(table.c.max, statement.excluded['max'])
+            })
+        db.session.execute(statement, rows)
+
+    def _write_per_device(self, rows: List[Dict[str, Any]]) -> int:
+        """Write each device's buckets alone, dropping those that fail."""
+        by_device: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_device.setdefault(row['device_id'], []).append(row)
+        written = 0
+        for device_id, device_rows in by_device.items():
+            try:
+                self._upsert(device_rows)
+                db.session.commit()
+                written += len(device_rows)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Dropping {len(device_rows)} telemetry buckets of device "
+                             f"{device_id}: {str(e)}")
+        return written
+
+    def _requeue(self, samples):
+        with self._lock:
+            for pending, failed in zip(self._samples, samples):
+                pending.extend(failed)
+
+    def _run(self):
+        while not self._stop.wait(self._flush_interval):
+            try:
+                with self._app.app_context():
+                    self.flush()
+                    if time.monotonic() - self._last_prune > 3600:
+                        self._last_prune = time.monotonic()
+                        self.prune()
+            except Exception as e:
+                logger.error(f"Error running telemetry aggregator: {str(e)}")
+
+
+telemetry = TelemetryAggregator()
@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """One app for the session; the background services are process-wide."""
+    from config import config, TestingConfig
+    from app import create_app
+
+    directory = tmp_path_factory.mktemp('app')
+
+    class TestConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{directory / 'test.db'}"
+        LOG_FILE = str(directory / 'app.log')
+
+    config['pytest'] = TestConfig
+    return create_app('pytest')
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,36 @@
+import threading
+from sqlalchemy import event
+from device_registry import device_registry
+from models import db, Device, DeviceType, User
+
+
+def test_unknown_macs_are_cached_until_added(app):
+    mac = '02:00:00:03:00:01'
+    statements = []
+
+    def count(*args):
+        # Background flushers share the engine
+        if threading.get_ident() == test_thread:
+            statements.append(args[2])
+
+    test_thread = threading.get_ident()
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            assert device_registry.find(mac) is None
+            assert device_registry.find(mac) is None
+            assert device_registry.find_many([mac]) == {}
+            assert len(statements) == 1
+
+            owner = User(username='registrar', email='registrar@example.com')
+            owner.set_password('password')
+            db.session.add_all([owner, Device(mac_address=mac, name='New',
+                                              device_type=DeviceType.LOCK, owner=owner)])
+            db.session.commit()
+
+            del statements[:]
+            assert device_registry.find(mac).mac_address == mac
+            assert statements == []
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
@@ -0,0 +1,65 @@
+from flask_jwt_extended import create_access_token
+import device_manager
+from heartbeat import HeartbeatTable
+from models import db, Device, DeviceType, User
+
+
+def test_flush_never_moves_ping_time_back(app):
+    with app.test_request_context():
+        owner = User(username='pinger', email='pinger@example.com')
+        owner.set_password('password')
+        device = Device(mac_address='02:00:00:02:00:01', name='Pinger',
+                        device_type=DeviceType.LOCK, owner=owner, last_ping_time=2000.0)
+        db.session.add_all([owner, device])
+        db.session.commit()
+
+        # Another worker's table, holding an older ping than the database
+        table = HeartbeatTable()
+        table.record(device.mac_address, 1000.0)
+        table.flush()
+        db.session.refresh(device)
+        assert device.last_ping_time == 2000.0
+
+        table.record(device.mac_address, 3000.0)
+        table.flush()
+        db.session.refresh(device)
+        assert device.last_ping_time == 3000.0
+
+
+def test_last_ping_time_prefers_the_later_value(app):
+    with app.test_request_context():
+        owner = User(username='reader', email='reader@example.com')
+        owner.set_password('password')
+        device = Device(mac_address='02:00:00:02:00:02', name='Reader',
+                        device_type=DeviceType.LOCK, owner=owner, last_ping_time=5000.0)
+        db.session.add_all([owner, device])
+        db.session.commit()
+
+        device_manager.heartbeats.record(device.mac_address, 4000.0)
+        assert device_manager.get_last_ping_time(device.mac_address) == 5000.0
+
+
+def test_bulk_heartbeat_reports_bad_entries(app, client):
+    with app.app_context():
+        owner = User(username='batcher', email='batcher@example.com')
+        owner.set_password('password')
+        macs = ['02:00:00:02:00:03', '02:00:00:02:00:04', '02:00:00:02:00:05']
+        db.session.add(owner)
+        db.session.add_all(Device(mac_address=mac, name=mac, device_type=DeviceType.LOCK,
+                                  owner=owner) for mac in macs)
+        db.session.commit()
+        headers = {'Authorization': f"Bearer {create_access_token(identity=owner.username)}"}
+
+    response = client.post('/api/heartbeats', headers=headers, json={'devices': [
+        {'mac_address': macs[0], 'status': 'online'},
+        {'mac_address': macs[1], 'status': ['online']},
+        {'mac_address': macs[2], 'ip_address': 'x' * 100},
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['updated'] == [macs[0]]
+    assert set(body['errors']) == {macs[1], macs[2]}
+
+    response = client.post('/api/heartbeats', headers=headers,
+                           json={'devices': [{'mac_address': [macs[0]]}]})
+    assert response.status_code == 400
@@ -0,0 +1,92 @@
+from itertools import count
+import pytest
+from flask import has_request_context
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from models import db, Device, DeviceType, Script, ScriptQueue, User
+
+# Statements a listing may run however many rows it returns
+MAX_LISTING_QUERIES = 6
+
+_ids = count(1)
+
+
+def _add_devices(owner, n):
+    """Add ``n`` devices with scripts and a queue item per script."""
+    for _ in range(n):
+        i = next(_ids)
+        device = Device(mac_address=f"02:00:00:00:{i // 256:02X}:{i % 256:02X}",
+                        name=f"Device {i}", device_type=DeviceType.LOCK, owner=owner)
+        scripts = [Script(name=f"script{j}", content="print(1)", device=device)
+                   for j in range(2)]
+        db.session.add_all([device, *scripts])
+        db.session.add_all(ScriptQueue(device=device, script=script, position=j)
+                           for j, script in enumerate(scripts))
+    db.session.commit()
+
+
+def _add_users(n):
+    for _ in range(n):
+        i = next(_ids)
+        user = User(username=f"user{i}", email=f"user{i}@example.com", role='viewer')
+        user.set_password('password')
+        db.session.add(user)
+    db.session.commit()
+
+
+@pytest.fixture
+def query_counter(app):
+    """Count the SQL statements run while handling requests."""
+    counter = {'count': 0}
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            counter['count'] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _count)
+    yield counter
+    event.remove(engine, 'before_cursor_execute', _count)
+
+
+def _queries(client, counter, path, headers):
+    counter['count'] = 0
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return counter['count']
+
+
+def test_listings_run_constant_queries(app, client, query_counter):
+    with app.app_context():
+        admin = User.query.filter_by(role='admin').first()
+        headers = {'Authorization': f"Bearer {create_access_token(identity=admin.username)}"}
+        # One device collects a queue item per device added
+        queue_device = Device(mac_address="02:FF:00:00:00:01", name="Queue",
+                              device_type=DeviceType.LOCK, owner=admin)
+        db.session.add(queue_device)
+        db.session.commit()
+        queue_device_id = queue_device.id
+        queue_path = f"/api/scripts-queue/{queue_device.mac_address}"
+    paths = ('/api/devices?include=scripts', '/api/users', queue_path)
+
+    # The first request also resolves and caches the principal
+    for path in paths:
+        _queries(client, query_counter, path, headers)
+
+    counts = []
+    for n in (5, 50):
+        with app.app_context():
+            admin = User.query.filter_by(role='admin').first()
+            _add_devices(admin, n)
+            _add_users(n)
+            script = Script(name=f"queued{n}", content="print(1)", device_id=queue_device_id)
+            db.session.add(script)
+            db.session.add_all(ScriptQueue(device_id=queue_device_id, script=script,
+                                           position=next(_ids)) for _ in range(n))
+            db.session.commit()
+        counts.append({path: _queries(client, query_counter, path, headers) for path in paths})
+
+    for path in paths:
+        assert counts[-1][path] <= MAX_LISTING_QUERIES, (path, counts)
+        assert counts[-1][path] <= counts[0][path], (path, counts)
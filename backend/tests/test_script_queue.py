@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+from itertools import count
+import pytest
+import device_manager
+from models import db, Device, DeviceType, Script, ScriptQueue, User
+
+_ids = count(1)
+
+
+@pytest.fixture
+def mac(app):
+    """Add a device with one script, returning its MAC."""
+    i = next(_ids)
+    with app.app_context():
+        owner = User(username=f"queue{i}", email=f"queue{i}@example.com")
+        owner.set_password('password')
+        device = Device(mac_address=f"02:00:00:01:00:{i:02X}", name=f"Queue {i}",
+                        device_type=DeviceType.LOCK, owner=owner)
+        db.session.add_all([owner, device,
+                            Script(name='run', content='print(1)', device=device)])
+        db.session.commit()
+        return device.mac_address
+
+
+def test_expired_lease_is_reclaimed(app, mac):
+    with app.test_request_context():
+        assert device_manager.enqueue_script(mac, 'run')
+        first = device_manager.claim_next_script(mac)
+        assert first is not None
+        # The device is still within its lease
+        assert device_manager.claim_next_script(mac) is None
+
+        expired = datetime.utcnow() - timedelta(seconds=app.config['SCRIPT_LEASE_SECONDS'] + 1)
+        ScriptQueue.query.filter_by(id=first['id']).update({'claimed_at': expired})
+        db.session.commit()
+
+        again = device_manager.claim_next_script(mac)
+        assert again['id'] == first['id']
+        assert device_manager.claim_next_script(mac) is None
+        assert device_manager.finish_script(mac, first['id'], True)
+
+
+def test_finished_items_are_pruned(app, mac):
+    retain = app.config['SCRIPT_QUEUE_RETAIN']
+    with app.test_request_context():
+        for _ in range(retain + 3):
+            assert device_manager.enqueue_script(mac, 'run')
+            item = device_manager.claim_next_script(mac)
+            assert device_manager.finish_script(mac, item['id'], True)
+
+        device_id = Device.query.filter_by(mac_address=mac).one().id
+        assert ScriptQueue.query.filter_by(device_id=device_id).count() == retain
+
+
+def test_queue_size_is_capped(app, mac):
+    with app.test_request_context():
+        for _ in range(app.config['MAX_QUEUE_SIZE']):
+            assert device_manager.enqueue_script(mac, 'run')
+        assert not device_manager.enqueue_script(mac, 'run')
+
+        device_manager.claim_next_script(mac)
+        # A running item still counts against the queue
+        assert not device_manager.enqueue_script(mac, 'run')
+
+
+def test_repeated_moves_keep_order(app, mac):
+    with app.test_request_context():
+        for _ in range(40):
+            assert device_manager.enqueue_script(mac, 'run')
+        device_id = Device.query.filter_by(mac_address=mac).one().id
+
+        def order():
+            return [item_id for item_id, in ScriptQueue.query.with_entities(ScriptQueue.id)
+                    .filter_by(device_id=device_id).order_by(ScriptQueue.position)]
+
+        ids = order()
+        target = ids[10]
+        # Moving the tail in front of the same item uses up the gap there
+        # many times over
+        moved = ids[:-31:-1]
+        for item_id in moved:
+            assert device_manager.move_queued_script(mac, item_id, target)
+
+        assert order() == ids[:10] + moved + ids[10:-30]
+
+
+def test_claim_updates_a_loaded_item(app, mac):
+    with app.test_request_context():
+        assert device_manager.enqueue_script(mac, 'run')
+        device_id = Device.query.filter_by(mac_address=mac).one().id
+        # Already in the session's identity map when the claim runs
+        loaded = ScriptQueue.query.filter_by(device_id=device_id).one()
+
+        item = device_manager.claim_next_script(mac)
+        assert item['status'] == 'running'
+        assert loaded.status == 'running'
+        assert loaded.claimed_at is not None
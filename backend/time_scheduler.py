@@ -0,0 +1,287 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+import pytz
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from models import db, Automation, Home
+from realtime import event_batcher
+from change_bus import change_bus
+from trigger_index import is_edit
+from solar import sun_event
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How far ahead to look for a sunrise/sunset before giving up (polar regions)
+MAX_SUN_SEARCH_DAYS = 370
+# Seconds to wait before retrying a reschedule that failed
+RESCHEDULE_RETRY_DELAY = 1
+
+
+def next_fire_time(trigger_data: Dict, after: datetime, timezone: str = 'UTC',
+                   latitude: Optional[float] = None, longitude: Optional[float] = None,
+                   last_run: Optional[datetime] = None) -> Optional[datetime]:
+    """Compute when a time trigger next fires.
+
+    Args:
+        trigger_data: Trigger with ``type`` exact, interval, sunrise or sunset
+        after: Naive UTC time; the result is strictly later
+        timezone: Home timezone that ``exact`` times are written in
+        latitude: Home latitude, needed for sunrise/sunset
+        longitude: Home longitude, needed for sunrise/sunset
+        last_run: Naive UTC time the trigger last fired, for intervals
+
+    Returns:
+        Optional[datetime]: Naive UTC fire time, or None if it never fires
+    """
+    trigger_type = trigger_data.get('type')
+    tz = pytz.timezone(timezone or 'UTC')
+    local_after = pytz.utc.localize(after).astimezone(tz)
+
+    if trigger_type == 'exact':
+        target = datetime.strptime(trigger_data['time'], '%H:%M').time()
+        day = local_after.date()
+        for _ in range(3):
+            candidate = tz.localize(datetime.combine(day, target))
+            candidate = candidate.astimezone(pytz.utc).replace(tzinfo=None)
+            if candidate > after:
+                return candidate
+            day += timedelta(days=1)
+        return None
+
+    elif trigger_type == 'interval':
+        interval = trigger_data.get('interval', 0)
+        if interval <= 0:
+            return None
+        if last_run is None:
+            return after + timedelta(seconds=interval)
+        # A missed run fires straight away rather than being skipped
+        return max(last_run + timedelta(seconds=interval), after + timedelta(microseconds=1))
+
+    elif trigger_type in ('sunrise', 'sunset'):
+        latitude = trigger_data.get('latitude', latitude)
+        longitude = trigger_data.get('longitude', longitude)
+        if latitude is None or longitude is None:
+            logger.warning(f"No location for {trigger_type} trigger")
+            return None
+
+        offset = timedelta(minutes=trigger_data.get('offset', 0))
+        day = local_after.date() - timedelta(days=1)
+        for _ in range(MAX_SUN_SEARCH_DAYS):
+            moment = sun_event(day, latitude, longitude,
+                               rising=trigger_type == 'sunrise')
+            if moment is not None and moment + offset > after:
+                return moment + offset
+            day += timedelta(days=1)
+        return None
+
+    return None
+
+
+class TimeTriggerScheduler:
+    """Fires time-based automations from a heap of next fire times.
+
+    One thread sleeps until the earliest trigger is due, so an idle system
+    does no work however many automations exist. Edits to automations are
+    picked up after their transaction commits.
+
+    Every worker process runs a scheduler; a fire is claimed by moving
+    ``last_triggered`` past the fire time in one conditional UPDATE, so
+    only the worker that wins the claim runs the actions.
+    """
+
+    def __init__(self, run_actions=None):
+        self._run_actions = run_actions
+        self._heap = []
+        # automation_id -> fire time of its live heap entry
+        self._next: Dict[int, datetime] = {}
+        self._dirty: Set[int] = set()
+        self._cv = threading.Condition()
+        self._app = None
+        self._thread: Optional[threading.Thread] = None
+
+    def init_app(self, app, run_actions=None) -> None:
+        """Load time automations and start the scheduler thread."""
+        self._app = app
+        if run_actions is not None:
+            self._run_actions = run_actions
+        with app.app_context():
+            self.load()
+        change_bus.subscribe('automations', self.mark_dirty)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='time-trigger-scheduler', daemon=True)
+            self._thread.start()
+
+    def load(self) -> None:
+        """Compute next fire times for all enabled time automations."""
+        now = datetime.utcnow()
+        rows = db.session.query(Automation, Home)\
+            .join(Home, Automation.home_id == Home.id)\
+            .filter(Automation.trigger_type == 'time',
+                    Automation.is_enabled.is_(True))\
+            .all()
+        with self._cv:
+            self._heap.clear()
+            self._next.clear()
+            for automation, home in rows:
+                self._push(automation.id,
+                           self._compute(automation, home, now))
+            self._cv.notify()
+        logger.info(f"Scheduled {len(self._next)} time automations")
+
+    def mark_dirty(self, automation_ids) -> None:
+        """Recompute the given automations on the scheduler thread."""
+        with self._cv:
+            self._dirty.update(automation_ids)
+            self._cv.notify()
+
+    def next_fire(self, automation_id: int) -> Optional[datetime]:
+        """Get the scheduled fire time of an automation, if any."""
+        with self._cv:
+            return self._next.get(automation_id)
+
+    def _compute(self, automation: Automation, home: Optional[Home],
+                 after: datetime) -> Optional[datetime]:
+        try:
+            return next_fire_time(
+                automation.trigger_data or {},
+                after,
+                timezone=home.timezone if home else 'UTC',
+                latitude=home.latitude if home else None,
+                longitude=home.longitude if home else None,
+                last_run=automation.last_triggered
+            )
+        except Exception as e:
+            logger.error(
+                f"Error scheduling automation {automation.id}: {str(e)}")
+            return None
+
+    def _push(self, automation_id: int, fire_at: Optional[datetime]):
+        # Older heap entries for the id are skipped when popped
+        if fire_at is None:
+            self._next.pop(automation_id, None)
+            return
+        self._next[automation_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, automation_id))
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._dirty:
+                    if self._heap:
+                        wait = (self._heap[0][0] -
+                                datetime.utcnow()).total_seconds()
+                        if wait <= 0:
+                            break
+                        self._cv.wait(wait)
+                    else:
+                        self._cv.wait()
+                dirty, self._dirty = self._dirty, set()
+                due = []
+                now = datetime.utcnow()
+                while self._heap and self._heap[0][0] <= now:
+                    fire_at, automation_id = heapq.heappop(self._heap)
+                    if self._next.get(automation_id) == fire_at:
+                        del self._next[automation_id]
+                        due.append((automation_id, fire_at))
+
+            # The due entries have left the heap; whatever happens to one
+            # fire, all of them and the dirty ids must be scheduled again
+            changed = dirty | {automation_id for automation_id, _ in due}
+            with self._app.app_context():
+                for automation_id, fire_at in due:
+                    try:
+                        self._fire(automation_id, fire_at)
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"Error firing time automation {automation_id}: {str(e)}")
+                try:
+                    self._reschedule(changed)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error rescheduling time automations: {str(e)}")
+                    with self._cv:
+                        self._dirty.update(changed)
+                    time.sleep(RESCHEDULE_RETRY_DELAY)
+
+    def _fire(self, automation_id: int, fire_at: datetime):
+        automation = db.session.get(Automation, automation_id)
+        if not automation or not automation.is_enabled or automation.trigger_type != 'time':
+            return
+        home_id, name, actions = automation.home_id, automation.name, automation.actions
+        if not self._claim(automation, fire_at):
+            logger.debug(f"Time automation {automation_id} fired by another worker")
+            return
+        if self._run_actions:
+            self._run_actions(actions)
+        event_batcher.publish_automation(automation_id, home_id, name)
+        logger.info(f"Time automation '{name}' triggered")
+
+    def _claim(self, automation: Automation, fire_at: datetime) -> bool:
+        """Record a fire unless another worker already recorded it."""
+        last_triggered = automation.last_triggered
+        if last_triggered is not None and last_triggered >= fire_at:
+            return False
+        unclaimed = Automation.last_triggered.is_(None) if last_triggered is None \
+            else Automation.last_triggered == last_triggered
+        claimed = db.session.query(Automation)\
+            .filter(Automation.id == automation.id, unclaimed)\
+            .update({Automation.last_triggered: max(datetime.utcnow(), fire_at)},
+                    synchronize_session='fetch')
+        db.session.commit()
+        return claimed == 1
+
+    def _reschedule(self, automation_ids: Set[int]):
+        if not automation_ids:
+            return
+        now = datetime.utcnow()
+        rows = db.session.query(Automation, Home)\
+            .outerjoin(Home, Automation.home_id == Home.id)\
+            .filter(Automation.id.in_(automation_ids)).all()
+        found = set()
+        with self._cv:
+            for automation, home in rows:
+                found.add(automation.id)
+                if automation.trigger_type == 'time' and automation.is_enabled:
+                    self._push(automation.id,
+                               self._compute(automation, home, now))
+                else:
+                    self._next.pop(automation.id, None)
+            for automation_id in automation_ids - found:
+                self._next.pop(automation_id, None)
+
+
+time_scheduler = TimeTriggerScheduler()
+
+
+@event.listens_for(Automation, 'after_insert')
+@event.listens_for(Automation, 'after_delete')
+def _track_automation_change(mapper, connection, automation):
+    session = object_session(automation)
+    if session is not None:
+        session.info.setdefault('changed_automations', set()).add(automation.id)
+
+
+@event.listens_for(Automation, 'after_update')
+def _track_automation_update(mapper, connection, automation):
+    # Condition automations record their fires through the ORM; that
+    # changes no schedule and other workers need not hear about it
+    if is_edit(automation):
+        _track_automation_change(mapper, connection, automation)
+
+
+@event.listens_for(Session, 'after_commit')
+def _reschedule_committed(session):
+    changed = session.info.pop('changed_automations', None)
+    if changed:
+        time_scheduler.mark_dirty(changed)
+        change_bus.publish('automations', list(changed))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('changed_automations', None)
@@ -0,0 +1,198 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from models import Automation
+from conditions import compile_condition
+from change_bus import change_bus, RESYNC
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns written when an automation fires rather than when it is edited
+FIRE_COLUMNS = frozenset(('last_triggered', 'updated_at'))
+
+
+class IndexedTrigger:
+    """Compiled, enabled condition automation held by the index."""
+
+    __slots__ = ('automation_id', 'home_id', 'condition', 'watches')
+
+    def __init__(self, automation: Automation):
+        self.automation_id = automation.id
+        self.home_id = automation.home_id
+        self.condition = compile_condition(automation.trigger_data or {})
+        self.watches = self.condition.watches
+
+
+def is_edit(automation: Automation) -> bool:
+    """Check whether a flushed update changed more than the fire bookkeeping."""
+    state = inspect(automation)
+    return any(state.attrs[attr.key].history.has_changes()
+               for attr in state.mapper.column_attrs if attr.key not in FIRE_COLUMNS)
+
+
+def indexed_trigger(automation: Automation) -> Optional[IndexedTrigger]:
+    """Compile an automation for the index, or None if it does not belong."""
+    if automation.trigger_type != 'condition' or not automation.is_enabled:
+        return None
+    try:
+        return IndexedTrigger(automation)
+    except ValueError as e:
+        logger.error(
+            f"Skipping automation {automation.id} with invalid trigger: {str(e)}")
+        return None
+
+
+class TriggerIndex:
+    """In-memory index of condition automations by the state keys they watch.
+
+    Conditions that name a ``device_id`` are indexed under
+    ``(device_id, key)``; the rest apply to every device in their home and
+    are indexed under ``(home_id, key)``. A state change then only looks at
+    automations watching the keys that actually changed. Conditions are
+    compiled when an automation is indexed, not on every event.
+
+    Each worker keeps its own index: local edits apply after commit, and
+    the time scheduler publishes committed automation ids on the change
+    bus, which other workers reload from the database.
+    """
+
+    def __init__(self):
+        self._triggers: Dict[int, IndexedTrigger] = {}
+        self._by_device: Dict[Tuple[int, str], Set[int]] = defaultdict(set)
+        self._by_home: Dict[Tuple[int, str], Set[int]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        """Index every condition automation and follow other workers' edits."""
+        with app.app_context():
+            self.load()
+        change_bus.subscribe('automations', self.reload)
+        change_bus.subscribe(RESYNC, self._resync)
+
+    def load(self) -> None:
+        """Rebuild the index from the database.
+
+        Must be called inside an application context.
+        """
+        automations = Automation.query.filter_by(
+            trigger_type='condition', is_enabled=True).all()
+        triggers = [indexed_trigger(automation) for automation in automations]
+        with self._lock:
+            self._triggers.clear()
+            self._by_device.clear()
+            self._by_home.clear()
+            for trigger in triggers:
+                if trigger is not None:
+                    self._add(trigger)
+        logger.info(f"Indexed {len(automations)} condition automations")
+
+    def reload(self, automation_ids: Iterable[int]) -> None:
+        """Re-index some automations from the database, dropping deleted ones.
+
+        Must be called inside an application context.
+        """
+        automation_ids = set(automation_ids)
+        automations = Automation.query.filter(Automation.id.in_(automation_ids)).all()
+        self.apply({automation_id: None for automation_id in automation_ids} |
+                   {automation.id: indexed_trigger(automation) for automation in automations})
+
+    def update(self, automation: Automation) -> None:
+        """Re-index a created or edited automation."""
+        self.apply({automation.id: indexed_trigger(automation)})
+
+    def remove(self, automation_id: int) -> None:
+        """Drop an automation from the index."""
+        self.apply({automation_id: None})
+
+    def apply(self, changes: Dict[int, Optional[IndexedTrigger]]) -> None:
+        """Store new triggers, or drop automations whose trigger is None."""
+        with self._lock:
+            for automation_id, trigger in changes.items():
+                self._remove(automation_id)
+                if trigger is not None:
+                    self._add(trigger)
+
+    def candidates(self, device_id: int, home_id: Optional[int],
+                   changed_keys: Iterable[str]) -> List[IndexedTrigger]:
+        """Get the triggers that watch any of the changed keys of a device."""
+        with self._lock:
+            ids = set()
+            for key in changed_keys:
+                ids |= self._by_device.get((device_id, key), set())
+                if home_id is not None:
+                    ids |= self._by_home.get((home_id, key), set())
+            return [self._triggers[automation_id] for automation_id in ids]
+
+    def __len__(self):
+        return len(self._triggers)
+
+    def _add(self, trigger: IndexedTrigger):
+        self._triggers[trigger.automation_id] = trigger
+        for watch in trigger.watches:
+            self._bucket(trigger, watch).add(trigger.automation_id)
+
+    def _remove(self, automation_id: int):
+        trigger = self._triggers.pop(automation_id, None)
+        if trigger is None:
+            return
+        for watch in trigger.watches:
+            index, key = self._bucket_key(trigger, watch)
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.discard(automation_id)
+                if not bucket:
+                    del index[key]
+
+    def _resync(self, _):
+        self.load()
+
+    def _bucket(self, trigger: IndexedTrigger, watch) -> Set[int]:
+        index, key = self._bucket_key(trigger, watch)
+        return index[key]
+
+    def _bucket_key(self, trigger: IndexedTrigger, watch):
+        device_id, state_key = watch
+        if device_id is not None:
+            return self._by_device, (device_id, state_key)
+        return self._by_home, (trigger.home_id, state_key)
+
+
+trigger_index = TriggerIndex()
+
+
+# Compiled at flush time while the row is loaded, applied once committed
+@event.listens_for(Automation, 'after_insert')
+def _track_automation_insert(mapper, connection, automation):
+    session = object_session(automation)
+    if session is not None:
+        session.info.setdefault('trigger_changes', {})[automation.id] = \
+            indexed_trigger(automation)
+
+
+@event.listens_for(Automation, 'after_update')
+def _track_automation_update(mapper, connection, automation):
+    # Recording a fire leaves the compiled condition as it was
+    if is_edit(automation):
+        _track_automation_insert(mapper, connection, automation)
+
+
+@event.listens_for(Automation, 'after_delete')
+def _track_automation_delete(mapper, connection, automation):
+    session = object_session(automation)
+    if session is not None:
+        session.info.setdefault('trigger_changes', {})[automation.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed(session):
+    changes = session.info.pop('trigger_changes', None)
+    if changes:
+        trigger_index.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('trigger_changes', None)
@@ -0,0 +1,7 @@
+import os
+from app import create_app
+
+# Entry point for gunicorn (wsgi:app). Every worker process builds its own
+# app; run more than one only with SOCKETIO_MESSAGE_QUEUE set, so socket
+# events reach clients connected to the other workers.
+app = create_app(os.getenv('FLASK_CONFIG', os.getenv('FLASK_ENV', 'default')))
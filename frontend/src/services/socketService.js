@@ -52,6 +52,14 @@ class SocketService {
   }
 
   setupDefaultHandlers() {
+    // Device events arrive batched, one frame per tick:
+    // { device_state_update: [...], device_status_update: [...], ping_received: [...] }
+    this.socket.on("device_updates", (frame) => {
+      Object.entries(frame).forEach(([event, payloads]) => {
+        payloads.forEach((data) => this.triggerEvent(event, data));
+      });
+    });
+
     // Device state updates
     this.socket.on("device_state_update", (data) => {
       this.triggerEvent("device_state_update", data);